@@ -0,0 +1,272 @@
+"""Throughput and peak memory of the report pipeline on synthetic data, written to JSON
+
+Times ``calculate_relative_report`` over status logs held in memory at every scale.
+With ``--duckdb`` the csv files are loaded into the embedded DuckDB backend and the
+whole report is generated from it, no database server needed. With ``--database``
+the data is also loaded into a scratch schema of the configured database, see DB_*
+in the environment, to time ingestion, ``generate_report_for_store`` and
+``generate_report_for_all_stores`` with the configured REPORT_ENGINE. Compare a run
+against an earlier one with ``--compare``. Run from the project root with
+``python -m benchmarks.report_pipeline --scales 100,1000 --database``
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import SyntheticData, add_arguments, from_arguments
+
+SCHEMA = 'stor_benchmark'
+
+
+def measure(
+        benchmark: str,
+        stores: int,
+        rows: int,
+        run: Callable[[], object],
+        repeat: int,
+        setup: Optional[Callable[[], object]] = None,
+        trace_memory: bool = True
+) -> Dict:
+    """Best time of repeat runs, then one more run under tracemalloc for the peak python memory
+
+    tracemalloc slows python down, so it is left out of the timed runs. Memory of
+    worker processes and of the database is not counted.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    peak = None
+    if trace_memory:
+        if setup:
+            setup()
+        gc.collect()
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    result = {
+        'benchmark': benchmark,
+        'stores': stores,
+        'rows': rows,
+        'seconds': seconds,
+        'stores_per_second': stores / seconds if seconds else None,
+        'rows_per_second': rows / seconds if seconds else None,
+        'peak_memory_bytes': peak,
+    }
+    print(
+        f"{benchmark:<32} {stores:>8} stores {seconds:9.3f}s {result['stores_per_second']:12.1f} stores/s "
+        f"{result['rows_per_second']:14.1f} rows/s"
+        + (f" peak {peak / 2 ** 20:8.1f} MiB" if peak is not None else "")
+    )
+    return result
+
+
+def bench_relative_report(data: SyntheticData, repeat: int) -> Dict:
+    from stor.db.functions import default_store_hours
+    from stor.report import calculate_relative_report
+
+    status_logs = []
+    for store, status_log in data.status_logs():
+        store_hours = default_store_hours()
+        store_hours.update(store.store_hours)
+        status_logs.append((status_log, store_hours))
+    rows = sum(len(status_log) for status_log, _ in status_logs)
+    start_time = data.end_time - datetime.timedelta(days=7)
+
+    def run():
+        for status_log, store_hours in status_logs:
+            calculate_relative_report(status_log, store_hours, start_time, data.end_time)
+
+    return measure('calculate_relative_report', len(status_logs), rows, run, repeat)
+
+
+def bench_duckdb(data: SyntheticData, repeat: int, work_dir: Path) -> List[Dict]:
+    import csv
+    from stor.db.backend import DuckDBBackend, load_duckdb
+    from stor.report import write_report_rows_backend
+
+    data_dir = work_dir / 'csv'
+    rows = data.write_csvs(data_dir)
+    results = [measure('load_duckdb', len(data.stores), rows, lambda: load_duckdb(data_dir), repeat)]
+
+    backend = DuckDBBackend(load_duckdb(data_dir))
+    end_time = backend.get_max_timestamp()
+
+    def run():
+        with open(work_dir / 'report.csv', 'w') as f:
+            write_report_rows_backend(backend, csv.writer(f), end_time)
+
+    results.append(measure('write_report_rows_backend[duckdb]', len(data.stores), rows, run, repeat))
+    return results
+
+
+def recreate_schema():
+    from stor.db import pooled_connection
+
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+            cur.execute(f"CREATE SCHEMA {SCHEMA};")
+
+
+def load_database(data_dir: Path):
+    """Create the tables in the scratch schema and ingest the cleaned csv files like populate_db"""
+    from stor.db import (
+        init_db,
+        pooled_connection,
+        populate_menu_hours_table,
+        populate_settings_table,
+        populate_store_status,
+        populate_time_zone_table
+    )
+    from stor.db.rollup import refresh_store_status_hourly
+
+    with pooled_connection() as conn:
+        init_db(conn)
+        populate_settings_table(conn)
+        populate_store_status(conn, data_dir / 'store_status_clean.csv')
+        populate_time_zone_table(conn, data_dir / 'time_zone_info_clean.csv')
+        populate_menu_hours_table(conn, data_dir / 'menu_hours_clean.csv')
+        refresh_store_status_hourly(conn)
+
+
+def bench_database(data: SyntheticData, repeat: int, sample_stores: int, work_dir: Path) -> List[Dict]:
+    from stor import config
+    from stor.db import pooled_connection
+    from stor.db.functions import get_max_timestamp
+    from stor.report import generate_report_for_all_stores, generate_report_for_store
+
+    data_dir = work_dir / 'csv'
+    rows = data.write_csvs(data_dir)
+    results = [measure(
+        'ingest', len(data.stores), rows, lambda: load_database(data_dir), 1, setup=recreate_schema
+    )]
+
+    store_rows = {}
+    for store in data.stores:
+        store_rows[store.store_id] = sum(1 for _ in data.statuses(store))
+    sample = [store.store_id for store in data.stores[::max(1, len(data.stores) // sample_stores)][:sample_stores]]
+
+    def run_stores():
+        with pooled_connection() as conn:
+            end_time = get_max_timestamp(conn)
+            for store_id in sample:
+                generate_report_for_store(conn, store_id, end_time)
+
+    results.append(measure(
+        'generate_report_for_store', len(sample), sum(store_rows[store_id] for store_id in sample), run_stores, repeat
+    ))
+
+    config.REPORT_CACHE_DIR = work_dir / 'report_cache'
+    config.REPORT_CACHE_DIR.mkdir(exist_ok=True)
+    report_id = uuid.uuid4()
+
+    def remove_report():
+        for file in config.REPORT_CACHE_DIR.glob(f'{report_id}*'):
+            file.unlink()
+
+    results.append(measure(
+        f'generate_report_for_all_stores[{config.REPORT_ENGINE}]',
+        len(data.stores),
+        rows,
+        lambda: generate_report_for_all_stores(report_id),
+        repeat,
+        setup=remove_report
+    ))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline_file: Path, threshold: float):
+    """Print the throughput change of every benchmark also in baseline_file"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    previous = {(result['benchmark'], result['stores']): result for result in baseline['results']}
+    print(f"Compared to {baseline_file} ({baseline.get('commit')}):")
+    for result in results:
+        before = previous.get((result['benchmark'], result['stores']))
+        if not before or not before['stores_per_second'] or not result['stores_per_second']:
+            continue
+        change = result['stores_per_second'] / before['stores_per_second'] - 1
+        flag = '  REGRESSION' if change < -threshold else ''
+        print(f"{result['benchmark']:<32} {result['stores']:>8} stores {change:+8.1%}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='100,1000,5000', help="store counts to run at, comma separated")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--duckdb', action='store_true', help="also run against the embedded DuckDB backend")
+    parser.add_argument('--database', action='store_true', help=f"also run against schema {SCHEMA}, dropped first")
+    parser.add_argument('--sample-stores', type=int, default=100)
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    parser.add_argument('--compare', type=Path, help="earlier results to compare throughput with")
+    parser.add_argument('--regression-threshold', type=float, default=0.1)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.database:
+        # every connection, of worker processes too, works in the scratch schema
+        os.environ['PGOPTIONS'] = f"{os.environ.get('PGOPTIONS', '')} -c search_path={SCHEMA},public".strip()
+    from stor import config
+
+    results = []
+    for store_count in [int(scale) for scale in args.scales.split(',')]:
+        data = from_arguments(args, store_count)
+        results.append(bench_relative_report(data, args.repeat))
+        if args.duckdb:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results.extend(bench_duckdb(data, args.repeat, Path(work_dir)))
+        if args.database:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results.extend(bench_database(data, args.repeat, args.sample_stores, Path(work_dir)))
+
+    report = {
+        'commit': git_commit(),
+        'created_utc': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'report_engine': config.REPORT_ENGINE,
+            'report_workers': config.REPORT_WORKERS,
+            'ingest_workers': config.INGEST_WORKERS,
+            'days': args.days,
+            'poll_minutes': args.poll_minutes,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        compare(results, args.compare, args.regression_threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Memory per row of the status log representations
+
+Run from the project root with ``python -m benchmarks.status_log_memory``
+"""
+import argparse
+import datetime
+import gc
+import random
+import time
+import tracemalloc
+
+from stor.report import StatusLogRow
+from stor.status_log import StoreStatusLog
+
+
+def generate_rows(row_count: int, seed: int = 0):
+    """Rows shaped like get_store_status_log results, polled roughly every hour"""
+    rng = random.Random(seed)
+    timestamp = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    rows = []
+    for _ in range(row_count):
+        timestamp += datetime.timedelta(seconds=rng.randint(1800, 5400), microseconds=rng.randint(0, 999999))
+        rows.append((1, rng.random() < 0.9, timestamp, timestamp))
+    return rows
+
+
+def measure(build):
+    """Returns bytes allocated by build and the seconds it took"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return allocated, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--timezone', default='America/Chicago')
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+
+    def build_status_log_with_arrays():
+        status_log = StoreStatusLog.from_rows(1, args.timezone, rows)
+        return status_log, status_log.to_arrays()
+
+    results = {
+        'StatusLogRow list': measure(lambda: [
+            StatusLogRow(store_id, status, timestamp_utc, timestamp_local, args.timezone)
+            for store_id, status, timestamp_utc, timestamp_local in rows
+        ]),
+        'StoreStatusLog': measure(lambda: StoreStatusLog.from_rows(1, args.timezone, rows)),
+        'StoreStatusLog + arrays': measure(build_status_log_with_arrays),
+    }
+    print(f"{args.rows} rows, timezone {args.timezone}")
+    for name, (allocated, elapsed) in results.items():
+        print(f"{name:<25} {allocated / args.rows:8.1f} bytes/row {elapsed * 1000:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Throughput of store_status ingestion, download then clean then read back, against streaming
+
+Serves a generated store_status.csv from a local aiohttp server and feeds both paths to
+a COPY stand-in that reads the file-like object like ``copy_expert`` does, so only
+download, cleaning and plumbing are measured. Run from the project root with
+``python -m benchmarks.streaming_ingestion``
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from stor.data.stream import open_store_status_stream
+
+COPY_READ_SIZE = 8192
+
+
+def generate_csv(row_count: int, seed: int = 0) -> bytes:
+    """store_status.csv shaped rows"""
+    rng = random.Random(seed)
+    lines = ['store_id,status,timestamp_utc']
+    for _ in range(row_count):
+        lines.append(
+            f"{rng.randint(10 ** 18, 10 ** 19)},{'active' if rng.random() < 0.9 else 'inactive'},"
+            f"2023-01-{rng.randint(18, 25)} {rng.randint(0, 23):02}:{rng.randint(0, 59):02}:"
+            f"{rng.randint(0, 59):02}.{rng.randint(0, 999999):06} UTC"
+        )
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def serve(body: bytes) -> str:
+    """Serve body on a local port from a background thread, returns its url"""
+    started = threading.Event()
+    address = {}
+
+    async def handler(request):
+        # written in pieces, so the server does not hold a copy of body in its send buffer
+        response = web.StreamResponse(headers={'Content-Type': 'text/csv'})
+        response.content_length = len(body)
+        await response.prepare(request)
+        for start in range(0, len(body), 64 * 1024):
+            await response.write(body[start:start + 64 * 1024])
+        await response.write_eof()
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/store_status.csv', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        address['url'] = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/store_status.csv"
+        started.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(run()), daemon=True).start()
+    started.wait()
+    return address['url']
+
+
+def copy_stand_in(file) -> int:
+    """Read file to the end in COPY sized reads, returns bytes read"""
+    total = 0
+    while chunk := file.read(COPY_READ_SIZE):
+        total += len(chunk)
+    return total
+
+
+def three_step(url: str, directory: Path) -> int:
+    """download_file, clean_store_status_csv and the COPY read, as ingestion does without streaming"""
+    async def download():
+        async with aiohttp.ClientSession() as session:
+            response = await session.get(url)
+            with open(directory / 'store_status.csv', 'w') as f:
+                f.write(await response.text())
+
+    asyncio.run(download())
+    with open(directory / 'store_status.csv', 'r') as main_file, \
+            open(directory / 'store_status_clean.csv', 'w') as clean_file:
+        for line in main_file:
+            clean_file.write(line.replace('inactive', '0').replace('active', '1'))
+    with open(directory / 'store_status_clean.csv', 'r') as f:
+        return copy_stand_in(f)
+
+
+def streaming(url: str, directory: Path) -> int:
+    with open_store_status_stream(url) as f:
+        return copy_stand_in(f)
+
+
+def measure(path, url: str, body_size: int):
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        start = time.perf_counter()
+        copied = path(url, Path(directory))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        on_disk = sum(file.stat().st_size for file in Path(directory).iterdir())
+    print(
+        f"{path.__name__:>10}: {elapsed:.3f}s {body_size / elapsed / 2 ** 20:8.1f} MiB/s "
+        f"peak python memory {peak / 2 ** 20:7.1f} MiB, on disk {on_disk / 2 ** 20:7.1f} MiB, copied {copied} bytes"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    body = generate_csv(args.rows)
+    url = serve(body)
+    print(f"{args.rows} rows, {len(body) / 2 ** 20:.1f} MiB")
+    for _ in range(args.repeat):
+        for path in (three_step, streaming):
+            measure(path, url, len(body))
+
+
+if __name__ == '__main__':
+    main()
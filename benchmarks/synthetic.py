@@ -0,0 +1,209 @@
+"""Deterministic synthetic store_status, menu_hours and time_zone data
+
+Stores are generated one after another from their own random stream, so the first
+stores of a larger data set are the same as those of a smaller one with the same seed.
+Write the csv files the app downloads, and their cleaned versions, with
+``python -m benchmarks.synthetic --stores 1000 --out stor/data/csv``
+"""
+import argparse
+import datetime
+import random
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from stor.status_log import StoreStatusLog
+
+DEFAULT_TIMEZONE_MIX = 'America/Chicago=0.5,America/New_York=0.25,America/Denver=0.1,America/Los_Angeles=0.15'
+DEFAULT_HOURS_MIX = '24x7=0.2,business=0.5,weekdays=0.2,overnight=0.1'
+DEFAULT_END_TIME = datetime.datetime(2023, 1, 25, 18, tzinfo=datetime.timezone.utc)
+
+# day of week: (start_time_local, end_time_local), days left out are open all day
+HOURS_PATTERNS = {
+    '24x7': {},
+    'business': {day: (datetime.time(9), datetime.time(17)) for day in range(7)},
+    'weekdays': {
+        **{day: (datetime.time(8), datetime.time(20)) for day in range(5)},
+        **{day: (datetime.time(11), datetime.time(15)) for day in range(5, 7)},
+    },
+    # ends before it starts, as some stores of the real data do
+    'overnight': {day: (datetime.time(18), datetime.time(2)) for day in range(7)},
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse ``name=weight,name=weight`` into a dict"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.strip().partition('=')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class SyntheticStore:
+    """One generated store, its status log is generated on demand"""
+
+    def __init__(
+            self,
+            store_id: int,
+            timezone: Optional[str],
+            store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
+            seed: int
+    ):
+        self.store_id = store_id
+        # None leaves the store out of time_zone, the app falls back to America/Chicago
+        self.timezone = timezone
+        self.store_hours = store_hours
+        self.seed = seed
+
+    def statuses(
+            self,
+            start_time: datetime.datetime,
+            end_time: datetime.datetime,
+            poll_minutes: float,
+            outage_rate: float
+    ) -> Iterator[Tuple[bool, datetime.datetime]]:
+        """Polls about every poll_minutes between start_time and end_time
+
+        A store goes down with probability outage_rate at every poll, and comes back up
+        at every later poll with probability 0.5.
+        """
+        rng = random.Random(self.seed)
+        is_open = True
+        timestamp = start_time + datetime.timedelta(minutes=rng.uniform(0, poll_minutes))
+        while timestamp <= end_time:
+            if is_open:
+                is_open = rng.random() >= outage_rate
+            else:
+                is_open = rng.random() < 0.5
+            yield is_open, timestamp
+            timestamp += datetime.timedelta(
+                minutes=poll_minutes * rng.uniform(0.5, 1.5),
+                microseconds=rng.randrange(1_000_000)
+            )
+
+
+class SyntheticData:
+    """Generated stores with their polls over days ending at end_time"""
+
+    def __init__(
+            self,
+            store_count: int,
+            days: float = 7,
+            poll_minutes: float = 60,
+            outage_rate: float = 0.1,
+            timezone_mix: str = DEFAULT_TIMEZONE_MIX,
+            hours_mix: str = DEFAULT_HOURS_MIX,
+            missing_timezone_rate: float = 0.05,
+            end_time: datetime.datetime = DEFAULT_END_TIME,
+            seed: int = 0
+    ):
+        self.days = days
+        self.poll_minutes = poll_minutes
+        self.outage_rate = outage_rate
+        self.end_time = end_time
+        self.start_time = end_time - datetime.timedelta(days=days)
+
+        timezones = parse_mix(timezone_mix)
+        hours = parse_mix(hours_mix)
+        rng = random.Random(seed)
+        store_ids = set()
+        self.stores: List[SyntheticStore] = []
+        for _ in range(store_count):
+            store_id = rng.randrange(10 ** 18, 9 * 10 ** 18)
+            while store_id in store_ids:
+                store_id = rng.randrange(10 ** 18, 9 * 10 ** 18)
+            store_ids.add(store_id)
+            timezone = rng.choices(list(timezones), weights=list(timezones.values()))[0]
+            if rng.random() < missing_timezone_rate:
+                timezone = None
+            hours_pattern = rng.choices(list(hours), weights=list(hours.values()))[0]
+            self.stores.append(SyntheticStore(store_id, timezone, HOURS_PATTERNS[hours_pattern], rng.getrandbits(64)))
+
+    def statuses(self, store: SyntheticStore) -> Iterator[Tuple[bool, datetime.datetime]]:
+        return store.statuses(self.start_time, self.end_time, self.poll_minutes, self.outage_rate)
+
+    def status_logs(self) -> Iterator[Tuple[SyntheticStore, StoreStatusLog]]:
+        """Status log of every store, one store at a time"""
+        for store in self.stores:
+            status_log = StoreStatusLog(store.store_id, store.timezone or 'America/Chicago')
+            for is_open, timestamp_utc in self.statuses(store):
+                status_log.append(is_open, timestamp_utc)
+            yield store, status_log
+
+    def write_store_status(self, file: Path, clean: bool = False) -> int:
+        """Write store_status csv, with 1 and 0 for statuses if clean, returns rows written"""
+        active, inactive = ('1', '0') if clean else ('active', 'inactive')
+        row_count = 0
+        with open(file, 'w') as f:
+            f.write('store_id,status,timestamp_utc\n')
+            for store in self.stores:
+                for is_open, timestamp_utc in self.statuses(store):
+                    f.write(
+                        f"{store.store_id},{active if is_open else inactive},"
+                        f"{timestamp_utc.strftime('%Y-%m-%d %H:%M:%S.%f')} UTC\n"
+                    )
+                    row_count += 1
+        return row_count
+
+    def write_menu_hours(self, file: Path):
+        with open(file, 'w') as f:
+            f.write('store_id,day,start_time_local,end_time_local\n')
+            for store in self.stores:
+                for day, (start_time_local, end_time_local) in sorted(store.store_hours.items()):
+                    f.write(f"{store.store_id},{day},{start_time_local},{end_time_local}\n")
+
+    def write_time_zones(self, file: Path):
+        with open(file, 'w') as f:
+            f.write('store_id,timezone_str\n')
+            for store in self.stores:
+                if store.timezone is not None:
+                    f.write(f"{store.store_id},{store.timezone}\n")
+
+    def write_csvs(self, directory: Path) -> int:
+        """Write the csv files as downloaded and as cleaned by clean_csv_files, returns store_status rows"""
+        directory.mkdir(parents=True, exist_ok=True)
+        row_count = self.write_store_status(directory / 'store_status.csv')
+        self.write_store_status(directory / 'store_status_clean.csv', clean=True)
+        for name, write in (('menu_hours', self.write_menu_hours), ('time_zone_info', self.write_time_zones)):
+            write(directory / f'{name}.csv')
+            write(directory / f'{name}_clean.csv')
+        return row_count
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Options of the generated data, shared with the benchmarks"""
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--poll-minutes', type=float, default=60)
+    parser.add_argument('--outage-rate', type=float, default=0.1)
+    parser.add_argument('--timezone-mix', default=DEFAULT_TIMEZONE_MIX)
+    parser.add_argument('--hours-mix', default=DEFAULT_HOURS_MIX)
+    parser.add_argument('--missing-timezone-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args: argparse.Namespace, store_count: int) -> SyntheticData:
+    return SyntheticData(
+        store_count,
+        days=args.days,
+        poll_minutes=args.poll_minutes,
+        outage_rate=args.outage_rate,
+        timezone_mix=args.timezone_mix,
+        hours_mix=args.hours_mix,
+        missing_timezone_rate=args.missing_timezone_rate,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stores', type=int, default=1000)
+    parser.add_argument('--out', type=Path, required=True)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    row_count = from_arguments(args, args.stores).write_csvs(args.out)
+    print(f"Wrote {args.stores} stores and {row_count} statuses to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
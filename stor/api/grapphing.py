@@ -1,70 +1,132 @@
-from typing import Dict
-import csv
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import random
+import threading
+
+import numpy as np
 from bokeh.embed import components
-from bokeh.plotting import figure, curdoc
+from bokeh.plotting import figure
 from bokeh.resources import INLINE
 from bokeh.models import ColumnDataSource
-from random import choices
+from bokeh.themes import built_in_themes
 
 from fastapi import Request, BackgroundTasks
-import numpy as np
 
 from .. import config
 
 from ..report import generate_total_report
 
+CLAMP_MAX = 50
+RANDOM_SECTION_SIZE = 25
 
-def get_graph(background_tasks: BackgroundTasks):
 
-    total_report_file = config.REPORT_CACHE_DIR / 'total_report.csv'
-    if not total_report_file.exists():
-        if not config.GENERATING_REPORTS:
-            background_tasks.add_task(generate_total_report)
-            config.GENERATING_REPORTS = True
-
-    if config.GENERATING_REPORTS:
-        p = figure(
-            title="Generating report...",
-            x_axis_label="x",
-            y_axis_label="y"
+class TotalReportData:
+    """total_report.csv as arrays, with uptime and downtime already scaled for the graph"""
+
+    def __init__(self, store_ids: np.ndarray, uptime: np.ndarray, downtime: np.ndarray):
+        self.store_ids = store_ids
+        self.uptime = uptime
+        self.downtime = downtime
+        # scaled against a range that always includes 0, as the graph always did
+        self.uptime_scaled = np.interp(uptime, (min(uptime.min(initial=0), 0), uptime.max(initial=0)), (0, CLAMP_MAX))
+        self.downtime_scaled = np.interp(
+            downtime, (min(downtime.min(initial=0), 0), downtime.max(initial=0)), (0, -CLAMP_MAX)
+        )
+
+    @classmethod
+    def read(cls, total_report_file) -> 'TotalReportData':
+        columns = np.loadtxt(
+            total_report_file,
+            delimiter=',',
+            skiprows=1,
+            dtype=[('store_id', np.int64), ('uptime', np.float64), ('downtime', np.float64)],
+            ndmin=1
         )
-        return p
-
-    stores = []
-    uptime_min, uptime_max = 0, 0
-    downtime_min, downtime_max = 0, 0
-    CLAMP_MAX = 50
-    RANDOM_SECTION_SIZE = 25
-
-    with open(total_report_file, 'r') as f:
-        reader = csv.reader(f)
-        for index, row in enumerate(reader):
-            if index == 0:
-                continue
-            store_id = str(row[0])
-            uptime, downtime = float(row[1]), float(row[2])
-            uptime_max = max(uptime_max, uptime)
-            uptime_min = min(uptime_min, uptime)
-            downtime_max = max(downtime_max, downtime)
-            downtime_min = min(downtime_min, downtime)
-            stores.append((store_id, uptime, downtime))
-
-    stores = choices(stores, k=RANDOM_SECTION_SIZE)
-
-    store_uptime = [store[1] for store in stores]
-    store_downtime = [store[2] for store in stores]
-    stores = [store[0] for store in stores]
-
-    store_uptime = np.interp(store_uptime, (uptime_min, uptime_max), (0, CLAMP_MAX))
-    store_downtime = np.interp(store_downtime, (downtime_min, downtime_max), (0, -CLAMP_MAX))
+        return cls(columns['store_id'], columns['uptime'], columns['downtime'])
+
+    def __len__(self) -> int:
+        return self.store_ids.size
+
+    def sample(self, seed: int) -> Dict[str, list]:
+        """Scaled uptime and downtime of RANDOM_SECTION_SIZE stores picked by seed"""
+        rng = np.random.default_rng(seed)
+        # without replacement, a store twice would be a duplicate factor of the y range
+        picked = rng.choice(len(self), size=min(RANDOM_SECTION_SIZE, len(self)), replace=False)
+        return {
+            'stores': [str(store_id) for store_id in self.store_ids[picked].tolist()],
+            'uptime': self.uptime_scaled[picked].tolist(),
+            'downtime': self.downtime_scaled[picked].tolist(),
+        }
+
+
+_total_report: Optional[Tuple[Tuple[int, int], TotalReportData]] = None
+_total_report_lock = threading.Lock()
+
+
+def get_total_report_data() -> Optional[Tuple[Tuple[int, int], TotalReportData]]:
+    """Version of total_report.csv and its data, read again only when the file changed
 
+    The version is the modification time and size of the file, None if there is no file.
+    """
+    global _total_report
+    total_report_file = config.REPORT_CACHE_DIR / 'total_report.csv'
+    try:
+        stat = total_report_file.stat()
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _total_report_lock:
+        if _total_report is None or _total_report[0] != version:
+            _total_report = (version, TotalReportData.read(total_report_file))
+        return _total_report
+
+
+def start_total_report(background_tasks: BackgroundTasks) -> bool:
+    """Start generating total_report.csv if there is none, returns whether it is being generated"""
+    if not (config.REPORT_CACHE_DIR / 'total_report.csv').exists() and not config.GENERATING_REPORTS:
+        background_tasks.add_task(generate_total_report)
+        config.GENERATING_REPORTS = True
+    return config.GENERATING_REPORTS
+
+
+def sample_seed(seed: Optional[int]) -> int:
+    """seed, or one of DASHBOARD_SAMPLE_SEEDS seeds at random, so rendered graphs are reused"""
+    if seed is None:
+        return random.randrange(config.DASHBOARD_SAMPLE_SEEDS)
+    return seed
+
+
+def get_graph_data(background_tasks: BackgroundTasks, seed: Optional[int] = None) -> Dict:
+    """Sample of the total report for the dashboard to redraw the graph with"""
+    # a report removed after the check is generating again too
+    total_report = None if start_total_report(background_tasks) else get_total_report_data()
+    if total_report is None:
+        return {'status': 'generating'}
+    _, data = total_report
+    # sampling alone is cheap, any seed will do
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    return {'status': 'ready', 'seed': seed, **data.sample(seed)}
+
+
+def get_generating_graph():
+    return figure(
+        title="Generating report...",
+        x_axis_label="x",
+        y_axis_label="y"
+    )
+
+
+def get_graph(data: TotalReportData, seed: int):
+    sample = data.sample(seed)
+    stores = sample['stores']
     uptime = {
         'stores': stores,
-        'uptime': store_uptime,
+        'uptime': sample['uptime'],
     }
     downtime = {
         'stores': stores,
-        'downtime': store_downtime,
+        'downtime': sample['downtime'],
     }
     p = figure(
         y_range=stores,
@@ -75,12 +137,13 @@ def get_graph(background_tasks: BackgroundTasks):
         x_range=(-CLAMP_MAX*1.5, CLAMP_MAX*1.5)
     )
 
+    # named so the page can swap in new samples from /dashboard/data
     p.hbar_stack(
         ["uptime"],
         y='stores',
         height=0.1,
         color=["#18ba20"],
-        source=ColumnDataSource(data=uptime),
+        source=ColumnDataSource(data=uptime, name='uptime_source'),
         legend_label="Uptime"
     )
     p.hbar_stack(
@@ -88,10 +151,11 @@ def get_graph(background_tasks: BackgroundTasks):
         y='stores',
         height=0.1,
         color=["#c93810"],
-        source=ColumnDataSource(data=downtime),
+        source=ColumnDataSource(data=downtime, name='downtime_source'),
         legend_label="Downtime"
     )
 
+    p.y_range.name = 'stores_range'
     p.y_range.range_padding = 0.1
     p.ygrid.grid_line_color = None
     p.axis.minor_tick_line_color = None
@@ -102,15 +166,50 @@ def get_graph(background_tasks: BackgroundTasks):
     return p
 
 
-def get_graph_template_options_dict(request: Request, background_tasks) -> Dict:
-    js_resources = INLINE.render_js()
-    css_resources = INLINE.render_css()
+def render_components(graph) -> Tuple[str, str]:
+    return components(graph, theme=built_in_themes['dark_minimal'])
+
+
+@lru_cache(maxsize=None)
+def get_resources() -> Tuple[str, str]:
+    """Inline bokeh js and css, the same for every page"""
+    return INLINE.render_js(), INLINE.render_css()
+
+
+GRAPH_COMPONENTS_CACHE_SIZE = 64
+_graph_components: Dict[int, Tuple[str, str]] = {}
+_graph_components_version: Optional[Tuple[int, int]] = None
+_graph_components_lock = threading.Lock()
+
+
+def get_graph_components(version: Tuple[int, int], data: TotalReportData, seed: int) -> Tuple[str, str]:
+    """Rendered graph of a sample of data, the data of version of total_report.csv, per seed
+
+    Graphs of older versions are dropped once a newer version is rendered.
+    """
+    global _graph_components_version
+    with _graph_components_lock:
+        if version != _graph_components_version:
+            _graph_components.clear()
+            _graph_components_version = version
+        if seed in _graph_components:
+            return _graph_components[seed]
+    rendered = render_components(get_graph(data, seed))
+    with _graph_components_lock:
+        if version == _graph_components_version and len(_graph_components) < GRAPH_COMPONENTS_CACHE_SIZE:
+            _graph_components[seed] = rendered
+    return rendered
+
 
-    graph = get_graph(background_tasks)
-    curdoc().theme = 'dark_minimal'
-    curdoc().add_root(graph)
+def get_graph_template_options_dict(request: Request, background_tasks, seed: Optional[int] = None) -> Dict:
+    js_resources, css_resources = get_resources()
 
-    script, div = components(graph, INLINE)
+    total_report = None if start_total_report(background_tasks) else get_total_report_data()
+    if total_report is None:
+        script, div = render_components(get_generating_graph())
+    else:
+        version, data = total_report
+        script, div = get_graph_components(version, data, sample_seed(seed))
 
     return {
             "request": request,
@@ -1,118 +1,308 @@
+import asyncio
 import uuid
+from pathlib import Path
+from typing import AsyncIterator, Optional
 
-from fastapi import FastAPI, BackgroundTasks, Request
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, BackgroundTasks, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from loguru import logger
 from fastapi_utils.tasks import repeat_every
 
 from datetime import datetime, timezone
 
-from ..db import create_connection, populate_db, get_settings
-from ..report import generate_report_for_all_stores, generate_total_report
+from ..db import PoolTimeout, pooled_connection, get_pool, populate_db
+from ..db.aio import (
+    async_pool_metrics,
+    async_pooled_connection,
+    close_async_pool,
+    fetch_data_version,
+    fetch_ingestion_generation,
+    fetch_max_timestamp
+)
+from ..db.backend import get_backend_data_version
+from ..report_cache import (
+    evict_report_cache,
+    metrics as report_cache_metrics,
+    reconcile_report_cache,
+    report_cache_usage,
+    store_reports
+)
+from ..report import (
+    REPORT_FORMATS,
+    generate_report_for_all_stores,
+    generate_store_report_milliseconds,
+    generate_total_report,
+    report_path
+)
+from .. import config
 from ..config import REPORT_CACHE_DIR, DEBUG, PROJECT_DIR
+from ..data.clean_data import clean_csv_files
 from ..data.get_data import get_csv_files, check_csv_exists
-from .grapphing import get_graph_template_options_dict
+from .grapphing import get_graph_data, get_graph_template_options_dict
 app = FastAPI()
 templates = Jinja2Templates(directory=PROJECT_DIR / "api" / "templates")
 
 
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"status": "Database busy, try again"})
+
+
 @app.get("/")
-def index(request: Request, background_tasks: BackgroundTasks):
+def index(request: Request, background_tasks: BackgroundTasks, seed: Optional[int] = None):
 
     return templates.TemplateResponse(
-        "bokeh.html", get_graph_template_options_dict(request, background_tasks)
+        "bokeh.html", get_graph_template_options_dict(request, background_tasks, seed)
     )
 
 
-@app.get("/trigger_report")
-def trigger_report(background_tasks: BackgroundTasks):
-    with create_connection() as conn:
-        # check if there is a report is already being generated
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT * FROM report_cache
-                WHERE generating = true;
-                """
-            )
-            if report := cur.fetchone():
-                return {"report_id": report[0]}
+@app.get("/dashboard/data")
+def dashboard_data(background_tasks: BackgroundTasks, seed: Optional[int] = None):
+    return get_graph_data(background_tasks, seed)
 
-            # check if generate_new_report if true
-            if get_settings(conn, "generate_new_report") == ['false']:
-                # return the latest report
-                cur.execute(
-                    """
-                    SELECT * FROM report_cache
-                    ORDER BY start_timestamp_utc DESC
-                    LIMIT 1;
-                    """
-                )
-                if report := cur.fetchone():
-                    return {"report_id": report[0]}
 
-            report_id = uuid.uuid4()
-            cur.execute(
+@app.on_event("shutdown")
+async def close_database_pools():
+    await close_async_pool()
+
+
+@app.get("/trigger_report")
+async def trigger_report(background_tasks: BackgroundTasks):
+    async with async_pooled_connection() as conn:
+        # a report of the current data version, generated or being generated, is handed out as is
+        if config.STORAGE_BACKEND == 'postgres':
+            max_timestamp, generation = await fetch_data_version(conn)
+        else:
+            # the version of the data the report will be computed from, not of the ingested tables
+            max_timestamp, generation = await run_in_threadpool(get_backend_data_version)
+        if max_timestamp is None:
+            # without a status there is nothing to report, and a NULL version never conflicts
+            return JSONResponse(status_code=404, content={"status": "No Data"})
+        report_id = await conn.fetchval(
+            """
+            INSERT INTO report_cache (UUID, generating, start_timestamp_utc, data_max_timestamp_utc, ingestion_generation)
+            VALUES ($1, true, $2, $3, $4)
+            ON CONFLICT (data_max_timestamp_utc, ingestion_generation) DO NOTHING
+            RETURNING UUID;
+            """,
+            uuid.uuid4(), datetime.now(timezone.utc), max_timestamp, generation
+        )
+        if report_id is None:
+            report_id = await conn.fetchval(
                 """
-                INSERT INTO report_cache (UUID, generating, start_timestamp_utc)
-                VALUES (%s, %s, %s);
+                SELECT UUID FROM report_cache
+                WHERE data_max_timestamp_utc = $1 AND ingestion_generation = $2;
                 """,
-                (report_id, True, datetime.now(timezone.utc)),
+                max_timestamp, generation
             )
-            conn.commit()
-            background_tasks.add_task(generate_report_for_all_stores, report_id)
             return {"report_id": report_id}
 
+        background_tasks.add_task(generate_report_for_all_stores, report_id)
+        return {"report_id": report_id}
+
+
+async def is_report_generating(report_id: uuid.UUID) -> Optional[bool]:
+    """Whether the report is still generating, None if it is no longer in report_cache"""
+    async with async_pooled_connection() as conn:
+        report = await conn.fetchrow(
+            """
+            SELECT generating FROM report_cache
+            WHERE UUID = $1;
+            """,
+            report_id
+        )
+    return None if report is None else report["generating"]
+
+
+async def tail_report_file(report_id: uuid.UUID, report_file: Path) -> AsyncIterator[bytes]:
+    """Yield complete rows of report_file as they are written, until the report is generated
+
+    The generator flushes the file before marking the report generated, so reading to
+    the end once more after that sees every row. Raises if the report is removed, as a
+    failed report is, or if the file does not grow for REPORT_STREAM_IDLE_TIMEOUT seconds,
+    so the response is aborted instead of ending as if the report was complete.
+    """
+    pending = b''
+    idle_seconds = 0.0
+    with open(report_file, 'rb') as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if chunk:
+                idle_seconds = 0.0
+                pending += chunk
+                # only whole rows, the writer may have flushed half of one
+                row_end = pending.rfind(b'\n') + 1
+                if row_end:
+                    yield pending[:row_end]
+                    pending = pending[row_end:]
+                continue
+
+            generating = await is_report_generating(report_id)
+            if generating is None:
+                raise RuntimeError(f"Report {report_id} was removed while streaming")
+            if not generating:
+                yield pending + f.read()
+                return
+            if idle_seconds >= config.REPORT_STREAM_IDLE_TIMEOUT:
+                raise RuntimeError(f"Report {report_id} stopped growing, aborting stream")
+            await asyncio.sleep(config.REPORT_STREAM_POLL_SECONDS)
+            idle_seconds += config.REPORT_STREAM_POLL_SECONDS
+
+
+# formats picked from the Accept header, in order of preference
+ACCEPTED_REPORT_FORMATS = ['parquet', 'arrow']
+
+
+def negotiate_report_format(report_id: uuid.UUID, accept: str, accept_encoding: str) -> str:
+    """Format of an existing report file to serve for the Accept and Accept-Encoding headers"""
+    for report_format in ACCEPTED_REPORT_FORMATS:
+        if REPORT_FORMATS[report_format][1] in accept and report_path(report_id, report_format).exists():
+            return report_format
+    if 'gzip' in accept_encoding and report_path(report_id, 'csv.gz').exists():
+        return 'csv.gz'
+    return 'csv'
+
 
 @app.get("/get_report")
-def get_report(report_id: uuid.UUID):
-    with create_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+async def get_report(
+        report_id: uuid.UUID,
+        stream: bool = False,
+        format: Optional[str] = None,
+        accept: str = Header(default=''),
+        accept_encoding: str = Header(default='')
+):
+    async with async_pooled_connection() as conn:
+        report = await conn.fetchrow(
+            """
+            SELECT * FROM report_cache
+            WHERE UUID = $1;
+            """,
+            report_id
+        )
+        if not report:
+            report_cache_metrics.count(misses=1)
+            return {"status": "Not Found"}
+
+        report_file = REPORT_CACHE_DIR / f"{report_id}.csv"
+        if not report_file.exists():
+            # remove report from cache
+            await conn.execute(
                 """
-                SELECT * FROM report_cache
-                WHERE UUID = %s;
+                DELETE FROM report_cache
+                WHERE UUID = $1;
                 """,
-                (report_id,),
+                report_id
             )
-            report = cur.fetchone()
-            if not report:
-                return {"status": "Not Found"}
+            report_cache_metrics.count(misses=1)
+            return {"status": "Not Found"}
 
-            report_file = REPORT_CACHE_DIR / f"{report_id}.csv"
-            if not report_file.exists():
-                # remove report from cache
-                cur.execute(
-                    """
-                    DELETE FROM report_cache
-                    WHERE UUID = %s;
-                    """,
-                    (report_id,),
-                )
-                conn.commit()
-                return {"status": "Not Found"}
-
-            if report["generating"]:
-                return {
-                    "status": f"generating",
-                    "report_id": report["uuid"],
+        if report["generating"] and stream:
+            return StreamingResponse(
+                tail_report_file(report_id, report_file),
+                media_type="text/csv",
+                headers={
+                    "status": "generating",
+                    "Content-Disposition": f'attachment; filename="store_monitoring_{report_id}.csv"'
                 }
+            )
 
-            response = FileResponse(
-                report_file,
-                media_type="text/csv",
+        if report["generating"]:
+            return {
+                "status": f"generating",
+                "report_id": report["uuid"],
+                "stores_processed": report["stores_processed"],
+                "stores_total": report["stores_total"],
+                "rows_scanned": report["rows_scanned"],
+                "stores_per_second": report["stores_per_second"],
+                "eta_utc": report["eta_utc"],
+            }
+
+        report_cache_metrics.count(hits=1)
+        await conn.execute(
+            """
+            UPDATE report_cache
+            SET last_accessed_utc = $2
+            WHERE UUID = $1;
+            """,
+            report_id, datetime.now(timezone.utc)
+        )
+        if format is not None:
+            if format not in REPORT_FORMATS or not report_path(report_id, format).exists():
+                return JSONResponse(status_code=406, content={"status": "Format Not Available"})
+            suffix, media_type = REPORT_FORMATS[format]
+            return FileResponse(
+                report_path(report_id, format),
+                media_type=media_type,
                 headers={"status": "Completed"},
-                filename=f"store_monitoring_{report_id}.csv"
+                filename=f"store_monitoring_{report_id}{suffix}"
             )
-            return response
+
+        report_format = negotiate_report_format(report_id, accept, accept_encoding)
+        headers = {"status": "Completed", "Vary": "Accept, Accept-Encoding"}
+        if report_format == 'csv.gz':
+            # the csv itself, compressed in transit
+            headers["Content-Encoding"] = "gzip"
+            suffix, media_type = REPORT_FORMATS['csv']
+        else:
+            suffix, media_type = REPORT_FORMATS[report_format]
+        response = FileResponse(
+            report_path(report_id, report_format),
+            media_type=media_type,
+            headers=headers,
+            filename=f"store_monitoring_{report_id}{suffix}"
+        )
+        return response
+
+
+def compute_store_report(store_id: int, end_time: datetime) -> Optional[dict]:
+    with pooled_connection() as conn:
+        return generate_store_report_milliseconds(conn, store_id, end_time)
+
+
+_NOT_CACHED = object()
+# cache key of the latest status, the default end_time
+_LATEST_STATUS = ('latest_status',)
+
+
+@app.get("/stores/{store_id}/report")
+async def get_store_report(store_id: int, end_time: Optional[datetime] = None):
+    """Uptime and downtime of one store for windows ending at end_time or the latest status
+
+    ``uptime_ms`` and ``downtime_ms`` are durations in milliseconds the store was up or
+    down within its store hours during the window, not response times.
+    """
+    async with async_pooled_connection() as conn:
+        # every ingestion that changes data bumps the generation, a cheap read unlike the latest status
+        generation = await fetch_ingestion_generation(conn)
+        if end_time is None:
+            end_time = store_reports.get(_LATEST_STATUS, generation, _NOT_CACHED)
+            if end_time is _NOT_CACHED:
+                end_time = await fetch_max_timestamp(conn)
+                store_reports.put(_LATEST_STATUS, generation, end_time)
+    if end_time is None:
+        return JSONResponse(status_code=404, content={"status": "No Data"})
+    if end_time.tzinfo is None:
+        end_time = end_time.replace(tzinfo=timezone.utc)
+
+    key = (store_id, end_time)
+    report = store_reports.get(key, generation, _NOT_CACHED)
+    if report is _NOT_CACHED:
+        report = await run_in_threadpool(compute_store_report, store_id, end_time)
+        store_reports.put(key, generation, report)
+    if report is None:
+        return JSONResponse(status_code=404, content={"status": "Store Not Found"})
+    return {"store_id": store_id, "end_time": end_time, **report}
 
 
 @repeat_every(seconds=60 * 60, logger=logger)
 def poll_csv_data():
-    get_csv_files(overwrite=not DEBUG)
-    if check_csv_exists()[0]:
-        with create_connection() as conn:
+    changed = get_csv_files(overwrite=not DEBUG)
+    # a streamed store_status is never downloaded, only ingestion can tell if it changed
+    if check_csv_exists()[0] and (changed or config.STREAM_INGESTION):
+        clean_csv_files(changed)
+        with pooled_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -123,6 +313,30 @@ def poll_csv_data():
                 )
                 conn.commit()
             populate_db(conn)
+        store_reports.clear()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=config.REPORT_CACHE_MAINTENANCE_SECONDS, logger=logger)
+def maintain_report_cache():
+    with pooled_connection() as conn:
+        reconcile_report_cache(conn)
+        evict_report_cache(conn)
+
+
+@app.get("/metrics/report_cache")
+def report_cache_metrics_endpoint():
+    return {**report_cache_metrics.as_dict(), **report_cache_usage()}
+
+
+@app.get("/metrics/store_report_cache")
+def store_report_cache_metrics():
+    return store_reports.as_dict()
+
+
+@app.get("/metrics/db_pool")
+def db_pool_metrics():
+    return {**get_pool().metrics(), "async": async_pool_metrics()}
 
 
 @app.get('/test')
@@ -0,0 +1,111 @@
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import datetime
+import zoneinfo
+
+import numpy as np
+
+from .kernel import EPOCH, MICROSECONDS_PER_DAY, StatusLogArrays, offset_transitions, time_to_microseconds
+
+StoreHours = Dict[int, Tuple[datetime.time, datetime.time]]
+HoursKey = Tuple[Tuple[datetime.time, datetime.time], ...]
+
+
+@lru_cache(maxsize=65536)
+def week_intervals(hours: HoursKey, timezone: str, monday: datetime.date) -> Tuple[Tuple[int, int], ...]:
+    """Store hours of the local week starting at monday as UTC epoch microsecond intervals
+
+    Every interval holds exactly the instants whose local time falls within the hours of
+    its day, both ends inclusive. A day is split where the UTC offset changes, so clocks
+    going back or forward during store hours are accounted for. Days whose hours start
+    after they end have no interval, like the local time comparison they replace.
+    """
+    tz = zoneinfo.ZoneInfo(timezone)
+    # local times as if they were UTC, shifted by the offset of every segment below
+    local_monday = (datetime.datetime.combine(monday, datetime.time(), datetime.timezone.utc) - EPOCH).days
+    local_monday *= MICROSECONDS_PER_DAY
+    transitions, offsets = offset_transitions(
+        tz,
+        local_monday // 1_000_000 - 2 * 86400,
+        local_monday // 1_000_000 + 9 * 86400
+    )
+    segments = list(zip(transitions, transitions[1:] + [np.iinfo(np.int64).max], offsets))
+
+    intervals = []
+    for day_of_week, (start_time_local, end_time_local) in enumerate(hours):
+        local_day = local_monday + day_of_week * MICROSECONDS_PER_DAY
+        local_start = local_day + time_to_microseconds(start_time_local)
+        local_end = local_day + time_to_microseconds(end_time_local)
+        for segment_start, segment_end, offset in segments:
+            start = max(segment_start, local_start - offset)
+            end = min(segment_end - 1, local_end - offset)
+            if start <= end:
+                intervals.append((start, end))
+    # clocks going back at midnight can put a day before the previous one
+    return tuple(sorted(intervals))
+
+
+class BusinessHoursIndex:
+    """Store hours of a store over a period, as sorted UTC epoch microsecond intervals
+
+    Membership and overlap are binary searches over plain integers, the timezone is
+    only needed to build the index.
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, starts: List[int], ends: List[int]):
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def for_horizon(cls, store_hours: StoreHours, timezone: str, start_time: int, end_time: int) -> 'BusinessHoursIndex':
+        """Index covering start_time to end_time, built from cached local weeks"""
+        hours = tuple(store_hours[day_of_week] for day_of_week in range(7))
+        # a day of margin on both ends, local days may start before or after the UTC day
+        first_day = (EPOCH + datetime.timedelta(microseconds=start_time, days=-1)).date()
+        last_day = (EPOCH + datetime.timedelta(microseconds=end_time, days=1)).date()
+
+        intervals = []
+        monday = first_day - datetime.timedelta(days=first_day.weekday())
+        while monday <= last_day:
+            intervals.extend(week_intervals(hours, timezone, monday))
+            monday += datetime.timedelta(days=7)
+        intervals.sort()
+        return cls([start for start, _ in intervals], [end for _, end in intervals])
+
+    def contains(self, timestamp: int) -> bool:
+        """Whether timestamp falls within store hours"""
+        index = bisect_right(self.starts, timestamp) - 1
+        return index >= 0 and timestamp <= self.ends[index]
+
+    def contains_many(self, timestamps: np.ndarray) -> np.ndarray:
+        """``contains`` for an int64 array of timestamps"""
+        if not self.starts:
+            return np.zeros(timestamps.shape, dtype=np.bool_)
+        index = np.searchsorted(np.asarray(self.starts, dtype=np.int64), timestamps, side='right') - 1
+        ends = np.asarray(self.ends, dtype=np.int64)
+        return (index >= 0) & (timestamps <= ends[np.maximum(index, 0)])
+
+    def overlap(self, start_time: int, end_time: int) -> int:
+        """Microseconds of start_time to end_time within store hours"""
+        overlap = 0
+        index = bisect_left(self.ends, start_time)
+        while index < len(self.starts) and self.starts[index] <= end_time:
+            overlap += max(0, min(self.ends[index], end_time) - max(self.starts[index], start_time))
+            index += 1
+        return overlap
+
+
+def store_hours_mask(store_status: StatusLogArrays, store_hours: StoreHours, start_time: int) -> np.ndarray:
+    """Whether every status at or after start_time falls within store hours, earlier statuses are False"""
+    timestamps = store_status.timestamps
+    in_window = timestamps >= start_time
+    in_hours = np.zeros(timestamps.shape, dtype=np.bool_)
+    if in_window.any():
+        window_timestamps = timestamps[in_window]
+        index = BusinessHoursIndex.for_horizon(
+            store_hours, store_status.timezone, int(window_timestamps.min()), int(window_timestamps.max())
+        )
+        in_hours[in_window] = index.contains_many(window_timestamps)
+    return in_hours
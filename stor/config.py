@@ -6,6 +6,69 @@ CSV_DIR = PROJECT_DIR / 'data' / 'csv'
 REPORT_CACHE_DIR = PROJECT_DIR / 'data' / 'report_cache'
 DEBUG = os.environ.get('DEBUG', False) == 'True'
 GENERATING_REPORTS = False
+# 'python' computes every store in python, 'sql' computes the whole report in the database,
+# 'rollup' sums the hourly rollup maintained at ingestion
+REPORT_ENGINE = os.environ.get('REPORT_ENGINE', 'python')
+# where reports read store data from: 'postgres', or 'duckdb' to load the csv files of
+# CSV_DIR into an embedded DuckDB database, needs the duckdb package. The data version
+# reports are deduplicated by comes from the same backend
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgres')
+# number of status rows fetched per round trip when streaming status logs
+STATUS_LOG_ITERSIZE = int(os.environ.get('STATUS_LOG_ITERSIZE', 10000))
+# more than one worker generates python engine reports in parallel processes
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 1))
+# stores are split between workers by 'hash' of the store id or by sorted store id 'range'
+REPORT_SHARD_STRATEGY = os.environ.get('REPORT_SHARD_STRATEGY', 'hash')
+# times a failed shard is retried before the report fails
+REPORT_SHARD_RETRIES = int(os.environ.get('REPORT_SHARD_RETRIES', 2))
+# formats every report is written in besides csv: csv.gz, and parquet or arrow if pyarrow is installed
+REPORT_OUTPUT_FORMATS = [
+    report_format.strip() for report_format in os.environ.get('REPORT_OUTPUT_FORMATS', 'csv').split(',')
+    if report_format.strip()
+]
+# limits of the report cache, 0 disables a limit, and seconds between its maintenance runs
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 1024 ** 3))
+REPORT_CACHE_MAX_AGE_HOURS = float(os.environ.get('REPORT_CACHE_MAX_AGE_HOURS', 7 * 24))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 100))
+REPORT_CACHE_MAINTENANCE_SECONDS = int(os.environ.get('REPORT_CACHE_MAINTENANCE_SECONDS', 10 * 60))
+# reports still generating this many hours after they started are given up by the
+# report cache maintenance, so trigger_report starts them over, 0 disables it
+REPORT_GENERATING_TIMEOUT_HOURS = float(os.environ.get('REPORT_GENERATING_TIMEOUT_HOURS', 6))
+# samples of the dashboard graph rendered and kept, the index page picks one at random
+DASHBOARD_SAMPLE_SEEDS = int(os.environ.get('DASHBOARD_SAMPLE_SEEDS', 32))
+# per store reports kept in memory by /stores/{store_id}/report, and for how many seconds
+STORE_REPORT_CACHE_SIZE = int(os.environ.get('STORE_REPORT_CACHE_SIZE', 10000))
+STORE_REPORT_CACHE_TTL_SECONDS = float(os.environ.get('STORE_REPORT_CACHE_TTL_SECONDS', 5 * 60))
+# seconds between progress updates of a generating report in report_cache
+REPORT_PROGRESS_INTERVAL = float(os.environ.get('REPORT_PROGRESS_INTERVAL', 2))
+# /get_report?stream=true checks for new rows this often, and aborts the response for a
+# report that did not grow for REPORT_STREAM_IDLE_TIMEOUT seconds
+REPORT_STREAM_POLL_SECONDS = float(os.environ.get('REPORT_STREAM_POLL_SECONDS', 0.5))
+REPORT_STREAM_IDLE_TIMEOUT = float(os.environ.get('REPORT_STREAM_IDLE_TIMEOUT', 300))
+# more than one worker loads the csv files concurrently, and store_status in that many
+# line aligned chunks over their own connections
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 1))
+# stream store_status from its url straight into COPY instead of downloading and cleaning to disk
+STREAM_INGESTION = os.environ.get('STREAM_INGESTION', False) == 'True'
+# bytes read per chunk, and chunks buffered between the download and COPY
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024))
+STREAM_QUEUE_CHUNKS = int(os.environ.get('STREAM_QUEUE_CHUNKS', 16))
+# database connections kept per process, and seconds to wait for a free one
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# connections idle for longer than this many seconds are pinged before reuse
+DB_POOL_HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 60))
+# TimescaleDB settings of store_status as postgres intervals, applied by init_db on every start.
+# An empty interval removes the policy. Compression and retention count from now(), so keep
+# them off when loading old data, and compress only chunks older than the 1 week report window.
+# With retention, store_status_hourly keeps the buckets of dropped statuses when it is rebuilt,
+# and lifetime totals are not reset when store hours or timezones change.
+TIMESCALE_CHUNK_INTERVAL = os.environ.get('TIMESCALE_CHUNK_INTERVAL', '7 days')
+TIMESCALE_COMPRESS_AFTER = os.environ.get('TIMESCALE_COMPRESS_AFTER', '')
+TIMESCALE_RETAIN_FOR = os.environ.get('TIMESCALE_RETAIN_FOR', '')
+# keep the store_status_hourly_summary continuous aggregate, read by report queries when enabled
+TIMESCALE_CONTINUOUS_AGGREGATE = os.environ.get('TIMESCALE_CONTINUOUS_AGGREGATE', False) == 'True'
 
 
 def ensure_project_directories_exists():
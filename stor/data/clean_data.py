@@ -1,6 +1,13 @@
 import shutil
+from typing import Iterable
 
-from ..config import CSV_DIR
+from ..config import CSV_DIR, STREAM_INGESTION
+
+
+def clean_store_status_chunk(chunk: bytes) -> bytes:
+    """Clean whole lines of store_status.csv, status text to 0 or 1"""
+    # order of replace matters, as 'inactive' is a substring of 'active'
+    return chunk.replace(b'inactive', b'0').replace(b'active', b'1')
 
 
 def clean_store_status_csv():
@@ -8,6 +15,9 @@ def clean_store_status_csv():
     file_path = CSV_DIR / 'store_status.csv'
     clean_file_path = CSV_DIR / 'store_status_clean.csv'
 
+    if STREAM_INGESTION:
+        # cleaned by clean_store_status_chunk while streaming into the database
+        return
     if clean_file_path.exists():
         # todo: think about if we should regenerate the clean file or not
         return
@@ -51,8 +61,10 @@ def clean_time_zone_info_csv():
     return
 
 
-def clean_csv_files():
-    """Clean all csv files"""
+def clean_csv_files(changed: Iterable[str] = ()):
+    """Clean all csv files, regenerating the clean files of changed ones"""
+    for file_name in changed:
+        (CSV_DIR / f'{file_name}_clean.csv').unlink(missing_ok=True)
     clean_store_status_csv()
     clean_menu_hours_csv()
     clean_time_zone_info_csv()
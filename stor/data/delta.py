@@ -0,0 +1,131 @@
+import datetime
+import hashlib
+import io
+from typing import IO, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+FINGERPRINT_MODULUS = 2 ** 63
+
+
+class IngestionState(NamedTuple):
+    """What was ingested from a source: its latest timestamp, and a fingerprint and count of its rows"""
+    high_water_mark: datetime.datetime
+    fingerprint: int
+    row_count: int
+
+
+def row_hash(line: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'big')
+
+
+def parse_timestamp_utc(value: bytes) -> datetime.datetime:
+    """Parse a store_status.csv timestamp like ``2023-01-22 12:09:39.388884 UTC``"""
+    value = value.strip().removesuffix(b' UTC').decode()
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+
+class DeltaFilter:
+    """Drops store_status.csv rows at or below the high-water mark of the last ingestion
+
+    The fingerprint is a sum of row hashes, so it does not depend on row order and the
+    fingerprint of the rows kept can be added to the previous one. Dropped rows are
+    summed on their own and compared to the previous fingerprint: any historical row
+    changed, added or removed since the last ingestion makes them differ, and the
+    source has to be reloaded in full. Without a previous state every row is kept.
+    """
+
+    def __init__(self, state: Optional[IngestionState]):
+        self.state = state
+        self.old_fingerprint = 0
+        self.old_row_count = 0
+        self.new_fingerprint = 0
+        self.new_row_count = 0
+        self.high_water_mark = state.high_water_mark if state else None
+
+    def keep(self, line: bytes) -> bool:
+        """Whether line has to be copied, the header always is"""
+        line = line.rstrip(b'\r\n')
+        if line.startswith(b'store_id'):
+            return True
+        if not line:
+            return False
+        timestamp_utc = parse_timestamp_utc(line.rsplit(b',', 1)[1])
+        if self.state and timestamp_utc <= self.state.high_water_mark:
+            self.old_fingerprint = (self.old_fingerprint + row_hash(line)) % FINGERPRINT_MODULUS
+            self.old_row_count += 1
+            return False
+        self.new_fingerprint = (self.new_fingerprint + row_hash(line)) % FINGERPRINT_MODULUS
+        self.new_row_count += 1
+        if self.high_water_mark is None or timestamp_utc > self.high_water_mark:
+            self.high_water_mark = timestamp_utc
+        return True
+
+    def history_unchanged(self) -> bool:
+        """Whether the dropped rows are exactly the rows ingested before, call after reading everything"""
+        return self.state is None or (
+            self.old_fingerprint == self.state.fingerprint and self.old_row_count == self.state.row_count
+        )
+
+    def next_state(self) -> Optional[IngestionState]:
+        """State after ingesting the kept rows, None if there were no rows at all"""
+        if self.high_water_mark is None:
+            return None
+        return IngestionState(
+            self.high_water_mark,
+            (self.old_fingerprint + self.new_fingerprint) % FINGERPRINT_MODULUS,
+            self.old_row_count + self.new_row_count
+        )
+
+    def counters(self) -> Tuple[int, int, int, int, Optional[datetime.datetime]]:
+        """Counters of the lines seen, to ``merge`` into the filter of another part of the source"""
+        return self.old_fingerprint, self.old_row_count, self.new_fingerprint, self.new_row_count, self.high_water_mark
+
+    def merge(self, counters: Tuple[int, int, int, int, Optional[datetime.datetime]]):
+        """Add the counters of a filter over another part of the same source, with the same state"""
+        old_fingerprint, old_row_count, new_fingerprint, new_row_count, high_water_mark = counters
+        self.old_fingerprint = (self.old_fingerprint + old_fingerprint) % FINGERPRINT_MODULUS
+        self.old_row_count += old_row_count
+        self.new_fingerprint = (self.new_fingerprint + new_fingerprint) % FINGERPRINT_MODULUS
+        self.new_row_count += new_row_count
+        if high_water_mark is not None and (self.high_water_mark is None or high_water_mark > self.high_water_mark):
+            self.high_water_mark = high_water_mark
+
+    def kept_chunks(self, file: Iterable[bytes], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Lines of file to keep, joined in chunks of about chunk_size bytes"""
+        kept = []
+        size = 0
+        for line in file:
+            if self.keep(line):
+                kept.append(line)
+                size += len(line)
+                if size >= chunk_size:
+                    yield b''.join(kept)
+                    kept, size = [], 0
+        if kept:
+            yield b''.join(kept)
+
+    def filter(self, file: Iterable[bytes]) -> IO[bytes]:
+        """Binary file-like view of the lines of file to keep"""
+        return io.BufferedReader(ChunkReader(self.kept_chunks(file)))
+
+
+class ChunkReader(io.RawIOBase):
+    """Read only file-like object over an iterator of byte chunks"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        super().__init__()
+        self._chunks = chunks
+        self._buffer = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
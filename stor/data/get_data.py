@@ -1,8 +1,15 @@
 from pathlib import Path
+from typing import List, Optional
 import asyncio
+import hashlib
+import json
+import os
 import aiohttp
 from loguru import logger
 
+from .. import config
+from ..config import CSV_DIR
+
 files = {
     'store_status': '1UIx1hVJ7qt_6oQoGZgb8B3P2vd1FD025',
     'menu_hours': '1va1X3ydSh-0Rt1hsy2QSnHRA4w57PcXg',
@@ -10,38 +17,158 @@ files = {
 }
 
 
-async def download_file(url, file_name, overwrite: bool = False):
+def files_on_disk() -> dict:
+    """Files downloaded to the csv directory, store_status is streamed into the database instead if enabled"""
+    if config.STREAM_INGESTION:
+        return {file_name: file_id for file_name, file_id in files.items() if file_name != 'store_status'}
+    return files
+
+
+def file_url(file_id: str) -> str:
+    return f"https://drive.google.com/uc?export=download&id={file_id}&confirm=1"
+
+
+def read_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_json(path: Path, data: dict):
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def validators(response: aiohttp.ClientResponse) -> dict:
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+
+def content_range_start(response: aiohttp.ClientResponse) -> Optional[int]:
+    """First byte of a 206 response, from ``Content-Range: bytes start-end/total``"""
+    content_range = response.headers.get('Content-Range', '')
+    if not content_range.startswith('bytes '):
+        return None
+    try:
+        return int(content_range[len('bytes '):].split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+async def download_file(url, file_name, overwrite: bool = False, directory: Path = CSV_DIR) -> bool:
+    """Download url to directory/file_name.csv, returns whether the file changed
+
+    The body is written in chunks to a ``.part`` file that replaces the csv once complete,
+    so readers never see half a file. The ETag and Last-Modified of the last download
+    make the request conditional, and its sha256 catches servers answering every request
+    in full. An interrupted download is resumed with a Range request, if the server
+    still serves the same version. A partial response that does not continue the
+    ``.part`` file discards it and the file is requested in full.
+    """
+    file_path = directory / f'{file_name}.csv'
+    if not overwrite and file_path.exists():
+        logger.debug(f"{file_name}.csv already exists")
+        return False
+
+    meta_path = directory / f'{file_name}.csv.meta.json'
+    part_path = directory / f'{file_name}.csv.part'
+    part_meta_path = directory / f'{file_name}.csv.part.meta.json'
+    meta = read_json(meta_path) if file_path.exists() else {}
+    part_meta = read_json(part_meta_path) if part_path.exists() else {}
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset and (part_meta.get('etag') or part_meta.get('last_modified')):
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = part_meta.get('etag') or part_meta['last_modified']
+    else:
+        offset = 0
+
+    digest = hashlib.sha256()
     async with aiohttp.ClientSession() as session:
-        file_path = Path(__file__).parent / 'csv' / f'{file_name}.csv'
-        if not overwrite and file_path.exists():
-            logger.debug(f"{file_name}.csv already exists")
-            return
-        response = await session.get(url)
-        with open(file_path, 'w') as f:
-            f.write(await response.text())
+        while True:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    logger.debug(f"{file_name}.csv not modified")
+                    part_path.unlink(missing_ok=True)
+                    part_meta_path.unlink(missing_ok=True)
+                    return False
+                response.raise_for_status()
+
+                if response.status == 206 and not (offset and content_range_start(response) == offset):
+                    if not offset:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                            message=f"Partial content for {file_name}.csv without a Range request",
+                            headers=response.headers
+                        )
+                    # appending would join the part file with bytes of another position
+                    logger.warning(f"Cannot resume download of {file_name}.csv from byte {offset}, starting over")
+                    part_path.unlink(missing_ok=True)
+                    part_meta_path.unlink(missing_ok=True)
+                    offset = 0
+                    del headers['Range'], headers['If-Range']
+                    continue
+
+                if response.status == 206:
+                    logger.info(f"Resuming download of {file_name}.csv from byte {offset}")
+                    with open(part_path, 'rb') as part:
+                        while chunk := part.read(config.STREAM_CHUNK_SIZE):
+                            digest.update(chunk)
+                    mode = 'ab'
+                else:
+                    mode = 'wb'
+                write_json(part_meta_path, validators(response))
+                with open(part_path, mode) as part:
+                    async for chunk in response.content.iter_chunked(config.STREAM_CHUNK_SIZE):
+                        part.write(chunk)
+                        digest.update(chunk)
+                new_meta = {**validators(response), 'sha256': digest.hexdigest()}
+                break
+
+    part_meta_path.unlink(missing_ok=True)
+    if file_path.exists() and new_meta['sha256'] == meta.get('sha256'):
+        logger.debug(f"{file_name}.csv unchanged")
+        part_path.unlink()
+        write_json(meta_path, new_meta)
+        return False
 
-        logger.info(f"Downloaded {file_name}.csv")
+    os.replace(part_path, file_path)
+    write_json(meta_path, new_meta)
+    logger.info(f"Downloaded {file_name}.csv")
+    return True
 
 
-async def execute_download(overwrite: bool = False):
-    tasks = []
-    (Path(__file__).parent / 'csv').mkdir(exist_ok=True)
-    for file_name, file_id in files.items():
-        url = f"https://drive.google.com/uc?export=download&id={file_id}&confirm=1"
-        tasks.append(download_file(url, file_name, overwrite=overwrite))
-    await asyncio.gather(*tasks)
+async def execute_download(overwrite: bool = False) -> List[str]:
+    tasks = {}
+    CSV_DIR.mkdir(exist_ok=True)
+    for file_name, file_id in files_on_disk().items():
+        tasks[file_name] = download_file(file_url(file_id), file_name, overwrite=overwrite)
+    changed = await asyncio.gather(*tasks.values())
+    return [file_name for file_name, file_changed in zip(tasks, changed) if file_changed]
 
 
 def check_csv_exists() -> tuple[bool, str]:
-    for file_name in files.keys():
-        file_path = Path(__file__).parent / 'csv' / f'{file_name}.csv'
+    for file_name in files_on_disk().keys():
+        file_path = CSV_DIR / f'{file_name}.csv'
         if not file_path.exists():
             return False, f"{file_name}.csv does not exist"
     return True, "All csv files exist"
 
 
-def get_csv_files(overwrite: bool = False):
-    asyncio.run(execute_download(overwrite=overwrite))
+def get_csv_files(overwrite: bool = False) -> List[str]:
+    """Download csv files, returns names of the files that changed"""
+    return asyncio.run(execute_download(overwrite=overwrite))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+import asyncio
+import io
+import queue
+import threading
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+import aiohttp
+from loguru import logger
+
+from .. import config
+from .clean_data import clean_store_status_chunk
+
+_END = object()
+
+
+def complete_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Regroup chunks so every chunk ends on a line break, the last one excepted"""
+    async def regrouped():
+        pending = b''
+        async for chunk in chunks:
+            pending += chunk
+            line_end = pending.rfind(b'\n') + 1
+            if line_end:
+                yield pending[:line_end]
+                pending = pending[line_end:]
+        if pending:
+            yield pending
+    return regrouped()
+
+
+class QueueReader(io.RawIOBase):
+    """Read only file-like view of chunks put on a bounded queue by another thread
+
+    ``read`` blocks until the producer puts more data, so a consumer like ``copy_expert``
+    pulls the stream at its own pace while the queue bounds memory to maxsize chunks.
+    The producer ends the stream with ``finish`` or ``fail``.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._buffer = memoryview(b'')
+        self._error: Optional[BaseException] = None
+        self._finished = False
+        self.stopped = threading.Event()
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def put(self, chunk: bytes) -> bool:
+        """Queue a chunk, waiting while the queue is full, False if the reader was closed"""
+        while not self.stopped.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        self.put(_END)
+
+    def fail(self, error: BaseException):
+        self._error = error
+        self.put(_END)
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if self._finished:
+                return 0
+            chunk = self._queue.get()
+            if chunk is _END:
+                self._finished = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.bytes_read += size
+        return size
+
+    def close(self):
+        self.stopped.set()
+        super().close()
+
+
+async def iter_url_chunks(url: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """Body of url in chunks of at most chunk_size bytes, as it arrives"""
+    async with aiohttp.ClientSession() as session, session.get(url) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(chunk_size):
+            yield chunk
+
+
+def produce(
+        reader: QueueReader,
+        chunks: Callable[[], AsyncIterator[bytes]],
+        transform: Callable[[bytes], bytes]
+):
+    """Put transformed chunks on reader, runs in its own thread with its own event loop"""
+    async def run():
+        async for chunk in complete_lines(chunks()):
+            if not reader.put(transform(chunk)):
+                logger.debug("Stream reader closed, stopping download")
+                return
+        reader.finish()
+
+    try:
+        asyncio.run(run())
+    except BaseException as e:
+        reader.fail(e)
+
+
+@contextmanager
+def open_transformed_stream(
+        chunks: Callable[[], AsyncIterator[bytes]],
+        transform: Callable[[bytes], bytes] = lambda chunk: chunk
+) -> Iterator[io.BufferedReader]:
+    """File-like object reading transform applied to whole lines of chunks, produced in a thread
+
+    Download errors are raised by ``read``. Leaving the block early stops the download.
+    """
+    reader = QueueReader(config.STREAM_QUEUE_CHUNKS)
+    producer = threading.Thread(target=produce, args=(reader, chunks, transform), daemon=True)
+    producer.start()
+    try:
+        with io.BufferedReader(reader, buffer_size=config.STREAM_CHUNK_SIZE) as f:
+            yield f
+    finally:
+        reader.close()
+        producer.join()
+        logger.debug(f"Streamed {reader.bytes_read} bytes")
+
+
+def open_store_status_stream(url: str) -> Iterator[io.BufferedReader]:
+    """store_status.csv from url, cleaned like ``clean_store_status_csv``, without touching disk"""
+    return open_transformed_stream(
+        lambda: iter_url_chunks(url, config.STREAM_CHUNK_SIZE),
+        clean_store_status_chunk
+    )
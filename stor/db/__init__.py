@@ -1,12 +1,25 @@
 import os
 import pathlib
+import datetime
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 
 import psycopg2
 from psycopg2 import sql, extras as pg_extras
 from loguru import logger
-from typing import TYPE_CHECKING
+from typing import IO, TYPE_CHECKING, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, Union
 
+from .. import config
 from ..config import CSV_DIR
+from ..data.delta import DeltaFilter, IngestionState
+from ..data.get_data import file_url, files
+from ..data.stream import open_store_status_stream
+from .pool import ConnectionPool, PoolTimeout
+from .lifetime import mark_store_lifetime_totals_stale, reset_store_lifetime_totals
+from .rollup import refresh_store_status_hourly
 
 if TYPE_CHECKING:
     from psycopg2.extensions import connection, cursor
@@ -43,6 +56,37 @@ def create_connection():
         raise e
 
 
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Connection pool of the current process, created on first use
+
+    A pool inherited from a parent process shares its sockets, so a forked
+    process gets a pool of its own.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(
+                config.DB_POOL_MIN_SIZE,
+                config.DB_POOL_MAX_SIZE,
+                config.DB_POOL_TIMEOUT,
+                config.DB_POOL_HEALTH_CHECK_AFTER,
+                **DB_CONFIG
+            )
+            logger.debug(f"Created connection pool of up to {config.DB_POOL_MAX_SIZE} connections to {DB_CONFIG['dbname']}")
+        return _pool
+
+
+@contextmanager
+def pooled_connection() -> Iterator['connection']:
+    """Connection from the process wide pool, committed and returned when the block exits"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
 def init_store_status_table(conn: 'connection') -> bool:
     """Create Table for store status"""
     with conn.cursor() as cur:
@@ -79,6 +123,172 @@ def init_store_status_table(conn: 'connection') -> bool:
     return True
 
 
+def run_outside_transaction(conn: 'connection', query: str, params: tuple = None):
+    """Run a statement TimescaleDB refuses to run inside a transaction block"""
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+    finally:
+        conn.autocommit = False
+
+
+def init_store_status_policies(conn: 'connection') -> bool:
+    """Apply chunk interval, compression, retention and continuous aggregate settings of store_status
+
+    Settings come from ``config`` and are applied again on every start, so changing or
+    clearing one takes effect without touching the database by hand.
+    """
+    with conn.cursor() as cur:
+        if config.TIMESCALE_CHUNK_INTERVAL:
+            # only chunks created from now on use the new interval
+            cur.execute(
+                "SELECT set_chunk_time_interval('store_status', %s::interval);",
+                (config.TIMESCALE_CHUNK_INTERVAL,)
+            )
+
+        cur.execute("SELECT remove_compression_policy('store_status', if_exists => TRUE);")
+        if config.TIMESCALE_COMPRESS_AFTER:
+            cur.execute("SELECT %s::interval < INTERVAL '7 days';", (config.TIMESCALE_COMPRESS_AFTER,))
+            if cur.fetchone()[0]:
+                logger.warning("Compressing chunks inside the 1 week report window, reports will be slower")
+            cur.execute(
+                """
+                SELECT compression_enabled
+                FROM timescaledb_information.hypertables
+                WHERE hypertable_name = 'store_status';
+                """
+            )
+            if not cur.fetchone()[0]:
+                cur.execute(
+                    """
+                    ALTER TABLE store_status SET (
+                        timescaledb.compress,
+                        timescaledb.compress_segmentby = 'store_id',
+                        timescaledb.compress_orderby = 'timestamp_utc'
+                    );
+                    """
+                )
+            cur.execute(
+                "SELECT add_compression_policy('store_status', %s::interval);",
+                (config.TIMESCALE_COMPRESS_AFTER,)
+            )
+
+        cur.execute("SELECT remove_retention_policy('store_status', if_exists => TRUE);")
+        if config.TIMESCALE_RETAIN_FOR:
+            cur.execute(
+                "SELECT add_retention_policy('store_status', %s::interval);",
+                (config.TIMESCALE_RETAIN_FOR,)
+            )
+        conn.commit()
+
+    if config.TIMESCALE_CONTINUOUS_AGGREGATE:
+        run_outside_transaction(
+            conn,
+            """
+            CREATE MATERIALIZED VIEW IF NOT EXISTS store_status_hourly_summary
+            WITH (timescaledb.continuous) AS
+            SELECT
+                store_id,
+                time_bucket(INTERVAL '1 hour', timestamp_utc) AS hour_utc,
+                COUNT(*) AS polls,
+                SUM(status::INT) AS open_polls,
+                MIN(timestamp_utc) AS first_timestamp_utc,
+                first(status, timestamp_utc) AS first_status,
+                MAX(timestamp_utc) AS last_timestamp_utc,
+                last(status, timestamp_utc) AS last_status
+            FROM store_status
+            GROUP BY store_id, hour_utc
+            WITH NO DATA;
+            """
+        )
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT remove_continuous_aggregate_policy('store_status_hourly_summary', if_exists => TRUE);"
+            )
+            # refreshing a range whose raw data was dropped would empty it, stop at the retention age
+            cur.execute(
+                """
+                SELECT add_continuous_aggregate_policy(
+                    'store_status_hourly_summary',
+                    start_offset => %s::interval,
+                    end_offset => NULL,
+                    schedule_interval => INTERVAL '1 hour'
+                );
+                """,
+                (config.TIMESCALE_RETAIN_FOR or None,)
+            )
+            conn.commit()
+        # materializes a newly created aggregate, already materialized hours are skipped
+        run_outside_transaction(
+            conn,
+            "CALL refresh_continuous_aggregate('store_status_hourly_summary', now() - %s::interval, NULL);",
+            (config.TIMESCALE_RETAIN_FOR or None,)
+        )
+    logger.debug("Applied store_status policies")
+    return True
+
+
+def refresh_store_status_hourly_summary(conn: 'connection', start_time: datetime.datetime = None):
+    """Materialize store_status_hourly_summary from start_time on, everything if None"""
+    if not config.TIMESCALE_CONTINUOUS_AGGREGATE:
+        return
+    run_outside_transaction(
+        conn,
+        "CALL refresh_continuous_aggregate('store_status_hourly_summary', %s, NULL);",
+        (start_time,)
+    )
+    logger.debug("Refreshed store_status_hourly_summary")
+
+
+def init_store_status_hourly_table(conn: 'connection') -> bool:
+    """Create Table for hourly rollup of store status
+
+    Every bucket holds the time since a status and the next one, for statuses in that
+    UTC hour, counted like ``calculate_relative_report`` does.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS store_status_hourly (
+                store_id BIGINT not null,
+                hour_utc timestamptz not null,
+                uptime_microseconds BIGINT not null,
+                downtime_microseconds BIGINT not null,
+                PRIMARY KEY (store_id, hour_utc)
+            );
+            """
+        )
+        conn.commit()
+        logger.debug("Created store_status_hourly table")
+    return True
+
+
+def init_store_lifetime_totals_table(conn: 'connection') -> bool:
+    """Create Table for lifetime uptime and downtime of every store
+
+    Totals cover every status up to the lifetime_totals_checkpoint setting, stale stores
+    got statuses before it and are recomputed in full.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS store_lifetime_totals (
+                store_id BIGINT PRIMARY KEY,
+                uptime_microseconds BIGINT not null,
+                downtime_microseconds BIGINT not null,
+                last_status BOOLEAN,
+                last_timestamp_utc timestamptz,
+                stale BOOLEAN not null default FALSE
+            );
+            """
+        )
+        conn.commit()
+        logger.debug("Created store_lifetime_totals table")
+    return True
+
+
 def init_time_zone_table(conn: 'connection') -> bool:
     """Create Table for time zone"""
     with conn.cursor() as cur:
@@ -121,7 +331,7 @@ def init_cache_table(conn: 'connection') -> bool:
     with conn.cursor() as cur:
         # UUID is used as a key to store the data in disk
         # If cache exists it will be in /data/report_cache/{UUID}
-        # todo: add a job that clears tabel if cache is not in /data/report_cache
+        # stor.report_cache keeps both in sync and bounded
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS report_cache (
@@ -132,6 +342,38 @@ def init_cache_table(conn: 'connection') -> bool:
             );
             """
         )
+        # progress of a generating report, written by ``ReportProgress``
+        cur.execute(
+            """
+            ALTER TABLE report_cache
+                ADD COLUMN IF NOT EXISTS stores_processed INTEGER not null DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS stores_total INTEGER default null,
+                ADD COLUMN IF NOT EXISTS rows_scanned BIGINT not null DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS stores_per_second DOUBLE PRECISION default null,
+                ADD COLUMN IF NOT EXISTS eta_utc timestamptz default null;
+            """
+        )
+        # last download, for least recently used eviction
+        cur.execute(
+            """
+            ALTER TABLE report_cache
+                ADD COLUMN IF NOT EXISTS last_accessed_utc timestamptz default null;
+            """
+        )
+        # data version a report was generated from, one report per version
+        cur.execute(
+            """
+            ALTER TABLE report_cache
+                ADD COLUMN IF NOT EXISTS data_max_timestamp_utc timestamptz default null,
+                ADD COLUMN IF NOT EXISTS ingestion_generation BIGINT default null;
+            """
+        )
+        cur.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_report_cache_data_version
+            ON report_cache (data_max_timestamp_utc, ingestion_generation);
+            """
+        )
         conn.commit()
         logger.debug("Created cache table")
     return True
@@ -153,6 +395,25 @@ def init_settings_table(conn: 'connection') -> bool:
     return True
 
 
+def init_ingestion_state_table(conn: 'connection') -> bool:
+    """Create Table for ingestion state, the high-water mark and fingerprint of every ingested source"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_state (
+                source VARCHAR(255) PRIMARY KEY not null,
+                high_water_mark timestamptz not null,
+                fingerprint BIGINT not null,
+                row_count BIGINT not null,
+                updated_at_utc timestamptz not null
+            );
+            """
+        )
+        conn.commit()
+        logger.debug("Created ingestion_state table")
+    return True
+
+
 def init_db(conn: 'connection') -> bool:
     """Create Tables"""
 
@@ -164,6 +425,18 @@ def init_db(conn: 'connection') -> bool:
         logger.error("Unable to initialize store_status table")
         return False
 
+    if not init_store_status_policies(conn):
+        logger.error("Unable to apply store_status policies")
+        return False
+
+    if not init_store_status_hourly_table(conn):
+        logger.error("Unable to initialize store_status_hourly table")
+        return False
+
+    if not init_store_lifetime_totals_table(conn):
+        logger.error("Unable to initialize store_lifetime_totals table")
+        return False
+
     if not init_time_zone_table(conn):
         logger.error("Unable to initialize time_zone table")
         return False
@@ -180,57 +453,309 @@ def init_db(conn: 'connection') -> bool:
         logger.error("Unable to initialize settings table")
         return False
 
+    if not init_ingestion_state_table(conn):
+        logger.error("Unable to initialize ingestion_state table")
+        return False
+
     return True
 
 
-def populate_store_status(conn: 'connection', sql_string: str, file: pathlib.Path):
+def create_tmp_table(cur: 'cursor', table_name: str, file: Union[pathlib.Path, IO]):
+    """COPY csv file, or file-like object, into a temp table shaped like table_name, dropped on commit"""
+    cur.execute(
+        sql.SQL(
+            """
+            CREATE TEMP TABLE tmp_table
+            ON COMMIT DROP
+            AS
+            SELECT *
+            FROM {table_name}
+            WITH NO DATA;
+            """
+        ).format(table_name=sql.Identifier(table_name))
+    )
+    if not isinstance(file, pathlib.Path):
+        cur.copy_expert(sql="COPY tmp_table FROM STDIN DELIMITER ',' CSV HEADER", file=file)
+        return
+    with open(file, 'r') as f:
+        cur.copy_expert(
+            sql="COPY tmp_table FROM STDIN DELIMITER ',' CSV HEADER",
+            file=f
+        )
+
+
+def copy_into_table(cur: 'cursor', table_name: str, file: pathlib.Path) -> int:
+    """COPY csv file into table, skipping rows already present, returns number of inserted rows"""
+    create_tmp_table(cur, table_name, file)
+    cur.execute(
+        sql.SQL(
+            """
+            INSERT INTO {table_name}
+            SELECT *
+            FROM tmp_table
+            ON CONFLICT DO NOTHING;
+            """
+        ).format(table_name=sql.Identifier(table_name))
+    )
+    return cur.rowcount
+
+
+def get_ingestion_state(cur: 'cursor', source: str) -> Optional[IngestionState]:
+    """State of the last ingestion of source, None if it was never ingested"""
+    cur.execute(
+        """
+        SELECT high_water_mark, fingerprint, row_count
+        FROM ingestion_state
+        WHERE source = %s
+        """,
+        (source,)
+    )
+    row = cur.fetchone()
+    return IngestionState(*row) if row else None
+
+
+def save_ingestion_state(cur: 'cursor', source: str, state: IngestionState):
+    cur.execute(
+        """
+        INSERT INTO ingestion_state (source, high_water_mark, fingerprint, row_count, updated_at_utc)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (source) DO UPDATE
+        SET high_water_mark = EXCLUDED.high_water_mark,
+            fingerprint = EXCLUDED.fingerprint,
+            row_count = EXCLUDED.row_count,
+            updated_at_utc = EXCLUDED.updated_at_utc;
+        """,
+        (source, *state)
+    )
+
+
+def merge_store_status(cur: 'cursor', sources: List[str]) -> Dict[int, datetime.datetime]:
+    """Insert rows of the source tables into store_status, returns the earliest inserted or changed status of every store
+
+    A status in the source tables more than once is inserted once, open if any of them is.
+    """
+    cur.execute(
+        sql.SQL(
+            """
+            WITH inserted AS (
+                INSERT INTO store_status
+                SELECT DISTINCT ON (store_id, timestamp_utc) *
+                FROM ({sources}) source
+                ORDER BY store_id, timestamp_utc, status DESC
+                ON CONFLICT (store_id, timestamp_utc) DO UPDATE
+                SET status = EXCLUDED.status
+                WHERE store_status.status IS DISTINCT FROM EXCLUDED.status
+                RETURNING store_id, timestamp_utc
+            )
+            SELECT store_id, MIN(timestamp_utc)
+            FROM inserted
+            GROUP BY store_id;
+            """
+        ).format(sources=sql.SQL(' UNION ALL ').join(
+            sql.SQL('SELECT * FROM {}').format(sql.Identifier(source)) for source in sources
+        ))
+    )
+    return dict(cur.fetchall())
+
+
+def copy_store_status(
+        cur: 'cursor',
+        open_file: Callable[[], ContextManager[IO[bytes]]],
+        state: Optional[IngestionState]
+) -> Optional[Dict[int, datetime.datetime]]:
+    """COPY rows of store_status newer than state, returns the earliest inserted or changed status of every store
+
+    Returns None, inserting nothing, if rows ingested before changed.
+    """
+    delta = DeltaFilter(state)
+    with open_file() as file:
+        create_tmp_table(cur, 'store_status', delta.filter(file))
+    if not delta.history_unchanged():
+        return None
+    logger.debug(f"Copying {delta.new_row_count} store_status rows newer than {state.high_water_mark if state else None}")
+
+    first_new_status = merge_store_status(cur, ['tmp_table'])
+    if next_state := delta.next_state():
+        save_ingestion_state(cur, 'store_status', next_state)
+    return first_new_status
+
+
+def line_aligned_ranges(file: pathlib.Path, chunk_count: int) -> List[Tuple[int, int]]:
+    """Byte ranges splitting the rows of a csv file after its header in up to chunk_count parts, on line breaks"""
+    size = file.stat().st_size
+    with open(file, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for chunk in range(1, chunk_count):
+            target = bounds[0] + (size - bounds[0]) * chunk // chunk_count
+            # from the byte before, so a target at the start of a line stays there
+            f.seek(max(target - 1, bounds[-1]))
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def iter_range_lines(f: IO[bytes], start: int, end: int) -> Iterator[bytes]:
+    """Lines of f from byte start, which begins a line, up to byte end"""
+    f.seek(start)
+    position = start
+    while position < end and (line := f.readline()):
+        position += len(line)
+        yield line
+
+
+def copy_store_status_chunk(
+        file: pathlib.Path,
+        start: int,
+        end: int,
+        staging_table: str,
+        state: Optional[IngestionState]
+) -> tuple:
+    """COPY rows of a byte range of file newer than state into staging_table, runs in a worker process
+
+    Returns the counters of its ``DeltaFilter``.
+    """
+    delta = DeltaFilter(state)
+    with pooled_connection() as conn, conn.cursor() as cur, open(file, 'rb') as f:
+        cur.copy_expert(
+            sql.SQL("COPY {staging_table} FROM STDIN DELIMITER ',' CSV").format(
+                staging_table=sql.Identifier(staging_table)
+            ),
+            delta.filter(iter_range_lines(f, start, end))
+        )
+    return delta.counters()
+
+
+def drop_tables(cur: 'cursor', tables: List[str]):
+    for table in tables:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {table};").format(table=sql.Identifier(table)))
+
+
+def parallel_copy_store_status(
+        conn: 'connection',
+        file: pathlib.Path,
+        state: Optional[IngestionState]
+) -> Optional[Dict[int, datetime.datetime]]:
+    """``copy_store_status`` of a csv file split in line aligned chunks, COPYed by INGEST_WORKERS processes
+
+    Every chunk is filtered and COPYed over a connection of its own into an unlogged staging
+    table, the staging tables are merged into store_status in the transaction of conn.
+    """
+    ranges = line_aligned_ranges(file, config.INGEST_WORKERS)
+    load_id = uuid.uuid4().hex[:12]
+    staging_tables = [f'store_status_staging_{load_id}_{chunk}' for chunk in range(len(ranges))]
+    with conn.cursor() as cur:
+        for staging_table in staging_tables:
+            cur.execute(
+                sql.SQL("CREATE UNLOGGED TABLE {staging_table} (LIKE store_status);").format(
+                    staging_table=sql.Identifier(staging_table)
+                )
+            )
+        conn.commit()
+
+    try:
+        delta = DeltaFilter(state)
+        # spawn, as forking a threaded server process can deadlock the workers
+        with ProcessPoolExecutor(
+                max_workers=config.INGEST_WORKERS, mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            for counters in executor.map(
+                    copy_store_status_chunk,
+                    [file] * len(ranges),
+                    [start for start, _ in ranges],
+                    [end for _, end in ranges],
+                    staging_tables,
+                    [state] * len(ranges)
+            ):
+                delta.merge(counters)
+
+        with conn.cursor() as cur:
+            if not delta.history_unchanged():
+                drop_tables(cur, staging_tables)
+                conn.commit()
+                return None
+            logger.debug(f"Merging {delta.new_row_count} store_status rows from {len(ranges)} chunks")
+            first_new_status = merge_store_status(cur, staging_tables) if staging_tables else {}
+            if next_state := delta.next_state():
+                save_ingestion_state(cur, 'store_status', next_state)
+            # dropped when the caller commits the merge
+            drop_tables(cur, staging_tables)
+        return first_new_status
+    except BaseException:
+        conn.rollback()
+        with conn.cursor() as cur:
+            drop_tables(cur, staging_tables)
+        conn.commit()
+        raise
+
+
+def populate_store_status(
+        conn: 'connection',
+        file: Union[pathlib.Path, Callable[[], ContextManager[IO[bytes]]]]
+) -> Dict[int, datetime.datetime]:
+    """Populates store_status table, returns the earliest inserted status of every store
+
+    file is a cleaned csv file, loaded in parallel chunks with more than one INGEST_WORKERS,
+    or a function opening a stream of one. Only rows after the high-water mark of the last
+    ingestion are copied, the source is read again to reload every row if the ones
+    ingested before changed.
+    """
+    if isinstance(file, pathlib.Path):
+        path = file
+        if config.INGEST_WORKERS > 1:
+            def copy(cur, state):
+                return parallel_copy_store_status(conn, path, state)
+        else:
+            def copy(cur, state):
+                return copy_store_status(cur, lambda: open(path, 'rb'), state)
+    else:
+        def copy(cur, state):
+            return copy_store_status(cur, file, state)
+
     with conn.cursor() as cur:
         if os.getenv('DEBUG', False) and not is_table_empty(cur, 'store_status'):
             logger.debug("Skipping populating of store_status table")
-            return
+            return {}
 
         logger.info("Populating store_status table")
-        with open(file, 'r') as f:
-            cur.copy_expert(
-                sql=sql_string.format(main_table='store_status'),
-                file=f
-            )
+        first_new_status = copy(cur, get_ingestion_state(cur, 'store_status'))
+        if first_new_status is None:
+            logger.warning("Ingested store_status rows changed, reloading every row")
+            conn.rollback()
+            first_new_status = copy(cur, None)
         conn.commit()
         logger.debug("Populated store_status table")
+    return first_new_status
 
 
-def populate_time_zone_table(conn: 'connection', sql_string: str, file: pathlib.Path):
-    """Populates time_zone table"""
+def populate_time_zone_table(conn: 'connection', file: pathlib.Path) -> int:
+    """Populates time_zone table, returns number of inserted rows"""
     with conn.cursor() as cur:
         if os.getenv('DEBUG', False) and not is_table_empty(cur, 'time_zone'):
             logger.debug("Skipping populating of time_zone table")
-            return
+            return 0
 
         logger.info("Populating time_zone table")
-        with open(file, 'r') as f:
-            cur.copy_expert(
-                sql=sql_string.format(main_table='time_zone'),
-                file=f
-            )
+        inserted = copy_into_table(cur, 'time_zone', file)
         conn.commit()
         logger.debug("Populated time_zone table")
+    return inserted
 
 
-def populate_menu_hours_table(conn: 'connection', sql_string: str, file: pathlib.Path):
-    """Populates menu_hours table"""
+def populate_menu_hours_table(conn: 'connection', file: pathlib.Path) -> int:
+    """Populates menu_hours table, returns number of inserted rows"""
     with conn.cursor() as cur:
         if os.getenv('DEBUG', False) and not is_table_empty(cur, 'menu_hours'):
             logger.debug("Skipping populating of menu_hours table")
-            return
+            return 0
 
         logger.info("Populating menu_hours table")
-        with open(file, 'r') as f:
-            cur.copy_expert(
-                sql=sql_string.format(main_table='menu_hours'),
-                file=f
-            )
+        inserted = copy_into_table(cur, 'menu_hours', file)
         conn.commit()
         logger.debug("Populated menu_hours table")
+    return inserted
 
 
 def populate_settings_table(conn: 'connection'):
@@ -245,10 +770,20 @@ def populate_settings_table(conn: 'connection'):
             """
         )
         conn.commit()
+        # bumped by every ingestion that changed data, part of the data version of reports
         cur.execute(
             """
             INSERT INTO settings (setting_name, setting_value)
-            VALUES ('generate_new_report', 'true')
+            VALUES ('ingestion_generation', '0')
+            ON CONFLICT DO NOTHING;
+            """
+        )
+        conn.commit()
+        # latest status counted in store_lifetime_totals, empty before the first refresh
+        cur.execute(
+            """
+            INSERT INTO settings (setting_name, setting_value)
+            VALUES ('lifetime_totals_checkpoint', '')
             ON CONFLICT DO NOTHING;
             """
         )
@@ -256,6 +791,19 @@ def populate_settings_table(conn: 'connection'):
         logger.debug("Populated settings table")
 
 
+def bump_ingestion_generation(conn: 'connection'):
+    """Start a new data version, reports of older versions are no longer handed out by trigger_report"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE settings
+            SET setting_value = (setting_value::BIGINT + 1)::VARCHAR
+            WHERE setting_name = 'ingestion_generation';
+            """
+        )
+        conn.commit()
+
+
 def get_settings(conn: 'connection', setting_name: str) -> dict:
     """Returns settings as a dict"""
     with conn.cursor() as cur:
@@ -270,32 +818,53 @@ def get_settings(conn: 'connection', setting_name: str) -> dict:
         return cur.fetchone()
 
 
-def populate_db(conn: 'connection', is_update: bool = False):
-    """Populate Tables"""
-    SQL_STRING = """
-                CREATE TEMP TABLE tmp_table 
-                ON COMMIT DROP
-                AS
-                SELECT * 
-                FROM {main_table}
-                WITH NO DATA;
-
-                COPY tmp_table from STDIN DELIMITER ',' CSV HEADER;
-
-                INSERT INTO {main_table}
-                SELECT *
-                FROM tmp_table
-                ON CONFLICT DO NOTHING;
-                """.strip()
+def on_pooled_connection(populate: Callable, *args):
+    """Call populate with a connection of its own from the pool"""
+    with pooled_connection() as conn:
+        return populate(conn, *args)
+
 
+def populate_db(conn: 'connection'):
+    """Populate Tables"""
     cur: 'cursor'
     # Load store_status
     populate_settings_table(conn)
     if get_settings(conn, 'csv_data_changed') == ['true']:
         logger.info("Populating data tables")
-        populate_store_status(conn, SQL_STRING, CSV_DIR / 'store_status_clean.csv')
-        populate_time_zone_table(conn, SQL_STRING, CSV_DIR / 'time_zone_info_clean.csv')
-        populate_menu_hours_table(conn, SQL_STRING, CSV_DIR / 'menu_hours_clean.csv')
+        if config.STREAM_INGESTION:
+            store_status_file = lambda: open_store_status_stream(file_url(files['store_status']))
+        else:
+            store_status_file = CSV_DIR / 'store_status_clean.csv'
+        if config.INGEST_WORKERS > 1:
+            # the tables are independent, the small ones load over pooled connections of their own
+            # while store_status loads over conn, so ingestion takes two connections besides conn
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                time_zones_future = executor.submit(
+                    on_pooled_connection, populate_time_zone_table, CSV_DIR / 'time_zone_info_clean.csv'
+                )
+                menu_hours_future = executor.submit(
+                    on_pooled_connection, populate_menu_hours_table, CSV_DIR / 'menu_hours_clean.csv'
+                )
+                first_new_status = populate_store_status(conn, store_status_file)
+                new_time_zones = time_zones_future.result()
+                new_menu_hours = menu_hours_future.result()
+        else:
+            first_new_status = populate_store_status(conn, store_status_file)
+            new_time_zones = populate_time_zone_table(conn, CSV_DIR / 'time_zone_info_clean.csv')
+            new_menu_hours = populate_menu_hours_table(conn, CSV_DIR / 'menu_hours_clean.csv')
+        if new_time_zones or new_menu_hours:
+            # store hours or timezones changed, every bucket may be counted differently
+            refresh_store_status_hourly(conn)
+        elif first_new_status:
+            refresh_store_status_hourly(conn, first_new_status)
+        if first_new_status:
+            refresh_store_status_hourly_summary(conn, min(first_new_status.values()))
+        if new_time_zones or new_menu_hours:
+            reset_store_lifetime_totals(conn)
+        elif first_new_status:
+            mark_store_lifetime_totals_stale(conn, first_new_status)
+        if first_new_status or new_time_zones or new_menu_hours:
+            bump_ingestion_generation(conn)
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -305,14 +874,8 @@ def populate_db(conn: 'connection', is_update: bool = False):
                 """
             )
             conn.commit()
-            if is_update:
-                # set generate_new_report to true
-                cur.execute(
-                    """
-                    UPDATE settings
-                    SET setting_value = 'true'
-                    WHERE setting_name = 'generate_new_report';
-                    """
-                )
-                conn.commit()
         logger.info("Populated data tables")
+
+    with conn.cursor() as cur:
+        if is_table_empty(cur, 'store_status_hourly') and not is_table_empty(cur, 'store_status'):
+            refresh_store_status_hourly(conn)
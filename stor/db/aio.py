@@ -0,0 +1,86 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+import asyncio
+import datetime
+
+import asyncpg
+from loguru import logger
+
+from .. import config
+from . import DB_CONFIG, PoolTimeout
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool() -> asyncpg.Pool:
+    """asyncpg pool of the event loop, created on first use"""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                user=DB_CONFIG['user'],
+                password=DB_CONFIG['password'],
+                host=DB_CONFIG['host'],
+                port=int(DB_CONFIG['port']),
+                database=DB_CONFIG['dbname'],
+                min_size=config.DB_POOL_MIN_SIZE,
+                max_size=config.DB_POOL_MAX_SIZE,
+            )
+            logger.debug(f"Created async connection pool of up to {config.DB_POOL_MAX_SIZE} connections to {DB_CONFIG['dbname']}")
+        return _pool
+
+
+async def close_async_pool():
+    """Close the asyncpg pool, waiting for checked out connections"""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+@asynccontextmanager
+async def async_pooled_connection() -> AsyncIterator[asyncpg.Connection]:
+    """Connection from the asyncpg pool, waiting up to DB_POOL_TIMEOUT seconds for a free one"""
+    pool = await get_async_pool()
+    try:
+        conn = await pool.acquire(timeout=config.DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout(f"No database connection free after {config.DB_POOL_TIMEOUT} seconds")
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def fetch_ingestion_generation(conn: asyncpg.Connection) -> int:
+    """Ingestion generation, bumped by every ingestion that changed data, a single row read"""
+    generation = await conn.fetchval(
+        "SELECT setting_value::BIGINT FROM settings WHERE setting_name = 'ingestion_generation'"
+    )
+    return generation or 0
+
+
+async def fetch_max_timestamp(conn: asyncpg.Connection) -> Optional[datetime.datetime]:
+    """``get_max_timestamp`` over an asyncpg connection"""
+    if config.TIMESCALE_CONTINUOUS_AGGREGATE:
+        return await conn.fetchval("SELECT MAX(last_timestamp_utc) FROM store_status_hourly_summary")
+    return await conn.fetchval("SELECT MAX(timestamp_utc) FROM store_status")
+
+
+async def fetch_data_version(conn: asyncpg.Connection) -> Tuple[Optional[datetime.datetime], int]:
+    """``get_data_version`` over an asyncpg connection"""
+    return await fetch_max_timestamp(conn), await fetch_ingestion_generation(conn)
+
+
+def async_pool_metrics() -> Dict[str, int]:
+    """Size counters of the asyncpg pool, empty before its first use"""
+    if _pool is None:
+        return {}
+    return {
+        'max_size': _pool.get_max_size(),
+        'size': _pool.get_size(),
+        'idle': _pool.get_idle_size(),
+        'in_use': _pool.get_size() - _pool.get_idle_size(),
+    }
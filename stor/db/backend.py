@@ -0,0 +1,327 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+import datetime
+import hashlib
+import threading
+import zoneinfo
+
+import numpy as np
+from loguru import logger
+
+from .. import config
+from ..kernel import EPOCH, StatusLogArrays, to_epoch_microseconds
+from ..status_log import StoreStatusLog
+from . import functions, pooled_connection
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection
+
+StatusRow = Tuple[int, bool, datetime.datetime, datetime.datetime]
+StoreHours = Dict[int, Tuple[datetime.time, datetime.time]]
+
+
+class StorageBackend(ABC):
+    """Read access to stores, their status logs, store hours and timezones
+
+    Methods mirror the ones of ``stor.db.functions`` of the same name, so the report
+    can be computed from any backend.
+    """
+
+    @abstractmethod
+    def get_all_stores(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    def iter_store_status_logs(
+            self,
+            start_time: Optional[datetime.datetime] = None,
+            store_ids: Optional[List[int]] = None,
+            end_time: Optional[datetime.datetime] = None
+    ) -> Iterator[Tuple[int, str, List[StatusRow]]]:
+        ...
+
+    def iter_status_log_arrays(
+            self,
+            start_time: Optional[datetime.datetime] = None,
+            store_ids: Optional[List[int]] = None,
+            end_time: Optional[datetime.datetime] = None
+    ) -> Iterator[Tuple[int, StatusLogArrays]]:
+        """``iter_store_status_logs`` as arrays for the kernels"""
+        for store_id, timezone, status_log in self.iter_store_status_logs(start_time, store_ids, end_time):
+            yield store_id, StoreStatusLog.from_rows(store_id, timezone, status_log).to_arrays()
+
+    @abstractmethod
+    def get_store_hours(self, store_id: int) -> StoreHours:
+        ...
+
+    @abstractmethod
+    def get_all_store_hours(self) -> Dict[int, StoreHours]:
+        ...
+
+    @abstractmethod
+    def get_store_timezone(self, store_id: int) -> str:
+        ...
+
+    @abstractmethod
+    def get_all_store_timezones(self) -> Dict[int, str]:
+        ...
+
+    @abstractmethod
+    def get_max_timestamp(self) -> Optional[datetime.datetime]:
+        ...
+
+    @abstractmethod
+    def get_data_version(self) -> Tuple[Optional[datetime.datetime], int]:
+        """Max timestamp and generation of the data read, the data version of the reports computed from it"""
+        ...
+
+
+class PostgresBackend(StorageBackend):
+    """The ingested tables of the Postgres database"""
+
+    def __init__(self, conn: 'connection'):
+        self.conn = conn
+
+    def get_all_stores(self) -> List[int]:
+        return functions.get_all_stores(self.conn)
+
+    def iter_store_status_logs(self, start_time=None, store_ids=None, end_time=None):
+        return functions.iter_store_status_logs(
+            self.conn, start_time, config.STATUS_LOG_ITERSIZE, store_ids, end_time
+        )
+
+    def get_store_hours(self, store_id: int) -> StoreHours:
+        return functions.get_store_hours(self.conn, store_id)
+
+    def get_all_store_hours(self) -> Dict[int, StoreHours]:
+        return functions.get_all_store_hours(self.conn)
+
+    def get_store_timezone(self, store_id: int) -> str:
+        return functions.get_store_timezone(self.conn, store_id)
+
+    def get_all_store_timezones(self) -> Dict[int, str]:
+        return functions.get_all_store_timezones(self.conn)
+
+    def get_max_timestamp(self) -> Optional[datetime.datetime]:
+        return functions.get_max_timestamp(self.conn)
+
+    def get_data_version(self) -> Tuple[Optional[datetime.datetime], int]:
+        return functions.get_data_version(self.conn)
+
+
+def csv_source(csv_dir: Path, name: str) -> str:
+    """read_csv of a csv file with every column as text, converted by the query reading it"""
+    path = str(csv_dir / f'{name}.csv').replace("'", "''")
+    return f"read_csv('{path}', header = true, all_varchar = true)"
+
+
+def load_duckdb(csv_dir: Path, database: str = ':memory:') -> 'duckdb.DuckDBPyConnection':
+    """Load the downloaded csv files of csv_dir into a DuckDB database
+
+    Rows are deduplicated the way ingestion into Postgres does: a poll reported twice
+    counts as active if any report says so, the first timezone of a store and the first
+    hours of a store and day win.
+    Timestamps are stored as UTC epoch microseconds.
+    """
+    conn = duckdb.connect(database)
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE store_status AS
+        SELECT store_id, BOOL_OR(status) AS status, timestamp_utc
+        FROM (
+            SELECT
+                CAST(store_id AS BIGINT) AS store_id,
+                status IN ('active', '1') AS status,
+                epoch_us(CAST(replace(timestamp_utc, ' UTC', '') AS TIMESTAMP)) AS timestamp_utc
+            FROM {csv_source(csv_dir, 'store_status')}
+        )
+        GROUP BY store_id, timestamp_utc
+        ORDER BY store_id, timestamp_utc
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE time_zone AS
+        SELECT CAST(store_id AS BIGINT) AS store_id, timezone_str
+        FROM (
+            SELECT *, row_number() OVER () AS line
+            FROM {csv_source(csv_dir, 'time_zone_info')}
+        )
+        QUALIFY row_number() OVER (PARTITION BY store_id ORDER BY line) = 1
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE menu_hours AS
+        SELECT
+            CAST(store_id AS BIGINT) AS store_id,
+            CAST(day AS SMALLINT) AS day_of_week,
+            CAST(start_time_local AS TIME) AS start_time_local,
+            CAST(end_time_local AS TIME) AS end_time_local
+        FROM (
+            SELECT *, row_number() OVER () AS line
+            FROM {csv_source(csv_dir, 'menu_hours')}
+        )
+        QUALIFY row_number() OVER (PARTITION BY store_id, day ORDER BY line) = 1
+        """
+    )
+    row_count = conn.execute("SELECT COUNT(*) FROM store_status").fetchone()[0]
+    logger.info(f"Loaded {row_count} statuses from {csv_dir} into DuckDB")
+    return conn
+
+
+class DuckDBBackend(StorageBackend):
+    """Tables of an embedded DuckDB database loaded by ``load_duckdb``
+
+    Status logs of all stores are read in one columnar scan and split into per store
+    arrays, without building a row object per status. generation identifies the csv
+    files loaded, it stands in for the ingestion generation of Postgres.
+    """
+
+    def __init__(self, conn: 'duckdb.DuckDBPyConnection', generation: int = 0):
+        self.conn = conn
+        self.generation = generation
+
+    def get_all_stores(self) -> List[int]:
+        return [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT store_id FROM store_status ORDER BY store_id"
+        ).fetchall()]
+
+    def iter_status_log_arrays(self, start_time=None, store_ids=None, end_time=None):
+        params = [
+            to_epoch_microseconds(start_time) if start_time else int(np.iinfo(np.int64).min),
+            to_epoch_microseconds(end_time) if end_time else int(np.iinfo(np.int64).max),
+        ]
+        if store_ids is None:
+            store_ids = self.get_all_stores()
+            stores_condition = ""
+        else:
+            store_ids = sorted(store_ids)
+            stores_condition = "AND store_id IN (SELECT UNNEST(?))"
+            params.append(store_ids)
+        timezones = self.get_all_store_timezones()
+        columns = self.conn.execute(
+            f"""
+            SELECT store_id, status, timestamp_utc
+            FROM store_status
+            WHERE timestamp_utc >= ? AND timestamp_utc <= ? {stores_condition}
+            ORDER BY store_id, timestamp_utc
+            """,
+            params
+        ).fetchnumpy()
+        row_store_ids = np.asarray(columns['store_id'], dtype=np.int64)
+        timestamps = np.asarray(columns['timestamp_utc'], dtype=np.int64)
+        statuses = np.asarray(columns['status'], dtype=np.bool_)
+        wanted = np.asarray(store_ids, dtype=np.int64)
+        # rows of every store are the run between its first and last row
+        starts = np.searchsorted(row_store_ids, wanted, side='left').tolist()
+        ends = np.searchsorted(row_store_ids, wanted, side='right').tolist()
+        for store_id, start, end in zip(store_ids, starts, ends):
+            yield store_id, StatusLogArrays(timestamps[start:end], statuses[start:end], timezones[store_id])
+
+    def iter_store_status_logs(self, start_time=None, store_ids=None, end_time=None):
+        for store_id, store_status in self.iter_status_log_arrays(start_time, store_ids, end_time):
+            tz = zoneinfo.ZoneInfo(store_status.timezone)
+            status_log = []
+            for status, timestamp in zip(store_status.statuses.tolist(), store_status.timestamps.tolist()):
+                timestamp_utc = EPOCH + datetime.timedelta(microseconds=timestamp)
+                status_log.append((store_id, status, timestamp_utc, timestamp_utc.astimezone(tz).replace(tzinfo=None)))
+            yield store_id, store_status.timezone, status_log
+
+    def get_store_hours(self, store_id: int) -> StoreHours:
+        store_hours = functions.default_store_hours()
+        store_hours.update({
+            day_of_week: (start_time_local, end_time_local)
+            for day_of_week, start_time_local, end_time_local in self.conn.execute(
+                "SELECT day_of_week, start_time_local, end_time_local FROM menu_hours WHERE store_id = ?",
+                [store_id]
+            ).fetchall()
+        })
+        return store_hours
+
+    def get_all_store_hours(self) -> Dict[int, StoreHours]:
+        all_store_hours = defaultdict(functions.default_store_hours)
+        for store_id, day_of_week, start_time_local, end_time_local in self.conn.execute(
+                "SELECT store_id, day_of_week, start_time_local, end_time_local FROM menu_hours"
+        ).fetchall():
+            all_store_hours[store_id][day_of_week] = (start_time_local, end_time_local)
+        return all_store_hours
+
+    def get_store_timezone(self, store_id: int) -> str:
+        row = self.conn.execute("SELECT timezone_str FROM time_zone WHERE store_id = ?", [store_id]).fetchone()
+        return row[0] if row else 'America/Chicago'
+
+    def get_all_store_timezones(self) -> Dict[int, str]:
+        all_store_timezones = defaultdict(lambda: 'America/Chicago')
+        all_store_timezones.update(self.conn.execute("SELECT store_id, timezone_str FROM time_zone").fetchall())
+        return all_store_timezones
+
+    def get_max_timestamp(self) -> Optional[datetime.datetime]:
+        max_timestamp = self.conn.execute("SELECT MAX(timestamp_utc) FROM store_status").fetchone()[0]
+        if max_timestamp is None:
+            return None
+        return EPOCH + datetime.timedelta(microseconds=max_timestamp)
+
+    def get_data_version(self) -> Tuple[Optional[datetime.datetime], int]:
+        return self.get_max_timestamp(), self.generation
+
+
+_duckdb: Optional[Tuple[int, 'duckdb.DuckDBPyConnection']] = None
+_duckdb_lock = threading.Lock()
+
+
+def csv_generation() -> int:
+    """Number identifying the csv files of CSV_DIR by their modification time and size
+
+    Downloads only replace a file whose content changed, so it is the same in every
+    process and across restarts until new data arrives.
+    """
+    version = repr(tuple(
+        (file.stat().st_mtime_ns, file.stat().st_size)
+        for file in (config.CSV_DIR / f'{name}.csv' for name in ('store_status', 'time_zone_info', 'menu_hours'))
+    ))
+    # positive, to fit report_cache.ingestion_generation
+    return int.from_bytes(hashlib.blake2b(version.encode(), digest_size=8).digest(), 'big') >> 1
+
+
+def get_duckdb_connection() -> Tuple['duckdb.DuckDBPyConnection', int]:
+    """Connection of its own to the process wide DuckDB database, loaded again when the csv files change
+
+    Returns the connection and the ``csv_generation`` of the files loaded.
+    """
+    global _duckdb
+    generation = csv_generation()
+    with _duckdb_lock:
+        if _duckdb is None or _duckdb[0] != generation:
+            _duckdb = (generation, load_duckdb(config.CSV_DIR))
+        return _duckdb[1].cursor(), generation
+
+
+@contextmanager
+def open_backend() -> Iterator[StorageBackend]:
+    """Backend selected by STORAGE_BACKEND, for the block"""
+    if config.STORAGE_BACKEND == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError("STORAGE_BACKEND is duckdb but duckdb is not installed")
+        conn, generation = get_duckdb_connection()
+        try:
+            yield DuckDBBackend(conn, generation)
+        finally:
+            conn.close()
+    else:
+        with pooled_connection() as conn:
+            yield PostgresBackend(conn)
+
+
+def get_backend_data_version() -> Tuple[Optional[datetime.datetime], int]:
+    """Data version of the backend selected by STORAGE_BACKEND"""
+    with open_backend() as backend:
+        return backend.get_data_version()
@@ -1,7 +1,11 @@
-from typing import TYPE_CHECKING, List, Tuple, Dict
+from typing import TYPE_CHECKING, List, Tuple, Dict, Iterator, Optional
+from collections import defaultdict
+from itertools import groupby
 
 import datetime
 
+from .. import config
+
 if TYPE_CHECKING:
     from psycopg2.extensions import connection, cursor
 
@@ -9,9 +13,18 @@ if TYPE_CHECKING:
 __all__ = [
     'get_all_stores',
     'get_store_status_log',
+    'iter_store_status_logs',
+    'store_exists',
     'get_store_hours',
+    'get_all_store_hours',
     'get_store_timezone',
+    'get_all_store_timezones',
     'get_max_timestamp',
+    'get_data_version',
+    'get_report_for_all_stores',
+    'get_hourly_rollup_totals',
+    'get_statuses_with_next',
+    'get_last_statuses',
 ]
 
 
@@ -45,6 +58,66 @@ def get_store_status_log(conn: 'connection', store_id: int, time_zone: str) -> L
         return cur.fetchall()
 
 
+def iter_store_status_logs(
+        conn: 'connection',
+        start_time: Optional[datetime.datetime] = None,
+        itersize: int = 10000,
+        store_ids: Optional[List[int]] = None,
+        end_time: Optional[datetime.datetime] = None
+) -> Iterator[Tuple[int, str, List[Tuple[int, bool, datetime.datetime, datetime.datetime]]]]:
+    """Stream status logs of all stores using a server side cursor
+
+    Yields ``(store_id, timezone, status_log)`` one store at a time, ordered by store_id,
+    the status log has the same shape as ``get_store_status_log``. Stores without any
+    status after ``start_time`` are yielded with an empty log. If ``store_ids`` is given
+    only those stores are streamed, if ``end_time`` is given statuses after it are left out.
+    """
+    if store_ids is None:
+        stores_query = "SELECT DISTINCT store_id FROM store_status"
+    else:
+        stores_query = "SELECT UNNEST(%(store_ids)s::BIGINT[]) AS store_id"
+    with conn.cursor(name='store_status_logs') as cur:
+        cur.itersize = itersize
+        cur.execute(
+            """
+            SELECT
+                stores.store_id,
+                COALESCE(tz.timezone_str, 'America/Chicago') AS timezone_str,
+                s.status,
+                s.timestamp_utc,
+                (s.timestamp_utc AT TIME ZONE COALESCE(tz.timezone_str, 'America/Chicago')) AS timestamp_local
+            FROM ({stores_query}) stores
+            LEFT JOIN time_zone tz ON tz.store_id = stores.store_id
+            LEFT JOIN store_status s
+                ON s.store_id = stores.store_id
+                AND s.timestamp_utc >= COALESCE(%(start_time)s, '-infinity'::timestamptz)
+                AND s.timestamp_utc <= COALESCE(%(end_time)s, 'infinity'::timestamptz)
+            ORDER BY stores.store_id, s.timestamp_utc
+            """.format(stores_query=stores_query),
+            {'start_time': start_time, 'end_time': end_time, 'store_ids': store_ids}
+        )
+        for store_id, rows in groupby(cur, key=lambda row: row[0]):
+            status_log = []
+            for _, timezone, status, timestamp_utc, timestamp_local in rows:
+                if status is not None:
+                    status_log.append((store_id, status, timestamp_utc, timestamp_local))
+            yield store_id, timezone, status_log
+
+
+def store_exists(conn: 'connection', store_id: int) -> bool:
+    """Whether store has any status"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM store_status WHERE store_id = %s)", (store_id,))
+        return cur.fetchone()[0]
+
+
+def default_store_hours() -> Dict[int, Tuple[datetime.time, datetime.time]]:
+    """Store hours used for days without any menu hours, open 24*7"""
+    return {
+        day_of_week: (datetime.time(0, 0), datetime.time(23, 59)) for day_of_week in range(7)
+    }
+
+
 def get_store_hours(conn: 'connection', store_id: int) -> Dict[
     int, Tuple[datetime.time, datetime.time]
 ]:
@@ -57,15 +130,30 @@ def get_store_hours(conn: 'connection', store_id: int) -> Dict[
             WHERE store_id = {store_id}
             """.format(store_id=store_id)
         )
-        store_hours = {
-            day_of_week: (datetime.time(0, 0), datetime.time(23, 59)) for day_of_week in range(7)
-        }
+        store_hours = default_store_hours()
         for row in cur.fetchall():
             # day_of_week, start_time_local, end_time_local
             store_hours[row[1]] = (row[2], row[3])
         return store_hours
 
 
+def get_all_store_hours(conn: 'connection') -> Dict[
+    int, Dict[int, Tuple[datetime.time, datetime.time]]
+]:
+    """Get store hours of all stores from database, stores without menu hours get the default hours"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT store_id, day_of_week, start_time_local, end_time_local
+            FROM menu_hours
+            """
+        )
+        all_store_hours = defaultdict(default_store_hours)
+        for store_id, day_of_week, start_time_local, end_time_local in cur.fetchall():
+            all_store_hours[store_id][day_of_week] = (start_time_local, end_time_local)
+        return all_store_hours
+
+
 def get_store_timezone(conn: 'connection', store_id: int) -> str:
     """Get store timezone from database"""
     with conn.cursor() as cur:
@@ -84,14 +172,280 @@ def get_store_timezone(conn: 'connection', store_id: int) -> str:
         return cur.fetchone()[0]
 
 
+def get_all_store_timezones(conn: 'connection') -> Dict[int, str]:
+    """Get timezone of all stores from database, stores without a timezone get 'America/Chicago'"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT store_id, timezone_str
+            FROM time_zone
+            """
+        )
+        all_store_timezones = defaultdict(lambda: 'America/Chicago')
+        all_store_timezones.update(cur.fetchall())
+        return all_store_timezones
+
+
 def get_max_timestamp(conn: 'connection') -> datetime.datetime:
     """Get max timestamp from database"""
+    with conn.cursor() as cur:
+        if config.TIMESCALE_CONTINUOUS_AGGREGATE:
+            cur.execute(
+                """
+                SELECT MAX(last_timestamp_utc)
+                FROM store_status_hourly_summary
+                """
+            )
+        else:
+            cur.execute(
+                """
+                SELECT MAX(timestamp_utc)
+                FROM store_status
+                """
+            )
+        return cur.fetchone()[0]
+
+
+def get_data_version(conn: 'connection') -> Tuple[Optional[datetime.datetime], int]:
+    """Max timestamp and ingestion generation of the data, reports of one version are identical"""
     with conn.cursor() as cur:
         cur.execute(
             """
-            SELECT MAX(timestamp_utc)
-            FROM store_status
+            SELECT setting_value::BIGINT
+            FROM settings
+            WHERE setting_name = 'ingestion_generation'
             """
         )
-        return cur.fetchone()[0]
+        row = cur.fetchone()
+    return get_max_timestamp(conn), row[0] if row else 0
+
+
+def get_report_for_all_stores(conn: 'connection', end_time: datetime.datetime, itersize: int = 2000) -> Iterator[
+    Tuple[int, int, int, int, int, int, int]
+]:
+    """Get report rows for every store, computed inside the database
+
+    Mirrors ``calculate_relative_report``: the time since the previous poll is counted
+    only if the poll falls within business hours, and the time between the last poll
+    and ``end_time`` is always counted with the status of the last poll.
+    """
+    with conn.cursor(name='report_for_all_stores') as cur:
+        cur.itersize = itersize
+        cur.execute(
+            """
+            WITH windows (window_name, start_time) AS (
+                VALUES
+                    ('last_hour', %(end_time)s::timestamptz - INTERVAL '1 hour'),
+                    ('last_day', %(end_time)s::timestamptz - INTERVAL '1 day'),
+                    ('last_week', %(end_time)s::timestamptz - INTERVAL '7 days')
+            ),
+            stores AS (
+                SELECT DISTINCT store_id
+                FROM store_status
+            ),
+            status_log AS (
+                SELECT
+                    s.store_id,
+                    s.status,
+                    s.timestamp_utc,
+                    s.timestamp_utc AT TIME ZONE COALESCE(tz.timezone_str, 'America/Chicago') AS timestamp_local
+                FROM store_status s
+                LEFT JOIN time_zone tz ON tz.store_id = s.store_id
+                WHERE s.timestamp_utc >= %(end_time)s::timestamptz - INTERVAL '7 days'
+                  AND s.timestamp_utc <= %(end_time)s::timestamptz
+            ),
+            windowed AS (
+                SELECT
+                    w.window_name,
+                    l.store_id,
+                    l.status,
+                    l.timestamp_utc,
+                    l.timestamp_local,
+                    LAG(l.status) OVER store_window AS previous_status,
+                    LAG(l.timestamp_utc) OVER store_window AS previous_timestamp_utc,
+                    LEAD(l.timestamp_utc) OVER store_window IS NULL AS is_last
+                FROM status_log l
+                JOIN windows w ON l.timestamp_utc >= w.start_time
+                WINDOW store_window AS (PARTITION BY w.window_name, l.store_id ORDER BY l.timestamp_utc)
+            ),
+            durations AS (
+                SELECT
+                    wd.window_name,
+                    wd.store_id,
+                    wd.status,
+                    wd.previous_status,
+                    wd.is_last,
+                    CASE
+                        WHEN wd.previous_timestamp_utc IS NOT NULL
+                            AND wd.timestamp_local::time BETWEEN
+                                COALESCE(mh.start_time_local, TIME '00:00')
+                                AND COALESCE(mh.end_time_local, TIME '23:59')
+                        THEN EXTRACT(EPOCH FROM wd.timestamp_utc - wd.previous_timestamp_utc)
+                        ELSE 0
+                    END AS seconds_since_last_status,
+                    CASE
+                        WHEN wd.is_last
+                        THEN EXTRACT(EPOCH FROM %(end_time)s::timestamptz - wd.timestamp_utc)
+                        ELSE 0
+                    END AS seconds_until_end
+                FROM windowed wd
+                LEFT JOIN menu_hours mh
+                    ON mh.store_id = wd.store_id
+                    AND mh.day_of_week = EXTRACT(ISODOW FROM wd.timestamp_local) - 1
+            ),
+            totals AS (
+                SELECT
+                    window_name,
+                    store_id,
+                    SUM(
+                        CASE WHEN previous_status THEN seconds_since_last_status ELSE 0 END
+                        + CASE WHEN status THEN seconds_until_end ELSE 0 END
+                    ) AS uptime_seconds,
+                    SUM(
+                        CASE WHEN NOT previous_status THEN seconds_since_last_status ELSE 0 END
+                        + CASE WHEN NOT status THEN seconds_until_end ELSE 0 END
+                    ) AS downtime_seconds
+                FROM durations
+                GROUP BY window_name, store_id
+            )
+            SELECT
+                st.store_id,
+                COALESCE(FLOOR(MAX(t.uptime_seconds) FILTER (WHERE t.window_name = 'last_hour')), 0)::BIGINT / 60,
+                COALESCE(FLOOR(MAX(t.uptime_seconds) FILTER (WHERE t.window_name = 'last_day')), 0)::BIGINT / 3600,
+                COALESCE(FLOOR(MAX(t.uptime_seconds) FILTER (WHERE t.window_name = 'last_week')), 0)::BIGINT / 3600,
+                COALESCE(FLOOR(MAX(t.downtime_seconds) FILTER (WHERE t.window_name = 'last_hour')), 0)::BIGINT / 60,
+                COALESCE(FLOOR(MAX(t.downtime_seconds) FILTER (WHERE t.window_name = 'last_day')), 0)::BIGINT / 3600,
+                COALESCE(FLOOR(MAX(t.downtime_seconds) FILTER (WHERE t.window_name = 'last_week')), 0)::BIGINT / 3600
+            FROM stores st
+            LEFT JOIN totals t ON t.store_id = st.store_id
+            GROUP BY st.store_id
+            """,
+            {'end_time': end_time}
+        )
+        for row in cur:
+            yield tuple(row)
+
+
+def get_hourly_rollup_totals(
+        conn: 'connection',
+        from_hours: List[datetime.datetime],
+        until_hour: datetime.datetime
+) -> Dict[int, List[Tuple[int, int]]]:
+    """Sum hourly rollup of every store from each of from_hours on and before until_hour,
+    as uptime and downtime microseconds"""
+    columns = ",\n".join(
+        f"""
+        COALESCE(SUM(uptime_microseconds) FILTER (WHERE hour_utc >= %(from_hour_{index})s), 0),
+        COALESCE(SUM(downtime_microseconds) FILTER (WHERE hour_utc >= %(from_hour_{index})s), 0)
+        """
+        for index in range(len(from_hours))
+    )
+    params = {f'from_hour_{index}': from_hour for index, from_hour in enumerate(from_hours)}
+    params['earliest'] = min(from_hours)
+    params['until_hour'] = until_hour
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT store_id, {columns}
+            FROM store_status_hourly
+            WHERE hour_utc >= %(earliest)s
+              AND hour_utc < %(until_hour)s
+            GROUP BY store_id
+            """.format(columns=columns),
+            params
+        )
+        return {
+            row[0]: [(int(row[index]), int(row[index + 1])) for index in range(1, len(row), 2)]
+            for row in cur.fetchall()
+        }
 
+
+def get_statuses_with_next(
+        conn: 'connection',
+        time_ranges: List[Tuple[datetime.datetime, datetime.datetime]]
+) -> List[Tuple[int, bool, datetime.datetime, datetime.datetime]]:
+    """Get statuses within any of the [start, end) time ranges, with the timestamp of the next status of the store
+
+    Statuses that are the last of their store are left out.
+    """
+    if not time_ranges:
+        return []
+    conditions = " OR ".join(
+        "(s.timestamp_utc >= %s AND s.timestamp_utc < %s)" for _ in time_ranges
+    )
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT s.store_id, s.status, s.timestamp_utc, next_status.timestamp_utc
+            FROM store_status s
+            CROSS JOIN LATERAL (
+                SELECT n.timestamp_utc
+                FROM store_status n
+                WHERE n.store_id = s.store_id
+                  AND n.timestamp_utc > s.timestamp_utc
+                ORDER BY n.timestamp_utc
+                LIMIT 1
+            ) next_status
+            WHERE {conditions}
+            """.format(conditions=conditions),
+            [timestamp for time_range in time_ranges for timestamp in time_range]
+        )
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def get_last_statuses(
+        conn: 'connection',
+        start_time: datetime.datetime,
+        end_time: datetime.datetime
+) -> Dict[int, Tuple[bool, datetime.datetime, Optional[datetime.datetime]]]:
+    """Get the last status at or before end_time of every store with a status at or after start_time
+
+    Returns the status, its timestamp and the timestamp of the next status of the store,
+    after end_time, or None if there is none.
+    """
+    if config.TIMESCALE_CONTINUOUS_AGGREGATE:
+        # the latest hour of a store before the hour of end_time holds its last status then,
+        # only the hour of end_time is read from store_status
+        last_statuses_query = """
+            SELECT store_id, last_status AS status, last_timestamp_utc AS timestamp_utc
+            FROM store_status_hourly_summary
+            WHERE hour_utc >= time_bucket(INTERVAL '1 hour', %(start_time)s::timestamptz)
+              AND hour_utc < time_bucket(INTERVAL '1 hour', %(end_time)s::timestamptz)
+              AND last_timestamp_utc >= %(start_time)s
+            UNION ALL
+            SELECT store_id, status, timestamp_utc
+            FROM store_status
+            WHERE timestamp_utc >= GREATEST(%(start_time)s, time_bucket(INTERVAL '1 hour', %(end_time)s::timestamptz))
+              AND timestamp_utc <= %(end_time)s
+        """
+    else:
+        last_statuses_query = """
+            SELECT store_id, status, timestamp_utc
+            FROM store_status
+            WHERE timestamp_utc >= %(start_time)s
+              AND timestamp_utc <= %(end_time)s
+        """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT l.store_id, l.status, l.timestamp_utc, next_status.timestamp_utc
+            FROM (
+                SELECT DISTINCT ON (store_id) store_id, status, timestamp_utc
+                FROM ({last_statuses_query}) last_statuses
+                ORDER BY store_id, timestamp_utc DESC
+            ) l
+            LEFT JOIN LATERAL (
+                SELECT n.timestamp_utc
+                FROM store_status n
+                WHERE n.store_id = l.store_id
+                  AND n.timestamp_utc > l.timestamp_utc
+                ORDER BY n.timestamp_utc
+                LIMIT 1
+            ) next_status ON TRUE
+            """.format(last_statuses_query=last_statuses_query),
+            {'start_time': start_time, 'end_time': end_time}
+        )
+        return {
+            store_id: (status, timestamp_utc, next_timestamp_utc)
+            for store_id, status, timestamp_utc, next_timestamp_utc in cur.fetchall()
+        }
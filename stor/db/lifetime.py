@@ -0,0 +1,204 @@
+from itertools import groupby
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+import datetime
+
+from loguru import logger
+from psycopg2 import extras as pg_extras
+
+from .. import config
+from ..business_hours import store_hours_mask
+from ..kernel import EPOCH, relative_report_kernel, to_epoch_microseconds
+from ..status_log import StoreStatusLog
+from .functions import get_all_store_hours, get_all_store_timezones
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection, cursor
+
+
+def write_lifetime_totals(cur: 'cursor', totals: List[Tuple[int, int, int, bool, datetime.datetime]]):
+    pg_extras.execute_values(
+        cur,
+        """
+        INSERT INTO store_lifetime_totals (
+            store_id, uptime_microseconds, downtime_microseconds, last_status, last_timestamp_utc, stale
+        )
+        VALUES %s
+        ON CONFLICT (store_id) DO UPDATE SET
+            uptime_microseconds = EXCLUDED.uptime_microseconds,
+            downtime_microseconds = EXCLUDED.downtime_microseconds,
+            last_status = EXCLUDED.last_status,
+            last_timestamp_utc = EXCLUDED.last_timestamp_utc,
+            stale = FALSE
+        """,
+        totals,
+        template="(%s, %s, %s, %s, %s, FALSE)",
+        page_size=1000
+    )
+
+
+def refresh_store_lifetime_totals(conn: 'connection', end_time: datetime.datetime, batch_size: int = 1000) -> int:
+    """Add statuses after the checkpoint up to end_time to the lifetime totals, returns stores updated
+
+    Totals hold the time between consecutive statuses, counted like ``calculate_relative_report``
+    does, and the last status of the store, so new statuses continue from it. Stale stores
+    are recomputed from their first status. Refreshes wait for each other on the checkpoint.
+    """
+    all_store_hours = get_all_store_hours(conn)
+    all_store_timezones = get_all_store_timezones(conn)
+    with conn.cursor() as cur, conn.cursor(name='store_lifetime_totals_refresh') as read_cur:
+        cur.execute(
+            """
+            SELECT NULLIF(setting_value, '')::timestamptz
+            FROM settings
+            WHERE setting_name = 'lifetime_totals_checkpoint'
+            FOR UPDATE
+            """
+        )
+        row = cur.fetchone()
+        checkpoint = row[0] if row else None
+        cur.execute(
+            """
+            SELECT store_id, uptime_microseconds, downtime_microseconds, last_status, last_timestamp_utc
+            FROM store_lifetime_totals
+            WHERE NOT stale
+            """
+        )
+        totals = {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+
+        read_cur.itersize = config.STATUS_LOG_ITERSIZE
+        read_cur.execute(
+            """
+            SELECT s.store_id, s.status, s.timestamp_utc
+            FROM store_status s
+            WHERE s.timestamp_utc > COALESCE(%(checkpoint)s, '-infinity'::timestamptz)
+              AND s.timestamp_utc <= %(end_time)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM store_lifetime_totals t WHERE t.store_id = s.store_id AND t.stale
+              )
+            UNION ALL
+            SELECT s.store_id, s.status, s.timestamp_utc
+            FROM store_lifetime_totals t
+            JOIN store_status s ON s.store_id = t.store_id AND s.timestamp_utc <= %(end_time)s
+            WHERE t.stale
+            ORDER BY 1, 3
+            """,
+            {'checkpoint': checkpoint, 'end_time': end_time}
+        )
+
+        store_count = 0
+        updated = []
+        for store_id, rows in groupby(read_cur, key=lambda row: row[0]):
+            uptime, downtime, last_status, last_timestamp_utc = totals.get(store_id, (0, 0, None, None))
+            status_log = StoreStatusLog(store_id, all_store_timezones[store_id])
+            # the time since the last counted status is counted with the first new one
+            if last_timestamp_utc is not None:
+                status_log.append(last_status, last_timestamp_utc)
+            for _, status, timestamp_utc in rows:
+                status_log.append(status, timestamp_utc)
+            store_status = status_log.to_arrays()
+            first, last = int(store_status.timestamps[0]), int(store_status.timestamps[-1])
+            new_uptime, new_downtime = relative_report_kernel(
+                store_status, store_hours_mask(store_status, all_store_hours[store_id], first), first, last
+            )
+            updated.append((
+                store_id,
+                uptime + new_uptime,
+                downtime + new_downtime,
+                bool(store_status.statuses[-1]),
+                EPOCH + datetime.timedelta(microseconds=last)
+            ))
+            store_count += 1
+            if len(updated) >= batch_size:
+                write_lifetime_totals(cur, updated)
+                updated = []
+        if updated:
+            write_lifetime_totals(cur, updated)
+
+        cur.execute(
+            """
+            UPDATE settings
+            SET setting_value = %s
+            WHERE setting_name = 'lifetime_totals_checkpoint'
+            """,
+            (end_time.isoformat(),)
+        )
+    conn.commit()
+    logger.debug(f"Refreshed lifetime totals of {store_count} stores up to {end_time}")
+    return store_count
+
+
+def mark_store_lifetime_totals_stale(conn: 'connection', first_new_status: Dict[int, datetime.datetime]):
+    """Mark stores with new statuses at or before the checkpoint stale, a refresh would miss them
+
+    Waits for a refresh in progress, so the checkpoint it moves to is the one compared with.
+    """
+    with conn.cursor() as cur:
+        # conflicts with the FOR UPDATE of refresh_store_lifetime_totals, held until it commits
+        cur.execute(
+            """
+            SELECT 1
+            FROM settings
+            WHERE setting_name = 'lifetime_totals_checkpoint'
+            FOR SHARE
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO store_lifetime_totals (store_id, uptime_microseconds, downtime_microseconds, stale)
+            SELECT new.store_id, 0, 0, TRUE
+            FROM UNNEST(%s::BIGINT[], %s::timestamptz[]) AS new(store_id, timestamp_utc)
+            JOIN settings
+                ON settings.setting_name = 'lifetime_totals_checkpoint'
+                AND new.timestamp_utc <= NULLIF(settings.setting_value, '')::timestamptz
+            ON CONFLICT (store_id) DO UPDATE SET stale = TRUE
+            """,
+            (list(first_new_status.keys()), list(first_new_status.values()))
+        )
+        if cur.rowcount:
+            logger.info(f"{cur.rowcount} stores got statuses before the lifetime totals checkpoint")
+    conn.commit()
+
+
+def reset_store_lifetime_totals(conn: 'connection'):
+    """Drop every lifetime total, the next refresh starts over from the first status
+
+    Refused with TIMESCALE_RETAIN_FOR, statuses older than the retention could not be
+    counted again, the totals stay as counted with the previous store hours and timezones.
+    """
+    if config.TIMESCALE_RETAIN_FOR:
+        logger.warning(
+            "Not resetting lifetime totals for the changed store hours or timezones, "
+            "TIMESCALE_RETAIN_FOR dropped statuses they count"
+        )
+        return
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE store_lifetime_totals;")
+        cur.execute(
+            """
+            UPDATE settings
+            SET setting_value = ''
+            WHERE setting_name = 'lifetime_totals_checkpoint'
+            """
+        )
+    conn.commit()
+
+
+def iter_store_lifetime_totals(conn: 'connection', end_time: datetime.datetime) -> Iterator[Tuple[int, int, int]]:
+    """Lifetime uptime and downtime of every store in microseconds, the last status counted up to end_time"""
+    end_time_microseconds = to_epoch_microseconds(end_time)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT store_id, uptime_microseconds, downtime_microseconds, last_status, last_timestamp_utc
+            FROM store_lifetime_totals
+            WHERE NOT stale AND last_timestamp_utc IS NOT NULL
+            ORDER BY store_id
+            """
+        )
+        for store_id, uptime, downtime, last_status, last_timestamp_utc in cur:
+            time_since_last_status = end_time_microseconds - to_epoch_microseconds(last_timestamp_utc)
+            if last_status:
+                uptime += time_since_last_status
+            else:
+                downtime += time_since_last_status
+            yield store_id, uptime, downtime
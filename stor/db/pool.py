@@ -0,0 +1,164 @@
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions as pg_extensions
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the pool timeout"""
+
+
+class ConnectionPool:
+    """Thread safe pool of psycopg2 connections
+
+    Callers wait for a free connection instead of failing when every connection is in
+    use. Connections idle for longer than health_check_after seconds are pinged before
+    being handed out, connections that are closed or broke while in use are replaced.
+    """
+
+    def __init__(self, min_size: int, max_size: int, timeout: float, health_check_after: float, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.connect_kwargs = connect_kwargs
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        # (connection, time it was returned), most recently returned last
+        self._idle: List[tuple] = []
+        self._in_use = 0
+        self._closed = False
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self) -> 'connection':
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def _is_healthy(self, conn: 'connection', idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> 'connection':
+        """Check a connection out, waiting up to timeout seconds for a free one"""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"No database connection free after {self.timeout} seconds")
+        waited = time.monotonic() - started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._connect()
+                elif self._is_healthy(*idle):
+                    conn = idle[0]
+                else:
+                    self._discard(idle[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return conn
+
+    def putconn(self, conn: 'connection', discard: bool = False):
+        """Return a connection, rolled back, or closed if discard or broken"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        discard = discard or bool(conn.closed)
+
+        with self._lock:
+            self._in_use -= 1
+            keep = not discard and not self._closed and len(self._idle) < self.max_size
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+        if not keep:
+            self._discard(conn)
+        self._slots.release()
+
+    def _discard(self, conn: 'connection'):
+        with self._lock:
+            self.recycled += 1
+        if not conn.closed:
+            conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator['connection']:
+        """Check a connection out for the block, commits on success and rolls back on error
+
+        A connection that broke inside the block is closed instead of returned.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            if not conn.closed and not conn.autocommit:
+                conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close every idle connection, checked out connections are closed when returned"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for conn, _ in idle:
+            conn.close()
+
+    def metrics(self) -> Dict[str, float]:
+        """Usage and wait time counters of the pool"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+                'wait_seconds_avg': round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
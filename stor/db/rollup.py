@@ -0,0 +1,123 @@
+from itertools import groupby
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import datetime
+
+from loguru import logger
+from psycopg2 import extras as pg_extras
+
+from .. import config
+from ..business_hours import store_hours_mask
+from ..kernel import EPOCH, MICROSECONDS_PER_HOUR, hourly_rollup_kernel
+from ..status_log import StoreStatusLog
+from .functions import get_all_store_hours, get_all_store_timezones
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection, cursor
+
+
+def write_hourly_buckets(
+        cur: 'cursor',
+        from_hours: Dict[int, datetime.datetime],
+        buckets: List[Tuple[int, datetime.datetime, int, int]]
+):
+    """Replace buckets of every store from its from_hour on"""
+    cur.execute(
+        """
+        DELETE FROM store_status_hourly h
+        USING UNNEST(%s::BIGINT[], %s::timestamptz[]) AS refreshed(store_id, from_hour)
+        WHERE h.store_id = refreshed.store_id
+          AND h.hour_utc >= refreshed.from_hour;
+        """,
+        (list(from_hours.keys()), list(from_hours.values()))
+    )
+    pg_extras.execute_values(
+        cur,
+        """
+        INSERT INTO store_status_hourly (store_id, hour_utc, uptime_microseconds, downtime_microseconds)
+        VALUES %s
+        """,
+        buckets,
+        page_size=1000
+    )
+
+
+def refresh_store_status_hourly(
+        conn: 'connection',
+        first_new_status: Optional[Dict[int, datetime.datetime]] = None,
+        batch_size: int = 1000
+):
+    """Recompute hourly rollup buckets touched by new statuses
+
+    first_new_status maps stores to their earliest newly inserted status. The bucket of the
+    status before it changes as well, so every bucket of the store from that status's hour
+    on is recomputed. Without first_new_status the whole table is rebuilt, with
+    TIMESCALE_RETAIN_FOR only from the first retained status of every store on, older
+    buckets are the only record of the dropped statuses and are kept as they were counted.
+    """
+    logger.info(f"Refreshing store_status_hourly for {len(first_new_status) if first_new_status else 'all'} stores")
+    all_store_hours = get_all_store_hours(conn)
+    all_store_timezones = get_all_store_timezones(conn)
+    with conn.cursor() as cur, conn.cursor(name='store_status_hourly_refresh') as read_cur:
+        read_cur.itersize = config.STATUS_LOG_ITERSIZE
+        if first_new_status is None:
+            if config.TIMESCALE_RETAIN_FOR:
+                logger.info("Keeping store_status_hourly buckets before the statuses TIMESCALE_RETAIN_FOR retains")
+            else:
+                cur.execute("TRUNCATE store_status_hourly;")
+            read_cur.execute(
+                """
+                SELECT store_id, status, timestamp_utc
+                FROM store_status
+                ORDER BY store_id, timestamp_utc
+                """
+            )
+        else:
+            read_cur.execute(
+                """
+                WITH refreshed AS (
+                    SELECT
+                        new.store_id,
+                        time_bucket(INTERVAL '1 hour', COALESCE(previous.timestamp_utc, new.timestamp_utc)) AS from_hour
+                    FROM UNNEST(%s::BIGINT[], %s::timestamptz[]) AS new(store_id, timestamp_utc)
+                    LEFT JOIN LATERAL (
+                        SELECT timestamp_utc
+                        FROM store_status s
+                        WHERE s.store_id = new.store_id
+                          AND s.timestamp_utc < new.timestamp_utc
+                        ORDER BY s.timestamp_utc DESC
+                        LIMIT 1
+                    ) previous ON TRUE
+                )
+                SELECT s.store_id, s.status, s.timestamp_utc
+                FROM refreshed
+                JOIN store_status s
+                    ON s.store_id = refreshed.store_id
+                    AND s.timestamp_utc >= refreshed.from_hour
+                ORDER BY s.store_id, s.timestamp_utc
+                """,
+                (list(first_new_status.keys()), list(first_new_status.values()))
+            )
+
+        from_hours = {}
+        buckets = []
+        for store_id, rows in groupby(read_cur, key=lambda row: row[0]):
+            status_log = StoreStatusLog(store_id, all_store_timezones[store_id])
+            for _, status, timestamp_utc in rows:
+                status_log.append(status, timestamp_utc)
+            store_status = status_log.to_arrays()
+            in_hours = store_hours_mask(store_status, all_store_hours[store_id], int(store_status.timestamps[0]))
+            hours, uptime, downtime = hourly_rollup_kernel(store_status, in_hours)
+
+            from_hour = int(store_status.timestamps[0]) // MICROSECONDS_PER_HOUR * MICROSECONDS_PER_HOUR
+            from_hours[store_id] = EPOCH + datetime.timedelta(microseconds=from_hour)
+            buckets.extend(
+                (store_id, EPOCH + datetime.timedelta(microseconds=hour), hour_uptime, hour_downtime)
+                for hour, hour_uptime, hour_downtime in zip(hours.tolist(), uptime.tolist(), downtime.tolist())
+            )
+            if len(from_hours) >= batch_size:
+                write_hourly_buckets(cur, from_hours, buckets)
+                from_hours, buckets = {}, []
+        if from_hours:
+            write_hourly_buckets(cur, from_hours, buckets)
+    conn.commit()
+    logger.debug("Refreshed store_status_hourly")
@@ -0,0 +1,201 @@
+from typing import List, Tuple, NamedTuple, Sequence
+import datetime
+
+import numpy as np
+
+MICROSECONDS_PER_HOUR = 60 * 60 * 1_000_000
+MICROSECONDS_PER_DAY = 24 * MICROSECONDS_PER_HOUR
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def time_to_microseconds(time: datetime.time) -> int:
+    """Convert time of day to microseconds since midnight"""
+    return ((time.hour * 60 + time.minute) * 60 + time.second) * 1_000_000 + time.microsecond
+
+
+def to_epoch_microseconds(timestamp: datetime.datetime) -> int:
+    """Convert aware datetime to integer microseconds since epoch, without float rounding"""
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+
+class StatusLogArrays(NamedTuple):
+    """Status log of a store as numpy arrays, ordered as the log"""
+    timestamps: np.ndarray
+    """UTC epoch microseconds, int64"""
+    statuses: np.ndarray
+    """True if store was open, bool"""
+    timezone: str
+
+    @classmethod
+    def from_rows(cls, store_status: Sequence, timezone: str) -> 'StatusLogArrays':
+        """Build from rows having ``is_open`` and ``timestamp_utc``, of a store in timezone"""
+        return cls(
+            np.fromiter(
+                (to_epoch_microseconds(row.timestamp_utc) for row in store_status),
+                dtype=np.int64, count=len(store_status)
+            ),
+            np.fromiter((row.is_open for row in store_status), dtype=np.bool_, count=len(store_status)),
+            timezone
+        )
+
+
+def relative_report_kernel(
+        store_status: StatusLogArrays,
+        in_hours: np.ndarray,
+        start_time: int,
+        end_time: int
+) -> Tuple[int, int]:
+    """Vectorized ``calculate_relative_report``, returns uptime and downtime in microseconds
+
+    in_hours tells for every status whether it falls within store hours. The time since the
+    previous status is counted with the previous status if the status falls within store
+    hours, the time between the last status and end_time is always counted with the last status.
+    """
+    in_window = store_status.timestamps >= start_time
+    timestamps = store_status.timestamps[in_window]
+    if not timestamps.size:
+        return 0, 0
+    statuses = store_status.statuses[in_window]
+    in_hours = in_hours[in_window][1:]
+
+    durations = np.diff(timestamps)
+    was_open = statuses[:-1]
+    uptime = int(durations[in_hours & was_open].sum())
+    downtime = int(durations[in_hours & ~was_open].sum())
+
+    time_since_last_status = end_time - int(timestamps[-1])
+    if statuses[-1]:
+        uptime += time_since_last_status
+    else:
+        downtime += time_since_last_status
+    return uptime, downtime
+
+
+def multi_window_report_kernel(
+        store_status: StatusLogArrays,
+        in_hours: np.ndarray,
+        start_times: Sequence[int],
+        end_time: int
+) -> List[Tuple[int, int]]:
+    """``relative_report_kernel`` for many windows ending at end_time in a single pass
+
+    The status log must be sorted by timestamp. Window starts are located with a binary
+    search and every window is the difference of cumulative sums over one sweep of the
+    log, so there is no copy of the log per window. Returns uptime and downtime in
+    microseconds for every window, in the order of start_times.
+    """
+    timestamps = store_status.timestamps
+    window_starts = np.searchsorted(timestamps, np.asarray(start_times, dtype=np.int64), side='left')
+    first = int(window_starts.min(initial=timestamps.size))
+    if first == timestamps.size:
+        return [(0, 0)] * len(window_starts)
+
+    # views of the part of the log covered by the longest window
+    timestamps = timestamps[first:]
+    statuses = store_status.statuses[first:]
+    in_hours = in_hours[first + 1:]
+
+    durations = np.diff(timestamps)
+    was_open = statuses[:-1]
+    # cumulative[i] holds the time counted up to status i of the sweep
+    uptime_cumulative = np.zeros(timestamps.size, dtype=np.int64)
+    np.cumsum(np.where(in_hours & was_open, durations, 0), out=uptime_cumulative[1:])
+    downtime_cumulative = np.zeros(timestamps.size, dtype=np.int64)
+    np.cumsum(np.where(in_hours & ~was_open, durations, 0), out=downtime_cumulative[1:])
+
+    time_since_last_status = end_time - int(timestamps[-1])
+    last_is_open = bool(statuses[-1])
+    report = []
+    for window_start in (window_starts - first).tolist():
+        if window_start == timestamps.size:
+            report.append((0, 0))
+            continue
+        uptime = int(uptime_cumulative[-1] - uptime_cumulative[window_start])
+        downtime = int(downtime_cumulative[-1] - downtime_cumulative[window_start])
+        if last_is_open:
+            uptime += time_since_last_status
+        else:
+            downtime += time_since_last_status
+        report.append((uptime, downtime))
+    return report
+
+
+def hourly_rollup_kernel(
+        store_status: StatusLogArrays,
+        in_hours: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Uptime and downtime in microseconds per UTC hour of a sorted status log
+
+    The time since a status and the next one is counted in the hour of the status, as
+    ``relative_report_kernel`` counts it, so summing the hours at or after a window start
+    gives the window without its tail. Returns hour starts in epoch microseconds, uptime
+    and downtime of every hour that has a status followed by another one.
+    """
+    timestamps = store_status.timestamps
+    if timestamps.size < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    durations = np.diff(timestamps)
+    was_open = store_status.statuses[:-1]
+    counted = in_hours[1:]
+    uptime = np.where(counted & was_open, durations, 0)
+    downtime = np.where(counted & ~was_open, durations, 0)
+
+    hours = timestamps[:-1] // MICROSECONDS_PER_HOUR
+    hour_starts = np.flatnonzero(np.diff(hours, prepend=hours[0] - 1))
+    return (
+        hours[hour_starts] * MICROSECONDS_PER_HOUR,
+        np.add.reduceat(uptime, hour_starts),
+        np.add.reduceat(downtime, hour_starts)
+    )
+
+
+def offset_transitions(tz: datetime.tzinfo, first_second: int, last_second: int) -> Tuple[List[int], List[int]]:
+    """UTC offsets in microseconds of tz between two epoch seconds, and the epoch microsecond each starts at
+
+    The first offset starts at the minimum int64. The offset is looked up once per UTC day
+    of the range, a change between two lookups is bisected down to the second it happens,
+    so this assumes a timezone changes its offset at most once a day.
+    """
+    def offset_at(second: int) -> int:
+        return datetime.datetime.fromtimestamp(second, tz).utcoffset() // ONE_MICROSECOND
+
+    transitions = [np.iinfo(np.int64).min]
+    offsets = [offset_at(first_second)]
+    previous_second = first_second
+    for day_end in range(first_second - first_second % 86400 + 86400, last_second + 86400, 86400):
+        second = min(day_end, last_second)
+        offset = offset_at(second)
+        if offset != offsets[-1]:
+            low, high = previous_second, second
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset_at(middle) == offsets[-1]:
+                    low = middle
+                else:
+                    high = middle
+            transitions.append(high * 1_000_000)
+            offsets.append(offset)
+        previous_second = second
+    return transitions, offsets
+
+
+def utc_offsets(tz: datetime.tzinfo, timestamps: np.ndarray) -> np.ndarray:
+    """UTC offset in microseconds in tz of every UTC epoch microsecond timestamp"""
+    if not timestamps.size:
+        return np.zeros(0, dtype=np.int64)
+
+    transitions, offsets = offset_transitions(
+        tz, int(timestamps.min()) // 1_000_000, int(timestamps.max()) // 1_000_000
+    )
+    return np.array(offsets, dtype=np.int64)[np.searchsorted(transitions, timestamps, side='right') - 1]
+
+
+def local_microseconds_of_week(tz: datetime.tzinfo, timestamps: np.ndarray) -> np.ndarray:
+    """Local time in tz as microseconds since monday midnight, of UTC epoch microsecond timestamps"""
+    local_timestamps = timestamps + utc_offsets(tz, timestamps)
+    # 1970-01-01 was a thursday
+    day_of_week = (local_timestamps // MICROSECONDS_PER_DAY + 3) % 7
+    return day_of_week * MICROSECONDS_PER_DAY + local_timestamps % MICROSECONDS_PER_DAY
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import time
+import uuid
+
+import psycopg2
+from loguru import logger
+
+from . import config
+from .db import PoolTimeout, pooled_connection
+
+
+class ReportProgress:
+    """Stores and status rows a report has gone through, written to report_cache in batches
+
+    ``advance`` only bumps counters and reads a monotonic clock, report_cache is updated
+    at most every interval seconds over a connection of its own, as the generating
+    connection may be streaming a server side cursor. Without a report_id nothing is
+    written, which is how worker processes count their shard.
+    """
+
+    def __init__(
+            self,
+            report_id: Optional[uuid.UUID],
+            stores_total: int,
+            interval: float = config.REPORT_PROGRESS_INTERVAL
+    ):
+        self.report_id = report_id
+        self.stores_total = stores_total
+        self.interval = interval
+        self.stores_processed = 0
+        self.rows_scanned = 0
+        self.started = time.monotonic()
+        self.last_written = self.started
+
+    def advance(self, stores: int = 1, rows: int = 0):
+        """Count processed stores and scanned status rows"""
+        self.stores_processed += stores
+        self.rows_scanned += rows
+        now = time.monotonic()
+        if now - self.last_written >= self.interval:
+            self.write(now)
+
+    def stores_per_second(self, now: float) -> float:
+        elapsed = now - self.started
+        return self.stores_processed / elapsed if elapsed > 0 else 0.0
+
+    def write(self, now: Optional[float] = None):
+        """Write counters, throughput and estimated completion to report_cache"""
+        if self.report_id is None:
+            return
+        now = now or time.monotonic()
+        self.last_written = now
+        stores_per_second = self.stores_per_second(now)
+        eta = None
+        if stores_per_second:
+            remaining = max(0, self.stores_total - self.stores_processed)
+            eta = datetime.now(timezone.utc) + timedelta(seconds=remaining / stores_per_second)
+        try:
+            with pooled_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE report_cache
+                    SET stores_processed = %s, stores_total = %s, rows_scanned = %s,
+                        stores_per_second = %s, eta_utc = %s
+                    WHERE uuid = %s
+                    """,
+                    (
+                        self.stores_processed, self.stores_total, self.rows_scanned,
+                        stores_per_second, eta, self.report_id
+                    )
+                )
+        except (psycopg2.Error, PoolTimeout) as e:
+            # progress is informational, never fail the report over it
+            logger.warning(f"Unable to record progress of report {self.report_id}: {e}")
@@ -1,9 +1,31 @@
 import uuid
-from typing import List, Tuple, TYPE_CHECKING, Dict
-from .db import create_connection
+import gzip
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Tuple, TYPE_CHECKING, Dict, Optional, Union
+from .db import pooled_connection
+from .db.backend import StorageBackend, open_backend
+from .db.lifetime import iter_store_lifetime_totals, refresh_store_lifetime_totals
 from .db.functions import *
+from .kernel import (
+    EPOCH,
+    MICROSECONDS_PER_HOUR,
+    ONE_MICROSECOND,
+    StatusLogArrays,
+    multi_window_report_kernel,
+    relative_report_kernel,
+    to_epoch_microseconds
+)
+from .progress import ReportProgress
+from .report_cache import discard_report
+from .status_log import StoreStatusLog
+from .business_hours import BusinessHoursIndex, store_hours_mask
 from dataclasses import dataclass
 
+from collections import defaultdict
 from datetime import datetime, timedelta
 import zoneinfo
 from . import config
@@ -11,6 +33,12 @@ import csv
 
 from loguru import logger
 
+try:
+    import pyarrow
+    from pyarrow import csv as pyarrow_csv, feather as pyarrow_feather, parquet as pyarrow_parquet
+except ImportError:
+    pyarrow = None
+
 if TYPE_CHECKING:
     from psycopg2.extensions import connection
 
@@ -25,17 +53,34 @@ class StatusLogRow:
     timezone: str
 
     def __post_init__(self):
-        self.timestamp_local = self.timestamp_local.astimezone(zoneinfo.ZoneInfo(self.timezone))
+        self.timestamp_local = self.timestamp_utc.astimezone(zoneinfo.ZoneInfo(self.timezone))
 
 
-def calculate_relative_report(
+StatusLog = Union[List[StatusLogRow], StoreStatusLog, StatusLogArrays]
+
+
+def as_status_log_arrays(store_status: StatusLog) -> StatusLogArrays:
+    """Convert any status log representation to the arrays used by the kernels"""
+    if isinstance(store_status, StatusLogArrays):
+        return store_status
+    if isinstance(store_status, StoreStatusLog):
+        return store_status.to_arrays()
+    # rows carry the timezone of their store, an empty log has no local times to derive
+    return StatusLogArrays.from_rows(store_status, store_status[0].timezone if store_status else 'UTC')
+
+
+def calculate_relative_report_reference(
         store_status: List[StatusLogRow],
         store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
         start_time: datetime,
         end_time: datetime,
         debug: bool = False
 ) -> Tuple[timedelta, timedelta]:
-    """Calculate report between start_time and end_time"""
+    """Calculate report between start_time and end_time, row by row
+
+    Reference implementation of ``calculate_relative_report``, kept to check the
+    vectorized kernel against.
+    """
 
     store_status = [row for row in store_status if start_time <= row.timestamp_utc]
     if debug:
@@ -89,8 +134,53 @@ def calculate_relative_report(
     return uptime_timedelta, downtime_timedelta
 
 
+def calculate_relative_report(
+        store_status: StatusLog,
+        store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
+        start_time: datetime,
+        end_time: datetime,
+        debug: bool = False
+) -> Tuple[timedelta, timedelta]:
+    """Calculate report between start_time and end_time"""
+
+    store_status = as_status_log_arrays(store_status)
+    start_time_microseconds = to_epoch_microseconds(start_time)
+    uptime, downtime = relative_report_kernel(
+        store_status,
+        store_hours_mask(store_status, store_hours, start_time_microseconds),
+        start_time_microseconds,
+        to_epoch_microseconds(end_time)
+    )
+    if debug:
+        logger.debug(f"uptime: {uptime}us, downtime: {downtime}us")
+    return timedelta(microseconds=uptime), timedelta(microseconds=downtime)
+
+
+def calculate_multi_window_report(
+        store_status: StatusLog,
+        store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
+        windows: List[timedelta],
+        end_time: datetime
+) -> List[Tuple[timedelta, timedelta]]:
+    """Calculate report for every window ending at end_time, in one pass over a sorted status log"""
+
+    store_status = as_status_log_arrays(store_status)
+    end_time_microseconds = to_epoch_microseconds(end_time)
+    start_times = [end_time_microseconds - window // ONE_MICROSECOND for window in windows]
+    report = multi_window_report_kernel(
+        store_status,
+        store_hours_mask(store_status, store_hours, min(start_times, default=end_time_microseconds)),
+        start_times,
+        end_time_microseconds
+    )
+    return [
+        (timedelta(microseconds=uptime), timedelta(microseconds=downtime))
+        for uptime, downtime in report
+    ]
+
+
 def calculate_report_last_hour(
-        store_status: List[StatusLogRow],
+        store_status: StatusLog,
         store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
         end_time: datetime
 ) -> Tuple[int, int]:
@@ -109,7 +199,7 @@ def calculate_report_last_hour(
 
 
 def calculate_report_last_day(
-        store_status: List[StatusLogRow],
+        store_status: StatusLog,
         store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
         end_time: datetime
 ) -> Tuple[int, int]:
@@ -128,7 +218,7 @@ def calculate_report_last_day(
 
 
 def calculate_report_last_week(
-        store_status: List[StatusLogRow],
+        store_status: StatusLog,
         store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
         end_time: datetime
 ) -> Tuple[int, int]:
@@ -147,128 +237,535 @@ def calculate_report_last_week(
     return uptime, downtime
 
 
+# report key: (window, unit the window is reported in)
+REPORT_WINDOWS = {
+    'last_hour': (timedelta(hours=1), timedelta(minutes=1)),
+    'last_day': (timedelta(days=1), timedelta(hours=1)),
+    'last_week': (timedelta(days=7), timedelta(hours=1)),
+}
+# the same windows, every one reported in milliseconds
+MILLISECOND_REPORT_WINDOWS = {key: (window, timedelta(milliseconds=1)) for key, (window, _) in REPORT_WINDOWS.items()}
+
+
+def generate_report_for_status_log(
+        store_id: int,
+        store_status: StatusLog,
+        store_hours: Dict[int, Tuple[datetime.time, datetime.time]],
+        end_time: datetime,
+        report_windows: Dict[str, Tuple[timedelta, timedelta]] = REPORT_WINDOWS
+) -> Dict[str, Tuple[int, int]]:
+    """Generate report for store from an already fetched status log"""
+
+    windows = calculate_multi_window_report(
+        store_status,
+        store_hours,
+        [window for window, _ in report_windows.values()],
+        end_time
+    )
+    report = {'store_id': store_id}
+    for (key, (_, unit)), (uptime, downtime) in zip(report_windows.items(), windows):
+        report[key] = (uptime // unit, downtime // unit)
+
+    return report
+
+
+def report_to_row(report: Dict[str, Tuple[int, int]]) -> List[int]:
+    """Convert store report to a row ordered as REPORT_CSV_HEADER"""
+    return [
+        report['store_id'],
+        report['last_hour'][0],
+        report['last_day'][0],
+        report['last_week'][0],
+        report['last_hour'][1],
+        report['last_day'][1],
+        report['last_week'][1]
+    ]
+
+
 def generate_report_for_store(
         conn: 'connection',
-        store_id: int, end_time: datetime
+        store_id: int, end_time: datetime,
+        report_windows: Dict[str, Tuple[timedelta, timedelta]] = REPORT_WINDOWS
 ) -> Dict[str, Tuple[int, int]]:
-    """Generate report for store"""
+    """Generate report for store
+
+    Only status within the longest window up to end_time is fetched, so end_time can be in the past.
+    """
 
     store_hours = get_store_hours(conn, store_id)
-    timezone = get_store_timezone(conn, store_id)
-    store_status = [
-        StatusLogRow(store_id, status, timestamp_utc, timestamp_local, timezone)
-        for store_id, status, timestamp_utc, timestamp_local in get_store_status_log(conn, store_id, timezone)
-    ]
-    report = {
-        'store_id': store_id,
-        'last_hour': calculate_report_last_hour(store_status, store_hours, end_time),
-        'last_day': calculate_report_last_day(store_status, store_hours, end_time),
-        'last_week': calculate_report_last_week(store_status, store_hours, end_time)
+    longest_window = max(window for window, _ in report_windows.values())
+    _, timezone, status_log = next(iter_store_status_logs(
+        conn, end_time - longest_window, store_ids=[store_id], end_time=end_time
+    ))
+    store_status = StoreStatusLog.from_rows(store_id, timezone, status_log)
+    return generate_report_for_status_log(store_id, store_status, store_hours, end_time, report_windows)
+
+
+def generate_store_report_milliseconds(
+        conn: 'connection',
+        store_id: int,
+        end_time: datetime
+) -> Optional[Dict[str, Dict[str, int]]]:
+    """Uptime and downtime of every report window of a store in milliseconds, None for an unknown store
+
+    These are durations the store was up or down within store hours, not response times.
+    """
+    if not store_exists(conn, store_id):
+        return None
+    report = generate_report_for_store(conn, store_id, end_time, MILLISECOND_REPORT_WINDOWS)
+    return {
+        key: {'uptime_ms': report[key][0], 'downtime_ms': report[key][1]}
+        for key in MILLISECOND_REPORT_WINDOWS
     }
 
-    return report
+
+REPORT_CSV_HEADER = [
+    'store_id',
+    'uptime_last_hour',
+    'uptime_last_day',
+    'uptime_last_week',
+    'downtime_last_hour',
+    'downtime_last_day',
+    'downtime_last_week'
+]
+
+
+def write_report_rows_python(
+        conn: 'connection',
+        csv_file_writer,
+        end_time: datetime,
+        store_ids: Optional[List[int]] = None,
+        progress: Optional[ReportProgress] = None
+) -> int:
+    """Write report rows by computing every store in python, returns number of stores"""
+    all_store_hours = get_all_store_hours(conn)
+    store_count = 0
+    # the longest report window is a week, older status is never looked at
+    for store_id, timezone, status_log in iter_store_status_logs(
+            conn, end_time - timedelta(days=7), config.STATUS_LOG_ITERSIZE, store_ids, end_time=end_time
+    ):
+        store_status = StoreStatusLog.from_rows(store_id, timezone, status_log)
+        report = generate_report_for_status_log(
+            store_id, store_status, all_store_hours[store_id], end_time
+        )
+        csv_file_writer.writerow(report_to_row(report))
+        store_count += 1
+        if progress:
+            progress.advance(rows=len(store_status))
+    return store_count
+
+
+def write_report_rows_sql(
+        conn: 'connection',
+        csv_file_writer,
+        end_time: datetime,
+        progress: Optional[ReportProgress] = None
+) -> int:
+    """Write report rows computed in a single query by the database, returns number of stores"""
+    store_count = 0
+    for report_row in get_report_for_all_stores(conn, end_time):
+        csv_file_writer.writerow(report_row)
+        store_count += 1
+        if progress:
+            progress.advance()
+    return store_count
+
+
+def write_report_rows_backend(
+        backend: StorageBackend,
+        csv_file_writer,
+        end_time: datetime,
+        progress: Optional[ReportProgress] = None
+) -> int:
+    """Write report rows like the python engine, reading store data from backend, returns number of stores"""
+    all_store_hours = backend.get_all_store_hours()
+    store_count = 0
+    for store_id, store_status in backend.iter_status_log_arrays(end_time - timedelta(days=7), end_time=end_time):
+        report = generate_report_for_status_log(store_id, store_status, all_store_hours[store_id], end_time)
+        csv_file_writer.writerow(report_to_row(report))
+        store_count += 1
+        if progress:
+            progress.advance(rows=store_status.timestamps.size)
+    return store_count
+
+
+def ceil_hour(timestamp: datetime) -> datetime:
+    """Start of the first UTC hour at or after timestamp"""
+    hours = -(-to_epoch_microseconds(timestamp) // MICROSECONDS_PER_HOUR)
+    return EPOCH + timedelta(microseconds=hours * MICROSECONDS_PER_HOUR)
+
+
+def floor_hour(timestamp: datetime) -> datetime:
+    """Start of the UTC hour timestamp falls in"""
+    hours = to_epoch_microseconds(timestamp) // MICROSECONDS_PER_HOUR
+    return EPOCH + timedelta(microseconds=hours * MICROSECONDS_PER_HOUR)
+
+
+def write_report_rows_rollup(
+        conn: 'connection',
+        csv_file_writer,
+        end_time: datetime,
+        stores: Optional[List[int]] = None,
+        progress: Optional[ReportProgress] = None
+) -> int:
+    """Write report rows from the hourly rollup, returns number of stores
+
+    Full hours of every window up to the hour of end_time are summed from store_status_hourly,
+    only statuses in the partial first hour of a window, in the partial hour of end_time and
+    the last status of every store at or before end_time are read from store_status.
+    """
+    windows = list(REPORT_WINDOWS.values())
+    start_times = [end_time - window for window, _ in windows]
+    full_hours = [ceil_hour(start_time) for start_time in start_times]
+    last_hour = floor_hour(end_time)
+    end_time_microseconds = to_epoch_microseconds(end_time)
+    start_times_microseconds = [to_epoch_microseconds(start_time) for start_time in start_times]
+    full_hours_microseconds = [to_epoch_microseconds(full_hour) for full_hour in full_hours]
+    last_hour_microseconds = to_epoch_microseconds(last_hour)
+
+    totals = get_hourly_rollup_totals(conn, full_hours, last_hour)
+    edge_statuses = defaultdict(list)
+    time_ranges = [time_range for time_range in zip(start_times, full_hours) if time_range[0] < time_range[1]]
+    for store_id, status, timestamp_utc, next_timestamp_utc in get_statuses_with_next(
+            conn, time_ranges + [(last_hour, end_time)]
+    ):
+        # the time until a status after end_time is the tail of the last status
+        if next_timestamp_utc <= end_time:
+            edge_statuses[store_id].append(
+                (status, to_epoch_microseconds(timestamp_utc), to_epoch_microseconds(next_timestamp_utc))
+            )
+    last_statuses = get_last_statuses(conn, min(start_times), end_time)
+    all_store_hours = get_all_store_hours(conn)
+    all_store_timezones = get_all_store_timezones(conn)
+
+    if stores is None:
+        stores = get_all_stores(conn)
+    for store_id in stores:
+        # [uptime, downtime] in microseconds of every window
+        store_report = [list(window_total) for window_total in totals.get(store_id, [(0, 0)] * len(windows))]
+        index = None
+        if store_id in edge_statuses or store_id in last_statuses:
+            next_timestamp_utc = last_statuses[store_id][2] if store_id in last_statuses else None
+            index = BusinessHoursIndex.for_horizon(
+                all_store_hours[store_id], all_store_timezones[store_id], min(start_times_microseconds),
+                # up to the next status after end_time, it is checked against store hours too
+                to_epoch_microseconds(max(end_time, next_timestamp_utc or end_time))
+            )
+        for status, timestamp, next_timestamp in edge_statuses.get(store_id, ()):
+            if not index.contains(next_timestamp):
+                continue
+            for window_report, start_time, full_hour in zip(
+                    store_report, start_times_microseconds, full_hours_microseconds
+            ):
+                if start_time <= timestamp < full_hour or timestamp >= last_hour_microseconds:
+                    window_report[0 if status else 1] += next_timestamp - timestamp
+        if store_id in last_statuses:
+            status, timestamp_utc, next_timestamp_utc = last_statuses[store_id]
+            timestamp = to_epoch_microseconds(timestamp_utc)
+            # the hour of the last status, if summed, counts the time until the next status after end_time
+            summed_after_end = 0
+            if next_timestamp_utc is not None and timestamp < last_hour_microseconds:
+                next_timestamp = to_epoch_microseconds(next_timestamp_utc)
+                if index.contains(next_timestamp):
+                    summed_after_end = next_timestamp - timestamp
+            for window_report, start_time, full_hour in zip(
+                    store_report, start_times_microseconds, full_hours_microseconds
+            ):
+                if timestamp >= start_time:
+                    window_report[0 if status else 1] += end_time_microseconds - timestamp
+                if timestamp >= full_hour:
+                    window_report[0 if status else 1] -= summed_after_end
+
+        report = {'store_id': store_id}
+        for key, (_, unit), (uptime, downtime) in zip(REPORT_WINDOWS, windows, store_report):
+            unit_seconds = int(unit.total_seconds())
+            report[key] = (uptime // 1_000_000 // unit_seconds, downtime // 1_000_000 // unit_seconds)
+        csv_file_writer.writerow(report_to_row(report))
+        if progress:
+            progress.advance(rows=len(edge_statuses.get(store_id, ())) + (store_id in last_statuses))
+    return len(stores)
+
+
+def shard_stores(stores: List[int], shard_count: int, strategy: str) -> List[List[int]]:
+    """Split stores into at most shard_count non-empty shards"""
+    if strategy == 'hash':
+        shards = [[] for _ in range(shard_count)]
+        for store_id in stores:
+            shards[hash(store_id) % shard_count].append(store_id)
+    elif strategy == 'range':
+        stores = sorted(stores)
+        shard_size = max(1, -(-len(stores) // shard_count))
+        shards = [stores[index:index + shard_size] for index in range(0, len(stores), shard_size)]
+    else:
+        raise ValueError(f"Unknown shard strategy {strategy}")
+    return [shard for shard in shards if shard]
+
+
+def generate_report_shard(part_file: Path, store_ids: List[int], end_time: datetime) -> Tuple[int, int]:
+    """Write report rows of a shard of stores to part_file, runs in a worker process
+
+    Returns number of stores and status rows scanned.
+    """
+    progress = ReportProgress(None, len(store_ids))
+    with pooled_connection() as conn, open(part_file, 'w') as csv_file:
+        store_count = write_report_rows_python(conn, csv.writer(csv_file), end_time, store_ids, progress)
+    return store_count, progress.rows_scanned
+
+
+def write_report_rows_parallel(
+        conn: 'connection',
+        csv_file,
+        report_id: uuid.UUID,
+        end_time: datetime,
+        stores: Optional[List[int]] = None,
+        progress: Optional[ReportProgress] = None
+) -> int:
+    """Write report rows by computing shards of stores in worker processes, returns number of stores
+
+    Every shard is written to its own part file by a worker with its own connection and
+    appended to csv_file once done. Failed shards are retried in a fresh process pool,
+    shards that still fail make the whole report fail, an incomplete report is never cached.
+    """
+    # more shards than workers, so a failing shard only costs a small part of the report
+    if stores is None:
+        stores = get_all_stores(conn)
+    shards = shard_stores(stores, config.REPORT_WORKERS * 4, config.REPORT_SHARD_STRATEGY)
+    pending = dict(enumerate(shards))
+    store_count = 0
+    # spawn, as forking a threaded server process can deadlock the workers
+    mp_context = multiprocessing.get_context('spawn')
+    for attempt in range(config.REPORT_SHARD_RETRIES + 1):
+        if not pending:
+            break
+        with ProcessPoolExecutor(max_workers=config.REPORT_WORKERS, mp_context=mp_context) as executor:
+            futures = {
+                executor.submit(
+                    generate_report_shard,
+                    config.REPORT_CACHE_DIR / f'{report_id}.part{shard_index}.csv',
+                    store_ids,
+                    end_time
+                ): shard_index
+                for shard_index, store_ids in pending.items()
+            }
+            for future in as_completed(futures):
+                shard_index = futures[future]
+                part_file = config.REPORT_CACHE_DIR / f'{report_id}.part{shard_index}.csv'
+                try:
+                    shard_store_count, shard_rows_scanned = future.result()
+                except Exception as e:
+                    logger.warning(f"Shard {shard_index} of report {report_id} failed on attempt {attempt + 1}: {e}")
+                    continue
+                with open(part_file, 'r') as part:
+                    shutil.copyfileobj(part, csv_file)
+                part_file.unlink()
+                store_count += shard_store_count
+                del pending[shard_index]
+                if progress:
+                    progress.advance(shard_store_count, shard_rows_scanned)
+
+    for shard_index in pending:
+        (config.REPORT_CACHE_DIR / f'{report_id}.part{shard_index}.csv').unlink(missing_ok=True)
+    if pending:
+        missing = sum(len(shards[shard_index]) for shard_index in pending)
+        raise RuntimeError(
+            f"{len(pending)} shards of report {report_id} failed {config.REPORT_SHARD_RETRIES + 1} times, "
+            f"{missing} stores are missing"
+        )
+    return store_count
+
+
+REPORT_ENGINES = {
+    'python': write_report_rows_python,
+    'sql': write_report_rows_sql,
+    'rollup': write_report_rows_rollup,
+}
+
+
+def get_report_end_time(conn: 'connection', report_id: uuid.UUID) -> datetime:
+    """Max timestamp of the data version of the report, so every report of a version is identical"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT data_max_timestamp_utc
+            FROM report_cache
+            WHERE uuid = %s
+            """,
+            (report_id,)
+        )
+        row = cursor.fetchone()
+    if row and row[0]:
+        return row[0]
+    return get_max_timestamp(conn)
+
+
+def get_report_data_version(conn: 'connection', report_id: uuid.UUID) -> Optional[Tuple[datetime, int]]:
+    """Data version report_id was triggered for, None for a report without a report_cache row"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT data_max_timestamp_utc, ingestion_generation
+            FROM report_cache
+            WHERE uuid = %s
+            """,
+            (report_id,)
+        )
+        row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def mark_report_generated(conn: 'connection', report_id: uuid.UUID):
+    """Mark report as generated in report cache"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE 
+                report_cache 
+            SET generating = %s, end_timestamp_utc = %s
+            WHERE uuid=%s 
+            """,
+            (False, datetime.utcnow(), report_id)
+        )
+        conn.commit()
+
+
+# file suffix and media type of every report format, csv is always written
+REPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+
+def report_path(report_id: uuid.UUID, report_format: str = 'csv') -> Path:
+    return config.REPORT_CACHE_DIR / f'{report_id}{REPORT_FORMATS[report_format][0]}'
+
+
+def read_report_table(report_file: Path) -> 'pyarrow.Table':
+    """Report csv as an arrow table, every column int64"""
+    return pyarrow_csv.read_csv(
+        report_file,
+        convert_options=pyarrow_csv.ConvertOptions(
+            column_types={column: pyarrow.int64() for column in REPORT_CSV_HEADER}
+        )
+    )
+
+
+def write_report_formats(report_id: uuid.UUID):
+    """Write the report csv in every format of REPORT_FORMATS besides csv
+
+    Every file is written under a temporary name and renamed, so a format that exists
+    is complete.
+    """
+    report_file = report_path(report_id)
+    table = None
+    for report_format in config.REPORT_OUTPUT_FORMATS:
+        if report_format == 'csv':
+            continue
+        if report_format not in REPORT_FORMATS:
+            logger.warning(f"Unknown report format {report_format}")
+            continue
+        if report_format in ('parquet', 'arrow') and pyarrow is None:
+            logger.warning(f"pyarrow is not installed, skipping {report_format} report")
+            continue
+
+        output_file = report_path(report_id, report_format)
+        tmp_file = output_file.with_name(output_file.name + '.tmp')
+        if report_format == 'csv.gz':
+            with open(report_file, 'rb') as source, gzip.open(tmp_file, 'wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target)
+        else:
+            if table is None:
+                table = read_report_table(report_file)
+            if report_format == 'parquet':
+                pyarrow_parquet.write_table(table, tmp_file, compression='zstd')
+            else:
+                pyarrow_feather.write_feather(table, tmp_file, compression='lz4')
+        os.replace(tmp_file, output_file)
+        logger.debug(f"Wrote {report_format} report {output_file}")
 
 
 def generate_report_for_all_stores(report_id: uuid.UUID):
+    """Generate the report of report_id, a report that fails is removed from the report cache"""
     report_file = config.REPORT_CACHE_DIR / f'{report_id}.csv'
     if report_file.exists():
         return
 
-    with open(report_file, 'w') as csv_file, create_connection() as conn:
-        csv_file_writer = csv.writer(csv_file)
-        csv_header = [
-            'store_id',
-            'uptime_last_hour',
-            'uptime_last_day',
-            'uptime_last_week',
-            'downtime_last_hour',
-            'downtime_last_day',
-            'downtime_last_week'
-        ]
-        csv_file_writer.writerow(csv_header)
+    try:
+        write_report(report_id, report_file)
+    except Exception:
+        logger.exception(f"Generating report {report_id} failed, removing it from report cache")
+        with pooled_connection() as conn:
+            discard_report(conn, report_id)
+        raise
 
-        max_timestamp = get_max_timestamp(conn)
-        stores = get_all_stores(conn)
-        logger.info(f"Generating report for {len(stores)} stores, for report {report_id}")
-        for store in stores:
-            report = generate_report_for_store(
-                conn, store, max_timestamp
-            )
-            report_row = [
-                report['store_id'],
-                report['last_hour'][0],
-                report['last_day'][0],
-                report['last_week'][0],
-                report['last_hour'][1],
-                report['last_day'][1],
-                report['last_week'][1]
-            ]
-            csv_file_writer.writerow(report_row)
-        logger.info(f"Finished generating report for {len(stores)} stores, for report {report_id}")
+
+def write_report(report_id: uuid.UUID, report_file: Path):
+    """Write the report of report_id in every format and mark it generated"""
+    write_report_rows = REPORT_ENGINES[config.REPORT_ENGINE]
+    with open(report_file, 'w') as csv_file, pooled_connection() as conn:
+        csv_file_writer = csv.writer(csv_file)
+        csv_file_writer.writerow(REPORT_CSV_HEADER)
+
+        if config.STORAGE_BACKEND != 'postgres':
+            # report_cache stays in postgres, store data and the data version come from the backend
+            logger.info(f"Generating report from {config.STORAGE_BACKEND} backend, for report {report_id}")
+            with open_backend() as backend:
+                data_version = backend.get_data_version()
+                if data_version != (get_report_data_version(conn, report_id) or data_version):
+                    raise RuntimeError(
+                        f"{config.STORAGE_BACKEND} data changed since report {report_id} was triggered"
+                    )
+                max_timestamp = data_version[0]
+                progress = ReportProgress(report_id, len(backend.get_all_stores()))
+                store_count = write_report_rows_backend(backend, csv_file_writer, max_timestamp, progress)
+        else:
+            max_timestamp = get_report_end_time(conn, report_id)
+            # scanned once, for the progress and the engines needing every store up front
+            stores = get_all_stores(conn)
+            progress = ReportProgress(report_id, len(stores))
+            logger.info(f"Generating report using {config.REPORT_ENGINE} engine, for report {report_id}")
+            if config.REPORT_ENGINE == 'python' and config.REPORT_WORKERS > 1:
+                store_count = write_report_rows_parallel(conn, csv_file, report_id, max_timestamp, stores, progress)
+            elif config.REPORT_ENGINE == 'rollup':
+                store_count = write_report_rows_rollup(conn, csv_file_writer, max_timestamp, stores, progress)
+            else:
+                store_count = write_report_rows(conn, csv_file_writer, max_timestamp, progress=progress)
+        logger.info(f"Finished generating report for {store_count} stores, for report {report_id}")
+        progress.write()
+        # streamed downloads stop reading once the report is marked generated
+        csv_file.flush()
+        write_report_formats(report_id)
         # update report cache
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                UPDATE 
-                    report_cache 
-                SET generating = %s, end_timestamp_utc = %s
-                WHERE uuid=%s 
-                """,
-                (False, datetime.utcnow(), report_id)
-            )
-            conn.commit()
-
-            # set generate_new_report to false
-            cursor.execute(
-                """
-                UPDATE
-                    settings
-                SET setting_value = 'false'
-                WHERE setting_name = 'generate_new_report'
-                """,
-            )
-            conn.commit()
+        mark_report_generated(conn, report_id)
         logger.info(f"Updated report cache for report {report_id}")
 
 
 def generate_total_report():
-    with create_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT 
-                    MIN(timestamp_utc)
-                FROM 
-                    store_status
-                """
-            )
-            min_timestamp = cursor.fetchone()
-            if min_timestamp:
-                min_timestamp = min_timestamp[0]
-        all_stores = get_all_stores(conn)
-        with open(config.REPORT_CACHE_DIR / 'total_report.csv', 'w') as csv_file:
+    """Write lifetime uptime and downtime of every store to total_report.csv
+
+    Only statuses since the last run are read, they are added to store_lifetime_totals.
+    """
+    total_report_file = config.REPORT_CACHE_DIR / 'total_report.csv'
+    tmp_file = total_report_file.with_name(total_report_file.name + '.tmp')
+    with pooled_connection() as conn:
+        max_timestamp = get_max_timestamp(conn)
+        if max_timestamp is not None:
+            refresh_store_lifetime_totals(conn, max_timestamp)
+        with open(tmp_file, 'w') as csv_file:
             csv_file_writer = csv.writer(csv_file)
             csv_file_writer.writerow([
                 'store_id', 'uptime', 'downtime'
             ])
-            for store_id in all_stores:
-                store_hours = get_store_hours(conn, store_id)
-                timezone = get_store_timezone(conn, store_id)
-                store_status = [
-                    StatusLogRow(store_id, status, timestamp_utc, timestamp_local, timezone)
-                    for store_id, status, timestamp_utc, timestamp_local in get_store_status_log(conn, store_id, timezone)
-                ]
-                uptime, downtime = calculate_relative_report(
-                        store_status,
-                        store_hours,
-                        min_timestamp,
-                        get_max_timestamp(conn)
-                    )
-                csv_file_writer.writerow([
-                    store_id,
-                    uptime.total_seconds(),
-                    downtime.total_seconds()
-                ])
+            if max_timestamp is not None:
+                for store_id, uptime, downtime in iter_store_lifetime_totals(conn, max_timestamp):
+                    csv_file_writer.writerow([
+                        store_id,
+                        timedelta(microseconds=uptime).total_seconds(),
+                        timedelta(microseconds=downtime).total_seconds()
+                    ])
+    # the dashboard reads the file whenever it changes, never half written
+    os.replace(tmp_file, total_report_file)
 
     config.GENERATING_REPORTS = False
     return {
@@ -278,7 +775,7 @@ def generate_total_report():
 
 def test_report_generation():
     store_id = 8139926242460185114
-    with create_connection() as conn:
+    with pooled_connection() as conn:
         max_timestamp = get_max_timestamp(conn)
         report = generate_report_for_store(
             conn, store_id, max_timestamp
@@ -0,0 +1,257 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Tuple
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+from . import config
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection
+
+
+class ReportCacheMetrics:
+    """Counters of report lookups and cache maintenance in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.orphan_rows = 0
+        self.orphan_files = 0
+        self.expired_generating = 0
+
+    def count(self, **counters: int):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'orphan_rows': self.orphan_rows,
+                'orphan_files': self.orphan_files,
+                'expired_generating': self.expired_generating,
+            }
+
+
+metrics = ReportCacheMetrics()
+
+
+def report_id_of(file: Path):
+    """Report id a cache file belongs to, None for files of no report"""
+    try:
+        return uuid.UUID(file.name[:36])
+    except ValueError:
+        return None
+
+
+def cached_files() -> Dict[uuid.UUID, List[Path]]:
+    """Files in REPORT_CACHE_DIR by report, every format and leftover part files included"""
+    files = {}
+    for file in config.REPORT_CACHE_DIR.iterdir():
+        if file.is_file() and (report_id := report_id_of(file)) is not None:
+            files.setdefault(report_id, []).append(file)
+    return files
+
+
+def remove_files(files: List[Path]) -> int:
+    """Remove files, returns bytes freed"""
+    freed = 0
+    for file in files:
+        try:
+            freed += file.stat().st_size
+            file.unlink()
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def reconcile_report_cache(conn: 'connection'):
+    """Remove report_cache rows of generated reports without a csv, and files without a row
+
+    Reports generating for longer than REPORT_GENERATING_TIMEOUT_HOURS are removed too,
+    their generator died without cleaning up after itself.
+    """
+    files = cached_files()
+    now = datetime.now(timezone.utc)
+    timeout = timedelta(hours=config.REPORT_GENERATING_TIMEOUT_HOURS)
+    with conn.cursor() as cur:
+        cur.execute("SELECT uuid, generating, start_timestamp_utc FROM report_cache")
+        rows = {report_id: (generating, started_at) for report_id, generating, started_at in cur.fetchall()}
+        missing = [
+            report_id for report_id, (generating, _) in rows.items()
+            if not generating and not (config.REPORT_CACHE_DIR / f'{report_id}.csv').exists()
+        ]
+        expired = [
+            report_id for report_id, (generating, started_at) in rows.items()
+            if generating and config.REPORT_GENERATING_TIMEOUT_HOURS and now - started_at > timeout
+        ]
+        if missing or expired:
+            cur.execute("DELETE FROM report_cache WHERE uuid = ANY(%s)", (missing + expired,))
+        conn.commit()
+
+    orphans = [report_id for report_id in files if report_id not in rows]
+    for report_id in orphans + missing + expired:
+        remove_files(files.get(report_id, []))
+    metrics.count(
+        orphan_rows=len(missing),
+        orphan_files=sum(len(files[report_id]) for report_id in orphans),
+        expired_generating=len(expired)
+    )
+    if missing or orphans or expired:
+        logger.info(
+            f"Reconciled report cache, removed {len(missing)} rows, files of {len(orphans)} reports "
+            f"and {len(expired)} reports generating since before {now - timeout}"
+        )
+
+
+def discard_report(conn: 'connection', report_id: uuid.UUID):
+    """Remove the report_cache row and every file of a report, so it is generated again when triggered"""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM report_cache WHERE uuid = %s", (report_id,))
+        conn.commit()
+    remove_files(list(config.REPORT_CACHE_DIR.glob(f'{report_id}*')))
+
+
+def evict_report_cache(conn: 'connection'):
+    """Evict generated reports older than REPORT_CACHE_MAX_AGE_HOURS, then least recently downloaded
+    ones until at most REPORT_CACHE_MAX_ENTRIES reports of REPORT_CACHE_MAX_BYTES remain
+
+    The latest generated report is never evicted, it is what trigger_report hands out.
+    A limit of 0 disables it.
+    """
+    files = cached_files()
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT uuid, COALESCE(last_accessed_utc, end_timestamp_utc, start_timestamp_utc), end_timestamp_utc
+            FROM report_cache
+            WHERE NOT generating
+            ORDER BY start_timestamp_utc DESC
+            """
+        )
+        reports = cur.fetchall()
+        if not reports:
+            return
+        # least recently used first, the latest report left out
+        candidates = sorted(reports[1:], key=lambda report: report[1])
+        sizes = {
+            report_id: sum(file.stat().st_size for file in report_files)
+            for report_id, report_files in files.items()
+        }
+        entries = len(reports)
+        total_bytes = sum(sizes.get(report_id, 0) for report_id, _, _ in reports)
+        now = datetime.now(timezone.utc)
+        max_age = timedelta(hours=config.REPORT_CACHE_MAX_AGE_HOURS)
+
+        evicted = []
+        for report_id, last_used, generated_at in candidates:
+            too_old = config.REPORT_CACHE_MAX_AGE_HOURS and generated_at and now - generated_at > max_age
+            too_many = config.REPORT_CACHE_MAX_ENTRIES and entries > config.REPORT_CACHE_MAX_ENTRIES
+            too_big = config.REPORT_CACHE_MAX_BYTES and total_bytes > config.REPORT_CACHE_MAX_BYTES
+            if not (too_old or too_many or too_big):
+                continue
+            evicted.append(report_id)
+            entries -= 1
+            total_bytes -= sizes.get(report_id, 0)
+
+        if evicted:
+            # rows first, so a report is never handed out after its files are gone
+            cur.execute("DELETE FROM report_cache WHERE uuid = ANY(%s)", (evicted,))
+        conn.commit()
+
+    freed = sum(remove_files(files.get(report_id, [])) for report_id in evicted)
+    metrics.count(evictions=len(evicted), evicted_bytes=freed)
+    if evicted:
+        logger.info(f"Evicted {len(evicted)} reports from report cache, freed {freed} bytes")
+
+
+def report_cache_usage() -> Dict[str, int]:
+    """Reports and bytes currently in REPORT_CACHE_DIR"""
+    files = cached_files()
+    return {
+        'entries': len(files),
+        'bytes': sum(file.stat().st_size for report_files in files.values() for file in report_files),
+    }
+
+
+_MISSING = object()
+
+
+class StoreReportCache:
+    """In memory LRU cache of per store reports, entries expire after ttl seconds
+
+    Entries belong to a data version. A lookup with another version than the cache
+    holds drops every entry, so the cache empties once ingestion advances the data.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self, version: Hashable):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: Hashable, version: Hashable, default=None):
+        with self._lock:
+            self._check_version(version)
+            expires_at, value = self._entries.get(key, (0.0, _MISSING))
+            if value is _MISSING or expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, version: Hashable, value: Any):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = None
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+
+store_reports = StoreReportCache(config.STORE_REPORT_CACHE_SIZE, config.STORE_REPORT_CACHE_TTL_SECONDS)
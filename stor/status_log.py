@@ -0,0 +1,76 @@
+from array import array
+from typing import Iterable, Tuple
+import datetime
+import zoneinfo
+
+import numpy as np
+
+from .kernel import EPOCH, StatusLogArrays, local_microseconds_of_week, to_epoch_microseconds
+
+
+class StoreStatusLog:
+    """Columnar status log of a single store
+
+    Holds UTC epoch microseconds and status bits in flat arrays with a single timezone
+    object for the store, local times are only derived when asked for.
+    """
+    __slots__ = ('store_id', 'timezone', 'tz', 'timestamps', 'statuses')
+
+    def __init__(self, store_id: int, timezone: str):
+        self.store_id = store_id
+        self.timezone = timezone
+        self.tz = zoneinfo.ZoneInfo(timezone)
+        self.timestamps = array('q')
+        self.statuses = array('b')
+
+    @classmethod
+    def from_rows(
+            cls,
+            store_id: int,
+            timezone: str,
+            rows: Iterable[Tuple[int, bool, datetime.datetime, datetime.datetime]]
+    ) -> 'StoreStatusLog':
+        """Build from rows shaped like ``get_store_status_log`` results"""
+        status_log = cls(store_id, timezone)
+        for _, status, timestamp_utc, _ in rows:
+            status_log.append(status, timestamp_utc)
+        return status_log
+
+    def append(self, is_open: bool, timestamp_utc: datetime.datetime):
+        self.timestamps.append(to_epoch_microseconds(timestamp_utc))
+        self.statuses.append(is_open)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def is_open(self, index: int) -> bool:
+        return bool(self.statuses[index])
+
+    def timestamp_utc(self, index: int) -> datetime.datetime:
+        return EPOCH + datetime.timedelta(microseconds=self.timestamps[index])
+
+    def timestamp_local(self, index: int) -> datetime.datetime:
+        return self.timestamp_utc(index).astimezone(self.tz)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the columns"""
+        return (
+            self.timestamps.buffer_info()[1] * self.timestamps.itemsize
+            + self.statuses.buffer_info()[1] * self.statuses.itemsize
+        )
+
+    def local_microseconds_of_week(self) -> np.ndarray:
+        """Local times of all statuses in bulk, as microseconds since local monday midnight"""
+        return local_microseconds_of_week(self.tz, np.frombuffer(self.timestamps, dtype=np.int64))
+
+    def to_arrays(self) -> StatusLogArrays:
+        """Numpy view of the columns
+
+        The log can not be appended to while the returned arrays are alive.
+        """
+        return StatusLogArrays(
+            np.frombuffer(self.timestamps, dtype=np.int64),
+            np.frombuffer(self.statuses, dtype=np.int8).view(np.bool_),
+            self.timezone
+        )
@@ -0,0 +1,53 @@
+"""Fixtures of the tests that need the database of DB_* in the environment"""
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterator
+
+import psycopg2
+import pytest
+
+from stor import db
+from stor.db import DB_CONFIG, init_db, pooled_connection, populate_settings_table
+
+
+def database_available() -> bool:
+    if not DB_CONFIG['dbname']:
+        return False
+    try:
+        psycopg2.connect(**DB_CONFIG, connect_timeout=3).close()
+    except psycopg2.OperationalError:
+        return False
+    return True
+
+
+def execute(statement: str):
+    with psycopg2.connect(**DB_CONFIG) as conn, conn.cursor() as cur:
+        cur.execute(statement)
+    conn.close()
+
+
+@pytest.fixture
+def database_schema(monkeypatch) -> Callable[[str], ContextManager['psycopg2.extensions.connection']]:
+    """Open a pooled connection working in a new schema with the tables of init_db
+
+    Every connection, of worker processes too, works in the schema. It is dropped
+    when the block exits. Skips the test without a database.
+    """
+    if not database_available():
+        pytest.skip("no database configured by DB_*")
+    monkeypatch.delenv('DEBUG', raising=False)
+
+    @contextmanager
+    def open_schema(schema: str) -> Iterator['psycopg2.extensions.connection']:
+        execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};")
+        monkeypatch.setenv('PGOPTIONS', f'-c search_path={schema},public')
+        monkeypatch.setattr(db, '_pool', None)
+        try:
+            with pooled_connection() as conn:
+                init_db(conn)
+                populate_settings_table(conn)
+                yield conn
+        finally:
+            db.get_pool().closeall()
+            execute(f"DROP SCHEMA {schema} CASCADE;")
+
+    return open_schema
@@ -0,0 +1,95 @@
+"""``DeltaFilter`` over store_status csv lines"""
+import datetime
+
+from stor.data.delta import DeltaFilter, IngestionState
+
+HEADER = b'store_id,status,timestamp_utc\n'
+LINES = [
+    b'8139926242460185114,1,2023-01-24 09:06:42.605777 UTC\n',
+    b'8139926242460185114,0,2023-01-24 10:06:42.605777 UTC\n',
+    b'2532765153785040440,1,2023-01-24 10:06:42.605777 UTC\n',
+    b'2532765153785040440,1,2023-01-24 11:08:13.42 UTC\n',
+    b'8139926242460185114,1,2023-01-25 18:13:22.47922 UTC\n',
+]
+HIGH_WATER_MARK = datetime.datetime(2023, 1, 24, 10, 6, 42, 605777, tzinfo=datetime.timezone.utc)
+
+
+def ingest(lines, state=None):
+    """Lines a DeltaFilter with state keeps, and the filter"""
+    delta = DeltaFilter(state)
+    return delta.filter([HEADER, *lines]).read(), delta
+
+
+def ingested_state():
+    """State after ingesting the lines up to and at HIGH_WATER_MARK"""
+    _, delta = ingest(LINES[:3])
+    return delta.next_state()
+
+
+def test_without_state_every_row_is_kept():
+    kept, delta = ingest(LINES)
+    assert kept == HEADER + b''.join(LINES)
+    assert delta.history_unchanged()
+    state = delta.next_state()
+    assert state.high_water_mark == datetime.datetime(2023, 1, 25, 18, 13, 22, 479220, tzinfo=datetime.timezone.utc)
+    assert state.row_count == len(LINES)
+
+
+def test_rows_at_or_before_high_water_mark_are_dropped():
+    state = ingested_state()
+    assert state.high_water_mark == HIGH_WATER_MARK
+    kept, delta = ingest(LINES, state)
+    # rows at the high-water mark were ingested with it
+    assert kept == HEADER + b''.join(LINES[3:])
+    assert delta.history_unchanged()
+    assert (delta.old_row_count, delta.new_row_count) == (3, 2)
+
+
+def test_next_state_continues_from_previous_state():
+    _, delta = ingest(LINES, ingested_state())
+    _, full = ingest(LINES)
+    # the same as ingesting everything at once, whatever the order of the rows
+    assert delta.next_state() == full.next_state()
+    _, shuffled = ingest(LINES[::-1])
+    assert shuffled.next_state() == full.next_state()
+
+
+def test_no_new_rows():
+    state = ingested_state()
+    kept, delta = ingest(LINES[:3], state)
+    assert kept == HEADER
+    assert delta.history_unchanged()
+    assert delta.next_state() == state
+
+
+def test_changed_history_forces_full_reload():
+    state = ingested_state()
+    changed = [LINES[0], LINES[1].replace(b',0,', b',1,'), *LINES[2:]]
+    _, delta = ingest(changed, state)
+    assert not delta.history_unchanged()
+    # a row removed or added before the high-water mark is caught too
+    _, delta = ingest(LINES[1:], state)
+    assert not delta.history_unchanged()
+    _, delta = ingest([LINES[0], *LINES], state)
+    assert not delta.history_unchanged()
+    # populate_store_status reloads the source without a state
+    kept, delta = ingest(changed, None)
+    assert kept == HEADER + b''.join(changed)
+
+
+def test_merged_chunks_match_one_pass():
+    state = ingested_state()
+    _, whole = ingest(LINES, state)
+    merged = DeltaFilter(state)
+    for chunk in (LINES[:2], LINES[2:4], LINES[4:]):
+        _, delta = ingest(chunk, state)
+        merged.merge(delta.counters())
+    assert merged.counters() == whole.counters()
+    assert merged.history_unchanged()
+    assert merged.next_state() == whole.next_state()
+
+
+def test_blank_lines_are_ignored():
+    kept, delta = ingest([LINES[0], b'\n', LINES[1]])
+    assert kept == HEADER + LINES[0] + LINES[1]
+    assert delta.next_state() == IngestionState(HIGH_WATER_MARK, delta.new_fingerprint, 2)
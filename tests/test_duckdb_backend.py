@@ -0,0 +1,100 @@
+"""Reports of ``DuckDBBackend`` over ``load_duckdb`` against the row by row reference"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+from benchmarks.synthetic import SyntheticData
+from stor.db.functions import default_store_hours
+from stor.report import (
+    REPORT_WINDOWS,
+    StatusLogRow,
+    calculate_relative_report_reference,
+    report_to_row,
+    write_report_rows_backend
+)
+
+duckdb = pytest.importorskip('duckdb')
+from stor.db.backend import DuckDBBackend, load_duckdb  # noqa: E402
+
+StoreHours = Dict[int, Tuple[time, time]]
+
+
+def expected_report_rows(
+        statuses: Dict[int, Dict[datetime, bool]],
+        timezones: Dict[int, str],
+        all_store_hours: Dict[int, StoreHours],
+        end_time: datetime
+) -> List[List[int]]:
+    """Report rows of every store computed with calculate_relative_report_reference"""
+    rows = []
+    for store_id in sorted(statuses):
+        store_status = [
+            StatusLogRow(store_id, is_open, timestamp_utc, timestamp_utc, timezones[store_id])
+            for timestamp_utc, is_open in sorted(statuses[store_id].items())
+            if timestamp_utc <= end_time
+        ]
+        report = {'store_id': store_id}
+        for key, (window, unit) in REPORT_WINDOWS.items():
+            uptime, downtime = calculate_relative_report_reference(
+                store_status, all_store_hours[store_id], end_time - window, end_time
+            )
+            report[key] = (uptime // unit, downtime // unit)
+        rows.append(report_to_row(report))
+    return rows
+
+
+def write_duplicates(directory: Path, data: SyntheticData) -> Tuple[Dict[int, Dict[datetime, bool]], Dict[int, str]]:
+    """Append duplicate polls and time zones to the csv files, returns the statuses and timezones they stand for"""
+    statuses = {store.store_id: {} for store in data.stores}
+    with open(directory / 'store_status.csv', 'a') as f:
+        for index, store in enumerate(data.stores):
+            for poll, (is_open, timestamp_utc) in enumerate(data.statuses(store)):
+                statuses[store.store_id][timestamp_utc] = is_open
+                if (index + poll) % 7:
+                    continue
+                # reported again, as open if it was closed and the other way around
+                statuses[store.store_id][timestamp_utc] = True
+                f.write(
+                    f"{store.store_id},{'inactive' if is_open else 'active'},"
+                    f"{timestamp_utc.strftime('%Y-%m-%d %H:%M:%S.%f')} UTC\n"
+                )
+
+    timezones = {store.store_id: store.timezone or 'America/Chicago' for store in data.stores}
+    twice = [store for store in data.stores if store.timezone is not None][:3]
+    with open(directory / 'time_zone_info.csv', 'a') as f:
+        for store in twice:
+            f.write(f"{store.store_id},Asia/Kolkata\n")
+    return statuses, timezones
+
+
+def test_duckdb_report_matches_reference(tmp_path):
+    data = SyntheticData(120, days=8, poll_minutes=45, outage_rate=0.2, seed=11)
+    data.write_csvs(tmp_path)
+    statuses, timezones = write_duplicates(tmp_path, data)
+    # the first hours of a store and day win
+    with open(tmp_path / 'menu_hours.csv', 'a') as f:
+        for store in [store for store in data.stores if 0 in store.store_hours][:5]:
+            f.write(f"{store.store_id},0,00:00:00,12:00:00\n")
+    all_store_hours = {}
+    for store in data.stores:
+        all_store_hours[store.store_id] = default_store_hours()
+        all_store_hours[store.store_id].update(store.store_hours)
+
+    conn = load_duckdb(tmp_path)
+    try:
+        backend = DuckDBBackend(conn)
+        all_store_timezones = backend.get_all_store_timezones()
+        assert {store_id: all_store_timezones[store_id] for store_id in timezones} == timezones
+        # statuses after end_time are left out, as ingested after the report was triggered
+        for end_time in (data.end_time, data.end_time - timedelta(hours=5, minutes=13)):
+            report = io.StringIO()
+            store_count = write_report_rows_backend(backend, csv.writer(report), end_time)
+            assert store_count == len(data.stores)
+            rows = [[int(value) for value in row] for row in csv.reader(io.StringIO(report.getvalue()))]
+            assert rows == expected_report_rows(statuses, timezones, all_store_hours, end_time)
+    finally:
+        conn.close()
@@ -0,0 +1,112 @@
+"""``download_file`` against a local aiohttp server"""
+import asyncio
+import hashlib
+import json
+from typing import Callable, List, Tuple
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stor.data.get_data import download_file
+
+BODY = b'store_id,status,timestamp_utc\n' + b''.join(
+    f'{store_id},active,2023-01-25 18:13:22.47922 UTC\n'.encode() for store_id in range(1000)
+)
+ETAG = '"v1"'
+
+
+def serve(handler: Callable[[web.Request], web.Response], tmp_path, **kwargs) -> Tuple[bool, List[web.Request]]:
+    """Run download_file against handler, returns whether the file changed and the requests made"""
+    requests = []
+
+    async def record(request: web.Request) -> web.Response:
+        requests.append(request)
+        return handler(request)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/store_status', record)
+        async with TestServer(app) as server:
+            return await download_file(str(server.make_url('/store_status')), 'store_status', directory=tmp_path, **kwargs)
+
+    return asyncio.run(run()), requests
+
+
+def full(request: web.Request) -> web.Response:
+    if request.headers.get('If-None-Match') == ETAG:
+        return web.Response(status=304)
+    return web.Response(body=BODY, headers={'ETag': ETAG})
+
+
+def ranged(start: int) -> Callable[[web.Request], web.Response]:
+    """Answer Range requests with the body from start, whatever the requested range"""
+    def handler(request: web.Request) -> web.Response:
+        if 'Range' not in request.headers:
+            return full(request)
+        return web.Response(
+            status=206,
+            body=BODY[start:],
+            headers={'ETag': ETAG, 'Content-Range': f'bytes {start}-{len(BODY) - 1}/{len(BODY)}'}
+        )
+    return handler
+
+
+def write_part(tmp_path, size: int):
+    (tmp_path / 'store_status.csv.part').write_bytes(BODY[:size])
+    (tmp_path / 'store_status.csv.part.meta.json').write_text(json.dumps({'etag': ETAG, 'last_modified': None}))
+
+
+def assert_downloaded(tmp_path):
+    assert (tmp_path / 'store_status.csv').read_bytes() == BODY
+    meta = json.loads((tmp_path / 'store_status.csv.meta.json').read_text())
+    assert meta == {'etag': ETAG, 'last_modified': None, 'sha256': hashlib.sha256(BODY).hexdigest()}
+    assert not (tmp_path / 'store_status.csv.part').exists()
+    assert not (tmp_path / 'store_status.csv.part.meta.json').exists()
+
+
+def test_download(tmp_path):
+    changed, requests = serve(full, tmp_path)
+    assert changed
+    assert len(requests) == 1 and 'Range' not in requests[0].headers
+    assert_downloaded(tmp_path)
+
+
+def test_not_modified(tmp_path):
+    serve(full, tmp_path)
+    changed, requests = serve(full, tmp_path, overwrite=True)
+    assert not changed
+    assert requests[0].headers['If-None-Match'] == ETAG
+    assert_downloaded(tmp_path)
+
+
+def test_resume(tmp_path):
+    write_part(tmp_path, 1000)
+    changed, requests = serve(ranged(1000), tmp_path)
+    assert changed
+    assert len(requests) == 1
+    assert requests[0].headers['Range'] == 'bytes=1000-'
+    assert requests[0].headers['If-Range'] == ETAG
+    assert_downloaded(tmp_path)
+
+
+@pytest.mark.parametrize('start', [0, 500, 1500])
+def test_partial_content_from_another_byte(tmp_path, start):
+    write_part(tmp_path, 1000)
+    changed, requests = serve(ranged(start), tmp_path)
+    assert changed
+    assert len(requests) == 2
+    assert 'Range' not in requests[1].headers and 'If-Range' not in requests[1].headers
+    assert_downloaded(tmp_path)
+
+
+def test_partial_content_without_range(tmp_path):
+    serve(full, tmp_path)
+
+    def partial(request: web.Request) -> web.Response:
+        return web.Response(status=206, body=BODY[:100], headers={'Content-Range': f'bytes 0-99/{len(BODY)}'})
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        serve(partial, tmp_path, overwrite=True)
+    assert_downloaded(tmp_path)
@@ -0,0 +1,31 @@
+"""store_status loaded by one process and by INGEST_WORKERS processes, needs the database of DB_* in the environment"""
+from pathlib import Path
+
+from stor import config
+from stor.db import populate_store_status
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'store_status_clean.csv'
+
+
+def load(monkeypatch, database_schema, schema: str, ingest_workers: int) -> tuple:
+    """Ingest FIXTURE into a new schema, returns the store_status rows and ingestion state"""
+    monkeypatch.setattr(config, 'INGEST_WORKERS', ingest_workers)
+    with database_schema(schema) as conn:
+        first_new_status = populate_store_status(conn, FIXTURE)
+        with conn.cursor() as cur:
+            cur.execute("SELECT store_id, status, timestamp_utc FROM store_status ORDER BY store_id, timestamp_utc")
+            rows = [tuple(row) for row in cur.fetchall()]
+            cur.execute("SELECT high_water_mark, fingerprint, row_count FROM ingestion_state")
+            state = [tuple(row) for row in cur.fetchall()]
+    return first_new_status, rows, state
+
+
+def test_parallel_load_matches_serial_load(monkeypatch, database_schema):
+    serial = load(monkeypatch, database_schema, 'stor_test_ingest_serial', 1)
+    parallel = load(monkeypatch, database_schema, 'stor_test_ingest_parallel', 4)
+    first_new_status, rows, state = serial
+    # every poll once, open if any report of it is
+    assert len(rows) == len({(store_id, timestamp_utc) for store_id, _, timestamp_utc in rows}) == 96
+    assert len(first_new_status) == 4
+    assert state[0][2] == 100
+    assert parallel == serial
@@ -0,0 +1,103 @@
+"""Incremental store_lifetime_totals against a full recompute, needs the database of DB_* in the environment"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from benchmarks.synthetic import SyntheticData
+from stor import config
+from stor.db import populate_menu_hours_table, populate_store_status, populate_time_zone_table
+from stor.db.functions import default_store_hours, get_max_timestamp
+from stor.db.lifetime import (
+    iter_store_lifetime_totals,
+    mark_store_lifetime_totals_stale,
+    refresh_store_lifetime_totals,
+    reset_store_lifetime_totals
+)
+from stor.report import StatusLogRow, calculate_relative_report_reference
+
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def write_store_status(file: Path, statuses: List[Tuple[int, bool, datetime]]):
+    with open(file, 'w') as f:
+        f.write('store_id,status,timestamp_utc\n')
+        for store_id, is_open, timestamp_utc in statuses:
+            f.write(f"{store_id},{int(is_open)},{timestamp_utc.strftime('%Y-%m-%d %H:%M:%S.%f')} UTC\n")
+
+
+def expected_totals(data: SyntheticData, statuses: List[Tuple[int, bool, datetime]], end_time: datetime) -> List[
+    Tuple[int, int, int]
+]:
+    """Uptime and downtime of every store from its first status to end_time, computed row by row"""
+    stores = {store.store_id: store for store in data.stores}
+    status_logs: Dict[int, List[StatusLogRow]] = {}
+    for store_id, is_open, timestamp_utc in sorted(statuses, key=lambda status: (status[0], status[2])):
+        timezone = stores[store_id].timezone or 'America/Chicago'
+        status_logs.setdefault(store_id, []).append(
+            StatusLogRow(store_id, is_open, timestamp_utc, timestamp_utc, timezone)
+        )
+    totals = []
+    for store_id, store_status in sorted(status_logs.items()):
+        store_hours = default_store_hours()
+        store_hours.update(stores[store_id].store_hours)
+        uptime, downtime = calculate_relative_report_reference(
+            store_status, store_hours, store_status[0].timestamp_utc, end_time
+        )
+        totals.append((store_id, uptime // ONE_MICROSECOND, downtime // ONE_MICROSECOND))
+    return totals
+
+
+def test_incremental_totals_match_full_recompute(tmp_path, monkeypatch, database_schema):
+    data = SyntheticData(30, days=3, poll_minutes=50, outage_rate=0.2, seed=5)
+    statuses = [
+        (store.store_id, is_open, timestamp_utc)
+        for store in data.stores
+        for is_open, timestamp_utc in data.statuses(store)
+    ]
+    checkpoint = data.end_time - timedelta(days=1)
+    late_store, new_store = data.stores[0].store_id, data.stores[1].store_id
+    late_status = [status for status in statuses if status[0] == late_store][10]
+    assert late_status[2] < checkpoint
+    first_batch = [
+        status for status in statuses
+        if status[2] <= checkpoint and status != late_status and status[0] != new_store
+    ]
+    data.write_time_zones(tmp_path / 'time_zone_info_clean.csv')
+    data.write_menu_hours(tmp_path / 'menu_hours_clean.csv')
+    write_store_status(tmp_path / 'first_batch.csv', first_batch)
+    write_store_status(tmp_path / 'second_batch.csv', statuses)
+
+    with database_schema('stor_test_lifetime_totals') as conn:
+        populate_time_zone_table(conn, tmp_path / 'time_zone_info_clean.csv')
+        populate_menu_hours_table(conn, tmp_path / 'menu_hours_clean.csv')
+
+        populate_store_status(conn, tmp_path / 'first_batch.csv')
+        first_end_time = get_max_timestamp(conn)
+        refresh_store_lifetime_totals(conn, first_end_time)
+        assert list(iter_store_lifetime_totals(conn, first_end_time)) == expected_totals(
+            data, first_batch, first_end_time
+        )
+
+        # a late status of a counted store and a store first seen with statuses before the checkpoint
+        first_new_status = populate_store_status(conn, tmp_path / 'second_batch.csv')
+        assert first_new_status[late_store] == late_status[2]
+        mark_store_lifetime_totals_stale(conn, first_new_status)
+        with conn.cursor() as cur:
+            cur.execute("SELECT store_id FROM store_lifetime_totals WHERE stale ORDER BY store_id")
+            assert [row[0] for row in cur.fetchall()] == sorted([late_store, new_store])
+
+        end_time = get_max_timestamp(conn)
+        refresh_store_lifetime_totals(conn, end_time)
+        expected = expected_totals(data, statuses, end_time)
+        assert list(iter_store_lifetime_totals(conn, end_time)) == expected
+
+        # with retention the statuses to count again may be gone, the totals are kept
+        monkeypatch.setattr(config, 'TIMESCALE_RETAIN_FOR', '30 days')
+        reset_store_lifetime_totals(conn)
+        assert list(iter_store_lifetime_totals(conn, end_time)) == expected
+
+        # counted from the first status again
+        monkeypatch.setattr(config, 'TIMESCALE_RETAIN_FOR', '')
+        reset_store_lifetime_totals(conn)
+        refresh_store_lifetime_totals(conn, end_time)
+        assert list(iter_store_lifetime_totals(conn, end_time)) == expected
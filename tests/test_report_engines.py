@@ -0,0 +1,70 @@
+"""Report engines against the python engine, needs the database of DB_* in the environment"""
+import csv
+import io
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from benchmarks.synthetic import SyntheticData
+from stor import config
+from stor.db import (
+    populate_menu_hours_table,
+    populate_store_status,
+    populate_time_zone_table,
+    refresh_store_status_hourly_summary
+)
+from stor.db.rollup import refresh_store_status_hourly
+from stor.report import write_report_rows_python, write_report_rows_rollup, write_report_rows_sql
+
+
+def report_rows(write_report_rows, conn, end_time: datetime) -> List[List[int]]:
+    report = io.StringIO()
+    write_report_rows(conn, csv.writer(report), end_time)
+    return sorted([int(value) for value in row] for row in csv.reader(io.StringIO(report.getvalue())))
+
+
+def end_times(data: SyntheticData) -> List[datetime]:
+    return [
+        data.end_time,
+        # every window starts between two polls, within an hour the rollup engine splits
+        data.end_time - timedelta(minutes=23),
+        # statuses after end_time are left out, as ingested after the report was triggered
+        data.end_time - timedelta(days=1, hours=5, minutes=41),
+    ]
+
+
+def load_synthetic_data(conn, data: SyntheticData, directory: Path):
+    data.write_csvs(directory)
+    populate_time_zone_table(conn, directory / 'time_zone_info_clean.csv')
+    populate_menu_hours_table(conn, directory / 'menu_hours_clean.csv')
+    populate_store_status(conn, directory / 'store_status_clean.csv')
+
+
+@pytest.mark.parametrize('continuous_aggregate', [False, True])
+def test_rollup_engine_matches_python_engine(tmp_path, monkeypatch, database_schema, continuous_aggregate):
+    monkeypatch.setattr(config, 'TIMESCALE_CONTINUOUS_AGGREGATE', continuous_aggregate)
+    data = SyntheticData(60, days=9, poll_minutes=50, outage_rate=0.2, seed=8)
+    # business, weekday and overnight hours leave statuses outside store hours
+    assert any(store.store_hours for store in data.stores)
+    with database_schema('stor_test_rollup_engine') as conn:
+        load_synthetic_data(conn, data, tmp_path)
+        refresh_store_status_hourly(conn)
+        refresh_store_status_hourly_summary(conn)
+        for end_time in end_times(data):
+            assert report_rows(write_report_rows_rollup, conn, end_time) == report_rows(
+                write_report_rows_python, conn, end_time
+            )
+
+
+def test_sql_engine_matches_python_engine(tmp_path, database_schema):
+    data = SyntheticData(60, days=9, poll_minutes=50, outage_rate=0.2, seed=9)
+    # business, weekday and overnight hours leave statuses outside store hours
+    assert any(store.store_hours for store in data.stores)
+    with database_schema('stor_test_sql_engine') as conn:
+        load_synthetic_data(conn, data, tmp_path)
+        for end_time in end_times(data):
+            assert report_rows(write_report_rows_sql, conn, end_time) == report_rows(
+                write_report_rows_python, conn, end_time
+            )
@@ -0,0 +1,105 @@
+"""The vectorized reports against the row by row ``calculate_relative_report_reference``"""
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Tuple
+
+import pytest
+
+from benchmarks.synthetic import SyntheticData
+from stor.db.functions import default_store_hours
+from stor.report import (
+    REPORT_WINDOWS,
+    StatusLogRow,
+    calculate_multi_window_report,
+    calculate_relative_report,
+    calculate_relative_report_reference
+)
+
+WINDOWS = [window for window, _ in REPORT_WINDOWS.values()]
+END_TIME = datetime(2023, 1, 25, 18, tzinfo=timezone.utc)
+
+
+def status_log(statuses: List[Tuple[bool, datetime]], timezone_str: str = 'America/Chicago') -> List[StatusLogRow]:
+    return [
+        StatusLogRow(1, is_open, timestamp_utc, timestamp_utc, timezone_str)
+        for is_open, timestamp_utc in statuses
+    ]
+
+
+def hourly(start_time: datetime, hours: int, closed_every: int = 3) -> List[Tuple[bool, datetime]]:
+    """A status every hour and 7 minutes, every closed_every-th of them closed"""
+    return [
+        (index % closed_every != 0, start_time + timedelta(hours=index, minutes=7 * index))
+        for index in range(hours)
+    ]
+
+
+def assert_equivalent(
+        store_status: List[StatusLogRow],
+        store_hours: Dict[int, Tuple[time, time]],
+        end_time: datetime = END_TIME
+):
+    expected = [
+        calculate_relative_report_reference(store_status, store_hours, end_time - window, end_time)
+        for window in WINDOWS
+    ]
+    assert [
+        calculate_relative_report(store_status, store_hours, end_time - window, end_time)
+        for window in WINDOWS
+    ] == expected
+    assert calculate_multi_window_report(store_status, store_hours, WINDOWS, end_time) == expected
+
+
+def test_empty_status_log():
+    assert_equivalent([], default_store_hours())
+    assert calculate_multi_window_report([], default_store_hours(), WINDOWS, END_TIME) == [
+        (timedelta(), timedelta())
+    ] * len(WINDOWS)
+
+
+@pytest.mark.parametrize('is_open', [True, False])
+def test_single_status(is_open):
+    assert_equivalent(status_log([(is_open, END_TIME - timedelta(minutes=20))]), default_store_hours())
+    # older than every window
+    assert_equivalent(status_log([(is_open, END_TIME - timedelta(days=8))]), default_store_hours())
+
+
+def test_window_starts_between_statuses():
+    store_status = status_log(hourly(END_TIME - timedelta(days=8, minutes=13), 8 * 20))
+    # the first status of every window is well after the window starts
+    for window in WINDOWS:
+        start_time = END_TIME - window
+        assert not any(row.timestamp_utc == start_time for row in store_status)
+    assert_equivalent(store_status, default_store_hours())
+
+
+def test_store_hours_ending_before_they_start():
+    store_hours = default_store_hours()
+    store_hours.update({day: (time(18), time(2)) for day in range(0, 7, 2)})
+    store_hours[1] = (time(9), time(17))
+    assert_equivalent(status_log(hourly(END_TIME - timedelta(days=8), 8 * 20)), store_hours)
+
+
+@pytest.mark.parametrize('timezone_str', ['America/Chicago', 'America/New_York', 'Europe/London'])
+def test_daylight_saving_time_change(timezone_str):
+    # clocks go forward on 2023-03-12 in America and on 2023-03-26 in Europe
+    store_hours = default_store_hours()
+    store_hours.update({day: (time(1, 30), time(3, 30)) for day in range(7)})
+    for end_time in (datetime(2023, 3, 12, 12, tzinfo=timezone.utc), datetime(2023, 3, 26, 12, tzinfo=timezone.utc)):
+        statuses = [
+            (index % 4 != 0, end_time - timedelta(days=8) + timedelta(minutes=20 * index))
+            for index in range(8 * 24 * 3)
+        ]
+        assert_equivalent(status_log(statuses, timezone_str), store_hours, end_time)
+        assert_equivalent(status_log(statuses, timezone_str), default_store_hours(), end_time)
+
+
+def test_synthetic_stores():
+    data = SyntheticData(200, days=8, poll_minutes=45, outage_rate=0.2, seed=4)
+    for store in data.stores:
+        store_hours = default_store_hours()
+        store_hours.update(store.store_hours)
+        store_status = [
+            StatusLogRow(store.store_id, is_open, timestamp_utc, timestamp_utc, store.timezone or 'America/Chicago')
+            for is_open, timestamp_utc in data.statuses(store)
+        ]
+        assert_equivalent(store_status, store_hours, data.end_time)